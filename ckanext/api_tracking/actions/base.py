@@ -1,6 +1,8 @@
 import logging
 from ckan.plugins import toolkit
-from ckanext.api_tracking.models import TrackingUsage
+from ckanext.api_tracking.models import TrackingErasure, TrackingUsage
+from ckanext.api_tracking.owners import get_owner_resolver
+from ckanext.api_tracking.queries.erasure import FIELDS, MODES, get_erase_settings, run_erasure, start_erasure
 
 
 log = logging.getLogger(__name__)
@@ -26,6 +28,11 @@ def tracking_usage_create(context, data_dict):
         if not logout_enabled:
             return None
 
+    # Dataset and organization of the object, for the reports by dataset or organization
+    resolver = get_owner_resolver()
+    if resolver is not None:
+        data_dict = resolver.add_owners(dict(data_dict))
+
     tu = TrackingUsage(
             user_id=data_dict.get('user_id'),
             extras=data_dict.get('extras'),
@@ -34,7 +41,58 @@ def tracking_usage_create(context, data_dict):
             token_name=data_dict.get('token_name'),
             object_type=data_dict.get('object_type'),
             object_id=data_dict.get('object_id'),
+            count=data_dict.get('count') or 1,
+            last_timestamp=data_dict.get('last_timestamp'),
+            duration_ms=data_dict.get('duration_ms'),
+            status_code=data_dict.get('status_code'),
+            response_bytes=data_dict.get('response_bytes'),
+            package_id=data_dict.get('package_id'),
+            owner_org=data_dict.get('owner_org'),
         )
+    # Coalesced events keep the time of the first one
+    if data_dict.get('timestamp'):
+        tu.timestamp = data_dict['timestamp']
     tu.save()
 
     return tu.dictize()
+
+
+def tracking_usage_erase(context, data_dict):
+    """ Erase (or pseudonymise) the tracking history of a user or an API token
+        The rows are changed in batches by a background job. Calling it again continues an unfinished erasure
+        Params in data_dict:
+            user_id or token_name: the user ID or the API token name
+            mode: erase (delete the rows, default) or pseudonymize (replace the user ID or token name)
+        Returns the erasure, see tracking_usage_erasure_show for its progress
+    """
+    toolkit.check_access('tracking_usage_erase', context, data_dict)
+    fields = [field for field in FIELDS if data_dict.get(field)]
+    if len(fields) != 1:
+        raise toolkit.ValidationError({'user_id': ['Define user_id or token_name']})
+    mode = data_dict.get('mode', 'erase')
+    if mode not in MODES:
+        raise toolkit.ValidationError({'mode': [f'Must be one of: {", ".join(MODES)}']})
+    field = fields[0]
+    erasure = start_erasure(field, data_dict[field], mode=mode)
+    # The job reads the value from the erasure (it is removed once done), RQ keeps the job arguments
+    toolkit.enqueue_job(
+        run_erasure,
+        [erasure.id],
+        kwargs=get_erase_settings(),
+        title=f'Tracking erasure {erasure.id}',
+        rq_kwargs={'timeout': 24 * 3600},
+    )
+    return erasure.dictize()
+
+
+@toolkit.side_effect_free
+def tracking_usage_erasure_show(context, data_dict):
+    """ Progress of an erasure
+        Params in data_dict:
+            id: erasure ID
+    """
+    toolkit.check_access('tracking_usage_erasure_show', context, data_dict)
+    erasure = TrackingErasure.get(data_dict.get('id')) if data_dict.get('id') else None
+    if erasure is None:
+        raise toolkit.ObjectNotFound('Erasure not found')
+    return erasure.dictize()
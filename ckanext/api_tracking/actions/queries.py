@@ -1,37 +1,74 @@
+from ckan import model
 from ckan.plugins import toolkit
+from ckanext.api_tracking.decorators import narrow_range_on_timeout
 from ckanext.api_tracking.queries.api import (
     get_all_token_usage,
     get_most_accessed_dataset_with_token,
+    get_most_accessed_organization_with_token,
     get_most_accessed_resource_with_token,
     get_most_accessed_token,
 )
+from ckanext.api_tracking.queries.changes import get_changes
+from ckanext.api_tracking.queries.latency import DIMENSIONS, get_latency_percentiles
 from ckanext.api_tracking.queries.users import users_active_metrics
 
 
+def _get_object_id(model_class, value):
+    """ ID of a dataset or organization from its ID or name """
+    if not value:
+        return None
+    obj = model_class.get(value)
+    if not obj:
+        raise toolkit.ObjectNotFound(f'Not found: {value}')
+    return obj.id
+
+
 @toolkit.side_effect_free
+@narrow_range_on_timeout
 def most_accessed_dataset_with_token(context, data_dict):
     """ Get most accessed datasets with token
         Params in data_dict:
             limit: int, default 10
-
+            owner_org: organization ID or name, optional
     """
     toolkit.check_access('most_accessed_dataset_with_token', context, data_dict)
     data = get_most_accessed_dataset_with_token(
-        limit=data_dict.get('limit', 10)
+        limit=data_dict.get('limit', 10),
+        owner_org=_get_object_id(model.Group, data_dict.get('owner_org')),
     )
 
     return data
 
 
 @toolkit.side_effect_free
+@narrow_range_on_timeout
 def most_accessed_resource_with_token(context, data_dict):
     """ Get most accessed resource with token
         Params in data_dict:
             limit: int, default 10
-
+            package_id: dataset ID or name, optional
+            owner_org: organization ID or name, optional
     """
     toolkit.check_access('most_accessed_resource_with_token', context, data_dict)
     data = get_most_accessed_resource_with_token(
+        limit=data_dict.get('limit', 10),
+        package_id=_get_object_id(model.Package, data_dict.get('package_id')),
+        owner_org=_get_object_id(model.Group, data_dict.get('owner_org')),
+    )
+
+    return data
+
+
+@toolkit.side_effect_free
+@narrow_range_on_timeout
+def most_accessed_organization_with_token(context, data_dict):
+    """ Get most accessed organizations with token
+        Requests to the organization, its datasets and its resources
+        Params in data_dict:
+            limit: int, default 10
+    """
+    toolkit.check_access('most_accessed_organization_with_token', context, data_dict)
+    data = get_most_accessed_organization_with_token(
         limit=data_dict.get('limit', 10)
     )
 
@@ -39,20 +76,27 @@ def most_accessed_resource_with_token(context, data_dict):
 
 
 @toolkit.side_effect_free
+@narrow_range_on_timeout
 def most_accessed_token(context, data_dict):
     """ Get most accessed token
         Params in data_dict:
             limit: int, default 10
+            order_by: total (requests, default) or response_bytes (data sent)
     """
     toolkit.check_access('most_accessed_token', context, data_dict)
+    order_by = data_dict.get('order_by', 'total')
+    if order_by not in ('total', 'response_bytes'):
+        raise toolkit.ValidationError({'order_by': ['Must be one of: total, response_bytes']})
     data = get_most_accessed_token(
-        limit=data_dict.get('limit', 10)
+        limit=data_dict.get('limit', 10),
+        order_by=order_by,
     )
 
     return data
 
 
 @toolkit.side_effect_free
+@narrow_range_on_timeout
 def all_token_usage(context, data_dict):
     """ Get all token usage
         Params in data_dict:
@@ -67,6 +111,7 @@ def all_token_usage(context, data_dict):
 
 
 @toolkit.side_effect_free
+@narrow_range_on_timeout
 def get_users_active_metrics(context, data_dict):
     """ Get users active metrics
         Params in data_dict:
@@ -78,3 +123,47 @@ def get_users_active_metrics(context, data_dict):
     )
 
     return data
+
+
+@toolkit.side_effect_free
+@narrow_range_on_timeout
+def latency_percentiles(context, data_dict):
+    """ Get the latency percentiles (p50, p95 and p99 in ms) of the tracked requests
+        Params in data_dict:
+            dimension: action (default), token or dataset
+            days: int, default 30
+            limit: int, default 20
+    """
+    toolkit.check_access('latency_percentiles', context, data_dict)
+    dimension = data_dict.get('dimension', 'action')
+    if dimension not in DIMENSIONS:
+        raise toolkit.ValidationError({'dimension': [f'Must be one of: {", ".join(DIMENSIONS)}']})
+    data = get_latency_percentiles(
+        dimension=dimension,
+        days=toolkit.asint(data_dict.get('days', 30)),
+        limit=toolkit.asint(data_dict.get('limit', 20)),
+    )
+
+    return data
+
+
+@toolkit.side_effect_free
+@narrow_range_on_timeout
+def tracking_usage_changes(context, data_dict):
+    """ Get the tracking rows written after a cursor, oldest first (for incremental ETL)
+        Params in data_dict:
+            cursor: the cursor returned by the previous call, empty to start from the first row
+            limit: int, default ckanext.api_tracking.changes_page_size (1000)
+        Returns results (each row with its cursor), cursor (to resume) and has_more
+    """
+    toolkit.check_access('tracking_usage_changes', context, data_dict)
+    try:
+        limit = toolkit.asint(data_dict['limit']) if data_dict.get('limit') else None
+    except ValueError:
+        raise toolkit.ValidationError({'limit': ['Must be an integer']})
+    try:
+        data = get_changes(cursor=data_dict.get('cursor'), limit=limit)
+    except ValueError as e:
+        raise toolkit.ValidationError({'cursor': [str(e)]})
+
+    return data
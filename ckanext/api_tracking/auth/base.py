@@ -1,2 +1,10 @@
 def tracking_usage_create(context, data_dict):
     return {'success': False}
+
+
+def tracking_usage_erase(context, data_dict):
+    return {'success': False}
+
+
+def tracking_usage_erasure_show(context, data_dict):
+    return {'success': False}
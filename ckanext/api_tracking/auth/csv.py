@@ -6,6 +6,10 @@ def most_accessed_resource_with_token_csv(context, data_dict):
     return {'success': False}
 
 
+def most_accessed_organization_with_token_csv(context, data_dict):
+    return {'success': False}
+
+
 def most_accessed_token_csv(context, data_dict):
     return {'success': False}
 
@@ -6,6 +6,10 @@ def most_accessed_resource_with_token(context, data_dict={}):
     return {'success': False}
 
 
+def most_accessed_organization_with_token(context, data_dict={}):
+    return {'success': False}
+
+
 def most_accessed_token(context, data_dict):
     return {'success': False}
 
@@ -16,3 +20,15 @@ def all_token_usage(context, data_dict):
 
 def users_active_metrics(context, data_dict):
     return {'success': False}
+
+
+def latency_percentiles(context, data_dict):
+    return {'success': False}
+
+
+def tracking_usage_changes(context, data_dict):
+    return {'success': False}
+
+
+def tracking_usage_export(context, data_dict):
+    return {'success': False}
@@ -1,4 +1,5 @@
 # flake8: noqa: F401
 
 from ckanext.api_tracking.blueprints.csv import tracking_csv_blueprint
-from ckanext.api_tracking.blueprints.dashboard import tracking_dashboard_blueprint
\ No newline at end of file
+from ckanext.api_tracking.blueprints.dashboard import tracking_dashboard_blueprint
+from ckanext.api_tracking.blueprints.export import tracking_export_blueprint
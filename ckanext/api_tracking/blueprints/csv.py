@@ -6,10 +6,12 @@ from flask import Blueprint, Response
 from ckan.common import current_user
 from ckan.plugins import toolkit
 
+from ckanext.api_tracking.guardrails import QueryTimeout
 from ckanext.api_tracking.queries.data import (
     all_token_usage_data,
     most_accessed_token_data,
     most_accessed_dataset_with_token_data,
+    most_accessed_organization_with_token_data,
     most_accessed_resource_with_token_data,
     users_active_metrics_dict,
 )
@@ -19,6 +21,20 @@ log = logging.getLogger(__name__)
 tracking_csv_blueprint = Blueprint('tracking_csv', __name__, url_prefix='/tracking-csv')
 
 
+@tracking_csv_blueprint.errorhandler(QueryTimeout)
+def query_timeout(error):
+    """ A report query took too long (see ckanext.api_tracking.guardrails) """
+    message = toolkit._('This query took too long. Try a narrower range (a shorter period or fewer results).')
+    return Response(message, status=503, mimetype='text/plain')
+
+
+@tracking_csv_blueprint.errorhandler(toolkit.ValidationError)
+def validation_error(error):
+    """ Invalid parameters (e.g. a limit that is not an integer) """
+    message = '; '.join(f'{field}: {text}' for field, text in error.error_summary.items())
+    return Response(message, status=400, mimetype='text/plain')
+
+
 def _csv_response(auth_fn, data_fn, kwargs, filename):
     """ general CSV response from data_fn(**kwargs) checking access with auth_fn """
     current_user_name = current_user.name if current_user else None
@@ -66,6 +82,18 @@ def most_accessed_resource_with_token_csv():
     )
 
 
+@tracking_csv_blueprint.route('/most-accessed-organization-with-token.csv', methods=["GET"])
+def most_accessed_organization_with_token_csv():
+    """ Get most accessed (using a API token) organizations """
+
+    return _csv_response(
+        'most_accessed_organization_with_token_csv',
+        most_accessed_organization_with_token_data,
+        {'limit': 10},
+        'most-accessed-organization-with-token.csv',
+    )
+
+
 @tracking_csv_blueprint.route('/most-accessed-token.csv', methods=["GET"])
 def most_accessed_token_csv():
     """ Get most accessed tokens """
@@ -1,17 +1,61 @@
 import logging
-from flask import Blueprint
+from flask import Blueprint, Response, jsonify
+from ckan import model
 from ckan.plugins import toolkit
 from ckanext.stats import stats as stats_lib
-from ckanext.api_tracking.dashboard.stats import get_dataset_views, get_unique_dataset_views, get_resource_downloads
-from ckanext.api_tracking.dashboard.stats_api import get_api_token_usage_aggregated, get_latest_api_token_usage
+from ckanext.api_tracking.dashboard.stats import (
+    get_dataset_usage,
+    get_dataset_views,
+    get_organization_usage,
+    get_resource_downloads,
+    get_unique_dataset_views,
+    get_views_freshness,
+)
+from ckanext.api_tracking.dashboard.stats_api import (
+    get_api_token_usage_aggregated,
+    get_latency_stats,
+    get_latest_api_token_usage,
+)
 from ckanext.api_tracking.dashboard.users import get_users_active_metrics
 from ckanext.api_tracking.decorators import require_sysadmin_user
+from ckanext.api_tracking.guardrails import QueryTimeout
+from ckanext.api_tracking.metrics import registry
+from ckanext.api_tracking.persistence import health_summary
+from ckanext.api_tracking.queries.views import (
+    DATASET_VIEWS,
+    RESOURCE_DOWNLOADS,
+    TOKEN_USAGE_BY_OBJECT,
+    UNIQUE_DATASET_VIEWS,
+    get_freshness,
+)
+from ckanext.api_tracking.query_stats import get_slow_query_threshold, registry as query_stats_registry
 
 
 log = logging.getLogger(__name__)
 tracking_dashboard_blueprint = Blueprint('tracking_dashboard', __name__, url_prefix='/tracking-dashboard')
 
 
+@tracking_dashboard_blueprint.errorhandler(QueryTimeout)
+def query_timeout(error):
+    """ A dashboard query took too long (see ckanext.api_tracking.guardrails) """
+    return toolkit.render('dashboard/timeout.html', {'active': None}), 503
+
+
+@tracking_dashboard_blueprint.errorhandler(toolkit.ValidationError)
+def validation_error(error):
+    """ Invalid parameters (e.g. a limit that is not an integer) """
+    message = '; '.join(f'{field}: {text}' for field, text in error.error_summary.items())
+    return Response(message, status=400, mimetype='text/plain')
+
+
+def _panel(function, **kwargs):
+    """ Results of a dashboard panel or None if its query timed out (the other panels are still shown) """
+    try:
+        return function(**kwargs)
+    except QueryTimeout:
+        return None
+
+
 # The default view for the dashboard is /dataset-views
 @tracking_dashboard_blueprint.route('/')
 @require_sysadmin_user
@@ -23,9 +67,10 @@ def index():
 @require_sysadmin_user
 def dataset_unique_views():
     extra_vars = {
-        'dataset_views_365': get_unique_dataset_views(days_ago=365),
-        'dataset_views_30': get_unique_dataset_views(days_ago=30),
-        'dataset_views_7': get_unique_dataset_views(days_ago=7),
+        'dataset_views_365': _panel(get_unique_dataset_views, days_ago=365),
+        'dataset_views_30': _panel(get_unique_dataset_views, days_ago=30),
+        'dataset_views_7': _panel(get_unique_dataset_views, days_ago=7),
+        'freshness': get_views_freshness(UNIQUE_DATASET_VIEWS),
         'active': 'dataset-unique-views',
     }
     return toolkit.render('dashboard/dataset-unique-views.html', extra_vars)
@@ -35,9 +80,10 @@ def dataset_unique_views():
 @require_sysadmin_user
 def dataset_views():
     extra_vars = {
-        'dataset_views_365': get_dataset_views(days_ago=365),
-        'dataset_views_30': get_dataset_views(days_ago=30),
-        'dataset_views_7': get_dataset_views(days_ago=7),
+        'dataset_views_365': _panel(get_dataset_views, days_ago=365),
+        'dataset_views_30': _panel(get_dataset_views, days_ago=30),
+        'dataset_views_7': _panel(get_dataset_views, days_ago=7),
+        'freshness': get_views_freshness(DATASET_VIEWS),
         'active': 'dataset-views',
     }
     return toolkit.render('dashboard/dataset-views.html', extra_vars)
@@ -47,14 +93,49 @@ def dataset_views():
 @require_sysadmin_user
 def resource_downloads():
     extra_vars = {
-        'resource_downloads_365': get_resource_downloads(days_ago=365),
-        'resource_downloads_30': get_resource_downloads(days_ago=30),
-        'resource_downloads_7': get_resource_downloads(days_ago=7),
+        'resource_downloads_365': _panel(get_resource_downloads, days_ago=365),
+        'resource_downloads_30': _panel(get_resource_downloads, days_ago=30),
+        'resource_downloads_7': _panel(get_resource_downloads, days_ago=7),
+        'freshness': get_views_freshness(RESOURCE_DOWNLOADS),
         'active': 'resource-downloads',
     }
     return toolkit.render('dashboard/resource-downloads.html', extra_vars)
 
 
+@tracking_dashboard_blueprint.route('/dataset-usage/<package_id>')
+@require_sysadmin_user
+def dataset_usage(package_id):
+    """ Usage of a single dataset """
+    package = model.Package.get(package_id)
+    if not package:
+        return toolkit.abort(404, toolkit._('Dataset not found'))
+    extra_vars = {
+        'package': package,
+        'usage_7': get_dataset_usage(package.id, days_ago=7),
+        'usage_30': get_dataset_usage(package.id, days_ago=30),
+        'usage_365': get_dataset_usage(package.id, days_ago=365),
+        'active': 'dataset-unique-views',
+    }
+    return toolkit.render('dashboard/dataset-usage.html', extra_vars)
+
+
+@tracking_dashboard_blueprint.route('/organization-usage/<org_id>')
+@require_sysadmin_user
+def organization_usage(org_id):
+    """ Usage of the datasets of an organization """
+    organization = model.Group.get(org_id)
+    if not organization or not organization.is_organization:
+        return toolkit.abort(404, toolkit._('Organization not found'))
+    extra_vars = {
+        'organization': organization,
+        'usage_7': get_organization_usage(organization.id, days_ago=7),
+        'usage_30': get_organization_usage(organization.id, days_ago=30),
+        'usage_365': get_organization_usage(organization.id, days_ago=365),
+        'active': 'api-aggregated',
+    }
+    return toolkit.render('dashboard/organization-usage.html', extra_vars)
+
+
 @tracking_dashboard_blueprint.route('/total-datasets')
 @require_sysadmin_user
 def total_datasets():
@@ -127,7 +208,9 @@ def api_token_usage_aggregated():
     extra_vars = {
         'by_dataset': usage['by_dataset'],
         'by_resource': usage['by_resource'],
+        'by_organization': usage['by_organization'],
         'by_token_name': usage['by_token_name'],
+        'freshness': get_freshness(TOKEN_USAGE_BY_OBJECT),
         'active': 'api-aggregated',
         'links': usage['links'],
     }
@@ -143,8 +226,52 @@ def users_active_metrics():
     users_active = get_users_active_metrics(limit=30)
     extra_vars = {
         'users_active': users_active['records'],
+        'unique_users': users_active['unique_users'],
         'active': 'users-active-metrics',
         'links': users_active['links'],
         'tracking_login_enabled': tracking_login_enabled,
     }
     return toolkit.render('dashboard/users-active-metrics.html', extra_vars)
+
+
+@tracking_dashboard_blueprint.route('/latency')
+@require_sysadmin_user
+def latency():
+    """ Show the latency percentiles of the tracked requests """
+    days = 30
+    stats = get_latency_stats(days=days, limit=20)
+    extra_vars = {
+        'by_action': stats['by_action'],
+        'by_token': stats['by_token'],
+        'by_dataset': stats['by_dataset'],
+        'days': days,
+        'active': 'latency',
+        'links': stats['links'],
+    }
+    return toolkit.render('dashboard/latency.html', extra_vars)
+
+
+@tracking_dashboard_blueprint.route('/query-stats')
+@require_sysadmin_user
+def query_stats():
+    """ Show the latency of the dashboard and report queries (for this worker) """
+    extra_vars = {
+        'queries': query_stats_registry.summary(),
+        'slow_query_ms': get_slow_query_threshold(),
+        'active': 'query-stats',
+    }
+    return toolkit.render('dashboard/query-stats.html', extra_vars)
+
+
+@tracking_dashboard_blueprint.route('/metrics')
+@require_sysadmin_user
+def metrics():
+    """ Tracking pipeline metrics (for this worker) in Prometheus text format """
+    return Response(registry.render_prometheus(), mimetype='text/plain; version=0.0.4')
+
+
+@tracking_dashboard_blueprint.route('/health')
+@require_sysadmin_user
+def health():
+    """ Tracking pipeline health summary (for this worker) """
+    return jsonify(health_summary())
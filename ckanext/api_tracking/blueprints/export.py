@@ -0,0 +1,89 @@
+import json
+import logging
+from datetime import date, datetime, timedelta
+
+from flask import Blueprint, Response, send_file, stream_with_context
+from ckan.common import current_user
+from ckan.plugins import toolkit
+from sqlalchemy.exc import SQLAlchemyError
+
+from ckanext.api_tracking.guardrails import QueryTimeout
+from ckanext.api_tracking.queries import export
+from ckanext.api_tracking.queries.changes import parse_cursor, stream_changes
+
+
+log = logging.getLogger(__name__)
+tracking_export_blueprint = Blueprint('tracking_export', __name__, url_prefix='/tracking-export')
+
+
+def _check_access(auth_fn):
+    current_user_name = current_user.name if current_user else None
+    toolkit.check_access(auth_fn, {'user': current_user_name})
+
+
+@tracking_export_blueprint.route('/changes.ndjson', methods=["GET"])
+def tracking_usage_changes_ndjson():
+    """ Stream the tracking rows written after a cursor (one JSON object per line, each with its cursor)
+        Params: cursor (empty to start from the first row), limit (max rows, default
+        ckanext.api_tracking.changes_stream_limit = 100000). Continue from the cursor of the last row
+    """
+    _check_access('tracking_usage_changes')
+    cursor = toolkit.request.args.get('cursor')
+    try:
+        parse_cursor(cursor)
+        limit = toolkit.asint(
+            toolkit.request.args.get('limit') or toolkit.config.get('ckanext.api_tracking.changes_stream_limit', 100000)
+        )
+    except ValueError as e:
+        return Response(str(e), status=400, mimetype='text/plain')
+
+    def generate():
+        try:
+            for change in stream_changes(cursor=cursor, max_rows=limit):
+                yield json.dumps(change) + '\n'
+        except QueryTimeout as e:
+            # Rows already sent are complete, the client continues from the last cursor
+            log.warning(f'Change feed stopped: {e}')
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+
+def _parse_day(value, default):
+    return datetime.strptime(value, '%Y-%m-%d').date() if value else default
+
+
+@tracking_export_blueprint.route('/tracking-usage.parquet', methods=["GET"])
+def tracking_usage_parquet():
+    """ Parquet file with the tracking rows of a time range, sent once it is complete
+        Params: since (YYYY-MM-DD, default 30 days ago), until (YYYY-MM-DD excluded, default tomorrow)
+        The range is limited to ckanext.api_tracking.export_max_days (default 31)
+    """
+    _check_access('tracking_usage_export')
+    if not export.available():
+        return Response('The Parquet export requires pyarrow', status=501, mimetype='text/plain')
+    try:
+        until = _parse_day(toolkit.request.args.get('until'), date.today() + timedelta(days=1))
+        since = _parse_day(toolkit.request.args.get('since'), until - timedelta(days=30))
+    except ValueError:
+        return Response('Invalid date, use YYYY-MM-DD', status=400, mimetype='text/plain')
+    try:
+        export.check_range(since, until)
+    except ValueError as e:
+        return Response(str(e), status=400, mimetype='text/plain')
+
+    try:
+        parquet, total = export.export_to_temporary_file(since, until, query_class='report')
+    except QueryTimeout as e:
+        log.warning(f'Parquet export {since} - {until} stopped: {e}')
+        return Response(f'{e}, use a shorter range', status=503, mimetype='text/plain')
+    except SQLAlchemyError:
+        log.exception(f'Parquet export {since} - {until} failed')
+        return Response('The export failed, try again later', status=503, mimetype='text/plain')
+    log.info(f'Parquet export {since} - {until}: {total} rows')
+    # The temporary file is closed (and deleted) once sent
+    return send_file(
+        parquet,
+        mimetype='application/vnd.apache.parquet',
+        as_attachment=True,
+        download_name=f'tracking-usage-{since}-{until}.parquet',
+    )
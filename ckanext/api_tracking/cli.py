@@ -0,0 +1,204 @@
+import logging
+import signal
+from datetime import timedelta
+import threading
+
+import click
+from ckan.plugins import toolkit
+
+from ckanext.api_tracking.collector import Collector
+from ckanext.api_tracking.persistence import bulk_save_tracking_usage, flush_shared_counters
+from ckanext.api_tracking.profiling import merge_profiles, summarize
+from ckanext.api_tracking.queries.archive import archive_tracking_usage, parse_age, restore_tracking_usage
+from ckanext.api_tracking.queries.erasure import run_erasure, start_erasure
+from ckanext.api_tracking.queries.export import available as export_available, export_tracking_usage
+from ckanext.api_tracking.queries.ingest import ingest_tracking_raw
+from ckanext.api_tracking.queries.latency import refresh_latency_rollups
+from ckanext.api_tracking.queries.owners import backfill_owners
+from ckanext.api_tracking.queries.sketches import build_sketches
+from ckanext.api_tracking.queries.views import VIEWS, refresh_views
+
+
+log = logging.getLogger(__name__)
+
+
+@click.group(name='api-tracking', short_help='API tracking commands')
+def api_tracking():
+    pass
+
+
+@api_tracking.command()
+@click.option('--address', default=None, help='udp://HOST:PORT or unix:///PATH (default: ckanext.api_tracking.collector_address)')
+@click.option('--batch-size', default=1000, show_default=True, help='Max events per write')
+@click.option('--flush-interval', default=5, show_default=True, help='Max seconds between writes')
+def collector(address, batch_size, flush_interval):
+    """ Receive tracking events from the web workers and write them in batches """
+    address = address or toolkit.config.get('ckanext.api_tracking.collector_address')
+    if not address:
+        raise click.UsageError('Define --address or ckanext.api_tracking.collector_address')
+
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *args: stop.set())
+
+    server = Collector(address, bulk_save_tracking_usage, batch_size=batch_size, flush_interval=flush_interval)
+    click.secho(f'Collecting tracking events at {address}', fg='green')
+    try:
+        server.serve_forever(stop=stop)
+    except KeyboardInterrupt:
+        pass
+    click.secho('Collector stopped', fg='green')
+
+
+@api_tracking.command(name='flush-counters')
+def flush_counters():
+    """ Save the shared counters now (from cron or before stopping the workers) """
+    if not toolkit.config.get('ckanext.api_tracking.shared_counters_path'):
+        raise click.UsageError('Shared counters are not enabled (ckanext.api_tracking.shared_counters_path)')
+    saved = flush_shared_counters(force=True)
+    click.secho(f'{len(saved)} shared counters saved', fg='green')
+
+
+@api_tracking.command(name='rollup-latency')
+@click.option('--days', default=2, show_default=True, help='Days to rebuild (today included)')
+def rollup_latency(days):
+    """ Rebuild the daily latency histograms used for the p50/p95/p99 reports """
+    since = refresh_latency_rollups(days=days)
+    click.secho(f'Latency rollups refreshed since {since}', fg='green')
+
+
+@api_tracking.command(name='profile-report')
+@click.argument('directory', required=False)
+@click.option('--sort', default='cumulative', show_default=True, help='pstats sort key (cumulative, tottime, calls...)')
+@click.option('--limit', default=30, show_default=True, help='Number of functions to show')
+@click.option('--output', default=None, help='Also save the merged stats to this pstats file')
+def profile_report(directory, sort, limit, output):
+    """ Merge and summarise the tracking profiles (default: ckanext.api_tracking.profile_dir) """
+    directory = directory or toolkit.config.get('ckanext.api_tracking.profile_dir')
+    if not directory:
+        raise click.UsageError('Define DIRECTORY or ckanext.api_tracking.profile_dir')
+    stats, files = merge_profiles(directory)
+    if stats is None:
+        raise click.ClickException(f'No pstats files found in {directory}')
+    click.secho(f'Merged {len(files)} profile files from {directory}', fg='green')
+    click.echo(summarize(stats, sort=sort, limit=limit))
+    if output:
+        stats.dump_stats(output)
+        click.secho(f'Merged stats saved to {output}', fg='green')
+
+
+@api_tracking.command(name='build-sketches')
+@click.option('--days', default=2, show_default=True, help='Days to rebuild (today included)')
+def build_sketches_command(days):
+    """ Rebuild the daily distinct users sketches (unique dataset views and active users) """
+    since, total = build_sketches(days=days)
+    click.secho(f'{total} sketches built since {since}', fg='green')
+
+
+@api_tracking.command(name='ingest-core-tracking')
+@click.option('--hours', default=24, show_default=True, help='Hours of tracking_raw rows saved in each transaction')
+@click.option('--since', type=click.DateTime(), default=None, help='First run only: start date (default: first tracking_raw row)')
+def ingest_core_tracking(hours, since):
+    """ Ingest the new CKAN core tracking_raw rows into tracking_usage """
+    try:
+        total, watermark = ingest_tracking_raw(hours=hours, since=since)
+    except ValueError as e:
+        raise click.UsageError(str(e))
+    click.secho(f'{total} rows ingested. Watermark: {watermark}', fg='green')
+
+
+@api_tracking.command(name='backfill-owners')
+@click.option('--batch-size', default=5000, show_default=True, help='Rows updated in each transaction')
+def backfill_owners_command(batch_size):
+    """ Fill the dataset and organization of the tracking rows saved before they were resolved at write time """
+    checked, updated = backfill_owners(batch_size=batch_size)
+    click.secho(f'{updated} of {checked} rows updated', fg='green')
+
+
+@api_tracking.command(name='refresh-views')
+@click.option('--view', 'views', multiple=True, type=click.Choice(VIEWS), help='View to refresh (default: all)')
+def refresh_views_command(views):
+    """ Refresh the materialized views used by the dashboards and reports """
+    for name, seconds in refresh_views(views).items():
+        click.secho(f'{name} refreshed in {seconds:.1f}s', fg='green')
+
+
+def _archive_dir(directory):
+    directory = directory or toolkit.config.get('ckanext.api_tracking.archive_dir')
+    if not directory:
+        raise click.UsageError('Define --directory or ckanext.api_tracking.archive_dir')
+    return directory
+
+
+@api_tracking.command()
+@click.option('--older-than', required=True, help='Age of the rows to archive: 180d, 26w, 12h')
+@click.option('--directory', default=None, help='Archive directory (default: ckanext.api_tracking.archive_dir)')
+@click.option('--batch-size', default=5000, show_default=True, help='Rows archived and deleted in each transaction')
+@click.option('--sleep', default=0.0, show_default=True, help='Seconds to wait between batches')
+@click.option('--keep-rows', is_flag=True, help='Only write the files, do not delete the rows')
+def archive(older_than, directory, batch_size, sleep, keep_rows):
+    """ Move the old tracking rows to compressed files (one gzip NDJSON file per day) """
+    directory = _archive_dir(directory)
+    try:
+        age = parse_age(older_than)
+    except ValueError as e:
+        raise click.UsageError(str(e))
+    total, files = archive_tracking_usage(directory, age, batch_size=batch_size, sleep=sleep, delete=not keep_rows)
+    click.secho(f'{total} rows archived to {len(files)} files in {directory}', fg='green')
+
+
+@api_tracking.command()
+@click.argument('path', required=False)
+@click.option('--since', type=click.DateTime(formats=['%Y-%m-%d']), default=None, help='First day to restore')
+@click.option('--until', type=click.DateTime(formats=['%Y-%m-%d']), default=None, help='Last day to restore')
+@click.option('--batch-size', default=5000, show_default=True, help='Rows inserted in each transaction')
+def restore(path, since, until, batch_size):
+    """ Load archived rows (a file or a directory, default: ckanext.api_tracking.archive_dir) back into tracking_usage """
+    path = _archive_dir(path)
+    total, files = restore_tracking_usage(
+        path,
+        since=since.date() if since else None,
+        until=until.date() if until else None,
+        batch_size=batch_size,
+    )
+    click.secho(f'{total} rows restored from {len(files)} files (rows already saved are skipped)', fg='green')
+
+
+@api_tracking.command()
+@click.option('--user-id', default=None, help='Erase the tracking rows of this user ID')
+@click.option('--token-name', default=None, help='Erase the tracking rows of this API token name')
+@click.option('--pseudonymize', is_flag=True, help='Replace the user ID or token name with a pseudonym, keep the rows')
+@click.option('--batch-size', default=1000, show_default=True, help='Rows changed in each transaction')
+@click.option('--sleep', default=0.5, show_default=True, help='Seconds to wait between batches')
+def erase(user_id, token_name, pseudonymize, batch_size, sleep):
+    """ Erase (or pseudonymise) the tracking history of a user or an API token. Run it again to continue """
+    if bool(user_id) == bool(token_name):
+        raise click.UsageError('Define --user-id or --token-name')
+    field, value = ('user_id', user_id) if user_id else ('token_name', token_name)
+    erasure = start_erasure(field, value, mode='pseudonymize' if pseudonymize else 'erase')
+    if erasure.rows:
+        click.secho(f'Continuing erasure {erasure.id} ({erasure.rows} rows already done)', fg='yellow')
+
+    def progress(erasure):
+        click.echo(f'{erasure.rows} rows, {len(erasure.days)} days')
+
+    erasure = run_erasure(erasure.id, value, batch_size=batch_size, sleep=sleep, progress=progress)
+    click.secho(f'Erasure {erasure.id} done: {erasure.rows} rows, rollups rebuilt for {len(erasure.days)} days', fg='green')
+
+
+@api_tracking.command(name='export')
+@click.argument('output')
+@click.option('--since', type=click.DateTime(formats=['%Y-%m-%d']), required=True, help='First day to export')
+@click.option('--until', type=click.DateTime(formats=['%Y-%m-%d']), required=True, help='Last day to export (included)')
+@click.option('--row-group-size', default=100000, show_default=True, help='Rows in each Parquet row group')
+def export_command(output, since, until, row_group_size):
+    """ Export the tracking rows of a time range to a Parquet file (OUTPUT) """
+    if not export_available():
+        raise click.ClickException('The Parquet export requires pyarrow: pip install ckanext-api-tracking[export]')
+    total = 0
+    for total in export_tracking_usage(output, since.date(), until.date() + timedelta(days=1), row_group_size=row_group_size):
+        click.echo(f'{total} rows written')
+    click.secho(f'{total} rows exported to {output}', fg='green')
+
+
+def get_commands():
+    return [api_tracking]
@@ -0,0 +1,141 @@
+"""
+In-memory coalescing of repeated identical tracking events.
+Polling scripts can hit the same URL with the same token hundreds of times a minute.
+Identical events seen within a time window are merged into a single row with a count
+"""
+import atexit
+import logging
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+from ckan.plugins import toolkit
+
+from ckanext.api_tracking.latency import merge_event_latency
+
+
+log = logging.getLogger(__name__)
+
+# Events with the same values in these fields are considered identical
+KEY_FIELDS = (
+    'token_name',
+    'user_id',
+    'tracking_type',
+    'tracking_sub_type',
+    'object_type',
+    'object_id',
+    'status_code',
+)
+# Coalesced events keep the total of these fields
+SUM_FIELDS = (
+    'duration_ms',
+    'response_bytes',
+)
+
+
+class EventCoalescer:
+    """ Buffer tracking events (tracking_usage_create data dicts) and merge the identical ones
+        Events are released once their first occurrence is older than the window
+    """
+
+    def __init__(self, window, max_keys=10000):
+        self.window = timedelta(seconds=window)
+        self.max_keys = max_keys
+        # key -> event. Insertion order is also the order of the first timestamp
+        self._pending = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._pending)
+
+    @staticmethod
+    def key(data_dict):
+        return tuple(data_dict.get(field) for field in KEY_FIELDS)
+
+    def add(self, data_dict, now=None):
+        """ Add a new event to the buffer.
+            Returns a list of coalesced events ready to be saved (could be empty)
+        """
+        now = now or datetime.now()
+        timestamp = data_dict.get('timestamp') or now
+        key = self.key(data_dict)
+        with self._lock:
+            event = self._pending.get(key)
+            if event:
+                # Before adding the durations
+                merge_event_latency(event, data_dict)
+                event['count'] += data_dict.get('count') or 1
+                for field in SUM_FIELDS:
+                    if data_dict.get(field) is not None:
+                        event[field] = (event.get(field) or 0) + data_dict[field]
+                last_timestamp = data_dict.get('last_timestamp') or timestamp
+                event['last_timestamp'] = max(event['last_timestamp'], last_timestamp)
+            else:
+                event = dict(data_dict)
+                event['count'] = data_dict.get('count') or 1
+                event['timestamp'] = timestamp
+                event['last_timestamp'] = data_dict.get('last_timestamp') or timestamp
+                self._pending[key] = event
+            return self._pop_ready(now)
+
+    def pop_ready(self, now=None):
+        """ Release the events whose window is closed """
+        now = now or datetime.now()
+        with self._lock:
+            return self._pop_ready(now)
+
+    def _pop_ready(self, now):
+        """ Release the events whose window is closed (or the oldest ones if we are full) """
+        limit = now - self.window
+        ready = []
+        while self._pending:
+            key, event = next(iter(self._pending.items()))
+            if event['timestamp'] > limit and len(self._pending) <= self.max_keys:
+                break
+            ready.append(self._pending.pop(key))
+        return ready
+
+    def oldest_timestamp(self):
+        """ First timestamp of the oldest pending event (or None) """
+        with self._lock:
+            if not self._pending:
+                return None
+            return next(iter(self._pending.values()))['timestamp']
+
+    def flush(self):
+        """ Release all pending events """
+        with self._lock:
+            ready = list(self._pending.values())
+            self._pending.clear()
+        return ready
+
+
+_coalescer = None
+
+
+def get_coalescer():
+    """ Get the process coalescer or None if coalescing is disabled
+        Config:
+            ckanext.api_tracking.coalesce_window: seconds, default 0 (disabled)
+            ckanext.api_tracking.coalesce_max_keys: max events in memory, default 10000
+    """
+    global _coalescer
+    window = toolkit.asint(toolkit.config.get('ckanext.api_tracking.coalesce_window', 0))
+    if window <= 0:
+        return None
+    if _coalescer is None:
+        max_keys = toolkit.asint(toolkit.config.get('ckanext.api_tracking.coalesce_max_keys', 10000))
+        log.info(f'Coalescing tracking events every {window} seconds')
+        _coalescer = EventCoalescer(window, max_keys=max_keys)
+        # Do not lose pending events when the worker stops
+        atexit.register(_flush_at_exit)
+    return _coalescer
+
+
+def _flush_at_exit():
+    # Avoid circular imports
+    from ckanext.api_tracking.persistence import flush_pending
+    try:
+        flush_pending()
+    except Exception as e:
+        log.error(f'Unable to save pending tracking events: {e}')
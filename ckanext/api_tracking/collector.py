@@ -0,0 +1,218 @@
+"""
+Fire-and-forget transport for tracking events.
+Web workers serialise each event into a datagram and send it (non-blocking)
+to a local collector over UDP or a Unix datagram socket. They never wait on the DB.
+The collector (ckan api-tracking collector) batches, dedupes and bulk-writes the events.
+
+Addresses:
+    udp://127.0.0.1:8799
+    unix:///run/ckan/api-tracking.sock
+"""
+import json
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+
+from ckan.plugins import toolkit
+
+from ckanext.api_tracking.coalesce import EventCoalescer
+
+
+log = logging.getLogger(__name__)
+
+# Keep datagrams under the UDP limit
+MAX_DATAGRAM_SIZE = 60000
+DATETIME_FIELDS = ('timestamp', 'last_timestamp')
+
+
+def parse_address(address):
+    """ Get the socket family and address from a udp:// or unix:// URL """
+    if address.startswith('unix://'):
+        return socket.AF_UNIX, address[len('unix://'):]
+    if address.startswith('udp://'):
+        host, _, port = address[len('udp://'):].rpartition(':')
+        if not host or not port.isdigit():
+            raise ValueError(f'Invalid collector address: {address}')
+        return socket.AF_INET, (host, int(port))
+    raise ValueError(f'Invalid collector address (udp:// or unix:// expected): {address}')
+
+
+def encode_event(data_dict):
+    event = dict(data_dict)
+    event.setdefault('event_id', uuid.uuid4().hex)
+    # Use the time the request happened, not the time we save it
+    event.setdefault('timestamp', datetime.now())
+    for field in DATETIME_FIELDS:
+        if isinstance(event.get(field), datetime):
+            event[field] = event[field].isoformat()
+    return json.dumps(event, default=str).encode('utf-8')
+
+
+def decode_event(payload):
+    event = json.loads(payload.decode('utf-8'))
+    for field in DATETIME_FIELDS:
+        if event.get(field):
+            event[field] = datetime.fromisoformat(event[field])
+    return event
+
+
+class DatagramSender:
+    """ Send tracking events to the collector without blocking the request """
+
+    def __init__(self, address):
+        self.family, self.address = parse_address(address)
+        self._local = threading.local()
+
+    def _socket(self):
+        # One socket per thread (and per process, sockets are created lazily after the fork)
+        sock = getattr(self._local, 'sock', None)
+        if sock is None or getattr(self._local, 'pid', None) != os.getpid():
+            sock = socket.socket(self.family, socket.SOCK_DGRAM)
+            sock.setblocking(False)
+            self._local.sock = sock
+            self._local.pid = os.getpid()
+        return sock
+
+    def send(self, data_dict):
+        """ Returns True if the event was sent. Events are dropped if the collector is not available """
+        payload = encode_event(data_dict)
+        if len(payload) > MAX_DATAGRAM_SIZE:
+            log.warning(f'Tracking event too big to send ({len(payload)} bytes)')
+            return False
+        try:
+            self._socket().sendto(payload, self.address)
+        except OSError as e:
+            # Includes BlockingIOError (buffer full) and missing unix socket
+            log.warning(f'Unable to send tracking event to the collector: {e}')
+            return False
+        return True
+
+
+class Collector:
+    """ Receive tracking events, dedupe and merge them and write them in batches """
+
+    def __init__(self, address, writer, batch_size=1000, flush_interval=5, max_seen=100000):
+        self.family, self.address = parse_address(address)
+        self.writer = writer
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_seen = max_seen
+        self.sock = None
+        self._seen = OrderedDict()
+        self._batch = EventCoalescer(window=flush_interval, max_keys=batch_size)
+        self._ready = []
+        self._received = 0
+        self._last_flush = time.monotonic()
+
+    def bind(self):
+        self.sock = socket.socket(self.family, socket.SOCK_DGRAM)
+        if self.family == socket.AF_UNIX and os.path.exists(self.address):
+            # Remove the socket from a previous run
+            os.unlink(self.address)
+        self.sock.bind(self.address)
+        self.sock.settimeout(1)
+        log.info(f'Tracking collector listening at {self.address}')
+
+    def close(self):
+        if self.sock:
+            self.sock.close()
+            self.sock = None
+        if self.family == socket.AF_UNIX and os.path.exists(self.address):
+            os.unlink(self.address)
+
+    def handle_datagram(self, payload):
+        """ Add an event to the current batch. Returns False for invalid or duplicated events """
+        try:
+            event = decode_event(payload)
+        except (ValueError, UnicodeDecodeError) as e:
+            log.error(f'Invalid tracking datagram: {e}')
+            return False
+        event_id = event.pop('event_id', None)
+        if event_id:
+            if event_id in self._seen:
+                return False
+            self._seen[event_id] = True
+            if len(self._seen) > self.max_seen:
+                self._seen.popitem(last=False)
+        # Identical events in the same batch are saved as a single row
+        # Old events (or the oldest ones if we have too many keys) are released but we keep them for this batch
+        self._ready.extend(self._batch.add(event))
+        self._received += 1
+        return True
+
+    def batch_ready(self):
+        if self._received >= self.batch_size:
+            return True
+        return self._received > 0 and time.monotonic() - self._last_flush >= self.flush_interval
+
+    def flush(self):
+        """ Write the current batch """
+        events = self._ready + self._batch.flush()
+        self._ready = []
+        self._received = 0
+        self._last_flush = time.monotonic()
+        if events:
+            try:
+                self.writer(events)
+            except Exception:
+                # Retry with the next batch. Keep memory bounded, we prefer losing events
+                self._ready = events[-self.batch_size * 10:]
+                self._received = len(self._ready)
+                raise
+        return events
+
+    def serve_forever(self, stop=None):
+        """ Receive events until stop (threading.Event) is set or we get interrupted """
+        if self.sock is None:
+            self.bind()
+        try:
+            while not (stop and stop.is_set()):
+                try:
+                    payload = self.sock.recv(65535)
+                except socket.timeout:
+                    payload = None
+                if payload:
+                    self.handle_datagram(payload)
+                if self.batch_ready():
+                    try:
+                        self.flush()
+                    except Exception as e:
+                        log.error(f'Unable to write tracking events: {e}')
+        finally:
+            try:
+                self._receive_pending()
+                self.flush()
+            finally:
+                self.close()
+
+    def _receive_pending(self):
+        """ Do not lose the events already sent when we stop """
+        self.sock.setblocking(False)
+        while True:
+            try:
+                payload = self.sock.recv(65535)
+            except OSError:
+                return
+            self.handle_datagram(payload)
+
+
+_sender = None
+
+
+def get_sender():
+    """ Get the datagram sender or None if the collector is not enabled
+        Config:
+            ckanext.api_tracking.collector_address: udp://HOST:PORT or unix:///PATH, default empty (disabled)
+    """
+    global _sender
+    address = toolkit.config.get('ckanext.api_tracking.collector_address')
+    if not address:
+        return None
+    if _sender is None:
+        _sender = DatagramSender(address)
+    return _sender
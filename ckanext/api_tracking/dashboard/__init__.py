@@ -1,20 +1,74 @@
 import logging
 from pathlib import Path
-from sqlalchemy.sql.expression import text
-from ckan import model
+from sqlalchemy import DateTime, Integer, String
+from sqlalchemy.sql.expression import bindparam, text
+from ckanext.api_tracking.replica import read_execute, read_stream
 
 
 log = logging.getLogger(__name__)
 
+SQL_DIR = Path(__file__).parent / 'sql'
+# Types of the bind parameters used in the SQL files
+BIND_TYPES = {
+    'limit': Integer,
+    'measure_from': DateTime,
+    'measure_to': DateTime,
+    'package_id': String,
+    'owner_org': String,
+    'period_days': Integer,
+}
+
+
+class QueryRegistry:
+    """ SQL files in the sql directory, read and compiled once """
+
+    def __init__(self, directory=SQL_DIR):
+        self.directory = Path(directory)
+        self._queries = {}
+
+    def load(self):
+        queries = {}
+        for path in sorted(self.directory.glob('*.sql')):
+            queries[path.name] = self.compile(path.name, path.read_text())
+        self._queries = queries
+        log.debug(f'Loaded {len(queries)} SQL queries from {self.directory}')
+
+    @staticmethod
+    def compile(name, sql):
+        statement = text(sql)
+        names = statement.compile().params
+        statement = statement.bindparams(
+            *[bindparam(key, type_=type_) for key, type_ in BIND_TYPES.items() if key in names]
+        )
+        # Named for the queries stats (see ckanext.api_tracking.query_stats)
+        return statement.execution_options(api_tracking_query=name)
+
+    def get(self, name):
+        if not self._queries:
+            self.load()
+        try:
+            return self._queries[name]
+        except KeyError:
+            raise ValueError(f'Unknown SQL query: {name}')
+
+    def names(self):
+        if not self._queries:
+            self.load()
+        return sorted(self._queries)
+
+
+queries = QueryRegistry()
+
 
 def query_results(sql_file, params={}):
     """ Query a sql file in the sql directory """
-    here = Path(__file__).parent
-    engine = model.meta.engine
-    sql_file = here / 'sql' / sql_file
-    f = open(sql_file, 'r')
-    sql = f.read()
-    f.close()
-    log.debug(f'Executing SQL: {sql} :: {params}')
-    text_sql = text(sql)
-    return engine.execute(text_sql, **params).fetchall()
+    statement = queries.get(sql_file)
+    log.debug(f'Executing SQL: {sql_file} :: {params}')
+    return read_execute(statement, params)
+
+
+def stream_query_results(sql_file, params={}):
+    """ Query a sql file in the sql directory, fetching the rows in batches (server side cursor) """
+    statement = queries.get(sql_file)
+    log.debug(f'Streaming SQL: {sql_file} :: {params}')
+    yield from read_stream(statement, params)
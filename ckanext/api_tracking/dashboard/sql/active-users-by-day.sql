@@ -0,0 +1,16 @@
+/*
+Users logged in by day (one row per login)
+
+Used to build the daily HyperLogLog sketches of active users
+(ckanext/api_tracking/queries/sketches.py)
+*/
+
+SELECT
+    date(t.timestamp) AS day,
+    t.object_id AS user_id
+FROM tracking_usage as t
+WHERE
+  t.timestamp >= :measure_from and
+  t.timestamp < :measure_to and
+  t.tracking_sub_type = 'login' and
+  t.object_id IS NOT NULL;
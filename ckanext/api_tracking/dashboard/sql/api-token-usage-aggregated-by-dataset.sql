@@ -1,6 +1,6 @@
 SELECT 
     t.object_id,
-    count(t.object_id) as total,
+    SUM(t.count) as total,
     g.name as group_name,
     g.title as group_title
 FROM tracking_usage as t
@@ -1,7 +1,7 @@
 SELECT 
     user_id,
     token_name,
-    count(t.token_name) as total
+    SUM(t.count) as total
 FROM tracking_usage as t
 WHERE 
     t.token_name IS NOT NULL
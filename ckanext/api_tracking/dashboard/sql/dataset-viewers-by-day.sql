@@ -0,0 +1,18 @@
+/*
+Users viewing each dataset by day (one row per view)
+
+Based on the tracking_raw table. Used to build the daily HyperLogLog sketches
+of unique dataset views (ckanext/api_tracking/queries/sketches.py)
+*/
+
+SELECT
+    date(tr.access_timestamp) AS day,
+    p.id AS package_id,
+    tr.user_key
+FROM tracking_raw as tr
+JOIN package as p ON p.name = substring(tr.url FROM '/dataset/([^/]+)')
+WHERE
+  tr.access_timestamp >= :measure_from and
+  tr.access_timestamp < :measure_to and
+  tr.tracking_type = 'page' and
+  tr.url LIKE '/dataset/%';
@@ -0,0 +1,25 @@
+ -- Get the most downloaded resources from the tracking_raw rows
+ -- already ingested in tracking_usage (ckanext/api_tracking/queries/ingest.py)
+ -- Same columns as downloaded-resources.sql
+
+SELECT
+    '/dataset/' || p.name || '/resource/' || r.id as url,
+    r.id as resource_id,
+    r.name as resource_name,
+    p.id as package_id,
+    p.name as package_name,
+    p.title as package_title,
+    SUM(t.count) as total_downloads
+FROM tracking_usage as t
+JOIN resource as r ON r.id = t.object_id
+JOIN package as p ON p.id = r.package_id
+WHERE
+ t.tracking_type = 'core' and
+ t.tracking_sub_type = 'download' and
+ t.timestamp >= :measure_from and
+ (:package_id IS NULL OR p.id = :package_id OR p.name = :package_id) and
+ (:owner_org IS NULL OR p.owner_org = :owner_org OR p.owner_org IN (SELECT id FROM "group" WHERE name = :owner_org))
+GROUP BY r.id, r.name, p.id, p.name, p.title
+ORDER BY total_downloads DESC
+
+LIMIT :limit;
@@ -0,0 +1,19 @@
+ -- Most downloaded resources, from the materialized view (ckanext/api_tracking/queries/views.py)
+ -- Same columns as downloaded-resources.sql for the pre-computed periods
+
+SELECT
+    v.url,
+    v.resource_id,
+    v.resource_name,
+    v.package_id,
+    v.package_name,
+    v.package_title,
+    v.total_downloads
+FROM tracking_resource_downloads_mv as v
+WHERE
+ v.period_days = :period_days and
+ (:package_id IS NULL OR v.package_id = :package_id OR v.package_name = :package_id) and
+ (:owner_org IS NULL OR v.owner_org = :owner_org OR v.owner_org IN (SELECT id FROM "group" WHERE name = :owner_org))
+ORDER BY v.total_downloads DESC
+
+LIMIT :limit;
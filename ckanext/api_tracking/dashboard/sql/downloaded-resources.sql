@@ -1,12 +1,24 @@
  -- Get the most downloaded resources from the tracking_summary table
+ -- URLs are like /dataset/{package_name}/resource/{resource_id}
+ -- Optional scope (NULL for all): package_id (ID or name) and owner_org (ID or name)
 
 SELECT
-    t.url, SUM(t.count) as total_downloads
+    '/dataset/' || p.name || '/resource/' || r.id as url,
+    r.id as resource_id,
+    r.name as resource_name,
+    p.id as package_id,
+    p.name as package_name,
+    p.title as package_title,
+    SUM(t.count) as total_downloads
 FROM tracking_summary as t
+JOIN resource as r ON r.id = substring(t.url FROM '/resource/([^/?#]+)')
+JOIN package as p ON p.id = r.package_id
 WHERE
  t.tracking_type = 'download' and
- t.tracking_date >= :measure_from
-GROUP BY t.url
+ t.tracking_date >= :measure_from and
+ (:package_id IS NULL OR p.id = :package_id OR p.name = :package_id) and
+ (:owner_org IS NULL OR p.owner_org = :owner_org OR p.owner_org IN (SELECT id FROM "group" WHERE name = :owner_org))
+GROUP BY r.id, r.name, p.id, p.name, p.title
 ORDER BY total_downloads DESC
 
 LIMIT :limit;
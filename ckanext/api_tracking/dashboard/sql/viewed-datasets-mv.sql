@@ -0,0 +1,13 @@
+ -- Most viewed datasets, from the materialized view (ckanext/api_tracking/queries/views.py)
+ -- Same results as viewed-datasets.sql for the pre-computed periods
+
+SELECT
+    v.package_id,
+    v.package_name,
+    v.package_title,
+    v.total_views
+FROM tracking_dataset_views_mv as v
+WHERE
+  v.period_days = :period_days
+ORDER BY v.total_views DESC
+LIMIT :limit;
@@ -0,0 +1,23 @@
+/*
+Unique views in a period
+Same results as viewed-datasets-unique.sql from the tracking_raw rows
+already ingested in tracking_usage (ckanext/api_tracking/queries/ingest.py)
+*/
+
+SELECT
+    p.name as package_name,
+    p.title as package_title,
+    p.id as package_id,
+    COUNT(DISTINCT t.extras->>'user_key') AS total_views
+FROM tracking_usage as t
+JOIN package as p ON p.id = t.object_id
+WHERE
+  t.tracking_type = 'core' and
+  t.tracking_sub_type = 'view' and
+  t.timestamp >= :measure_from and
+  (:package_id IS NULL OR p.id = :package_id OR p.name = :package_id) and
+  (:owner_org IS NULL OR p.owner_org = :owner_org OR p.owner_org IN (SELECT id FROM "group" WHERE name = :owner_org))
+
+GROUP BY p.name, p.title, p.id
+ORDER BY total_views DESC
+LIMIT :limit;
@@ -0,0 +1,17 @@
+/*
+Unique views in a period, from the materialized view (ckanext/api_tracking/queries/views.py)
+Same results as viewed-datasets-unique.sql for the pre-computed periods
+*/
+
+SELECT
+    v.package_name,
+    v.package_title,
+    v.package_id,
+    v.total_views
+FROM tracking_unique_dataset_views_mv as v
+WHERE
+  v.period_days = :period_days and
+  (:package_id IS NULL OR v.package_id = :package_id OR v.package_name = :package_id) and
+  (:owner_org IS NULL OR v.owner_org = :owner_org OR v.owner_org IN (SELECT id FROM "group" WHERE name = :owner_org))
+ORDER BY v.total_views DESC
+LIMIT :limit;
@@ -3,6 +3,7 @@ Unique views in a period
 If a user views a dataset multiple times in a period, it will only be counted once
 
 Based on the tracking_raw table because the tracking_summary table does not allow to count unique views in a period.
+Optional scope (NULL for all): package_id (ID or name) and owner_org (ID or name).
 
 This query is used in ckanext/api_tracking/dashboard/stats.py module to collect views statistics.
 */
@@ -20,7 +21,9 @@ JOIN package as p ON p.name = substring(tr.url FROM '/dataset/([^/]+)')
 WHERE
   access_timestamp >= :measure_from and
   tracking_type = 'page' and
-  tr.url LIKE '/dataset/%'
+  tr.url LIKE '/dataset/%' and
+  (:package_id IS NULL OR p.id = :package_id OR p.name = :package_id) and
+  (:owner_org IS NULL OR p.owner_org = :owner_org OR p.owner_org IN (SELECT id FROM "group" WHERE name = :owner_org))
 
 GROUP BY package_name, package_title, package_id
 ORDER BY total_views DESC
@@ -3,29 +3,60 @@ Stats for our dashboard
 """
 import logging
 from datetime import datetime, timedelta
-from ckan import model
 from ckanext.api_tracking.dashboard import query_results
+from ckanext.api_tracking.queries.ingest import use_ingested
+from ckanext.api_tracking.queries.sketches import unique_dataset_views, use_sketches
+from ckanext.api_tracking.queries.views import (
+    DATASET_VIEWS,
+    RESOURCE_DOWNLOADS,
+    UNIQUE_DATASET_VIEWS,
+    get_freshness,
+    view_ready,
+)
 
 
 log = logging.getLogger(__name__)
 
 
-def get_unique_dataset_views(days_ago=365, limit=10, package_id=None):
-    """ Get an ordered list of most viewed datasets """
+def _period_query(days_ago, sql_file, view=None, view_sql_file=None):
+    """ SQL file and period params. Use the materialized view if it is refreshed and has this period """
+    if view and view_ready(view, days_ago=days_ago):
+        return view_sql_file, {'period_days': days_ago}
+    return sql_file, {'measure_from': datetime.now() - timedelta(days=days_ago)}
+
+
+def get_views_freshness(view):
+    """ Last refresh of the materialized view used by a dashboard (None if it is not used) """
+    if view == UNIQUE_DATASET_VIEWS and use_sketches():
+        return None
+    if view in (UNIQUE_DATASET_VIEWS, RESOURCE_DOWNLOADS) and use_ingested():
+        return None
+    return get_freshness(view)
+
+
+def get_unique_dataset_views(days_ago=365, limit=10, package_id=None, owner_org=None):
+    """ Get an ordered list of most viewed datasets
+        Optional scope: a dataset or an organization (ID or name)
+    """
 
     log.debug(f'Getting dataset views for the last {days_ago} days')
-    sql_file = 'viewed-datasets-unique.sql'
-    measure_from = datetime.now() - timedelta(days=days_ago)
-    params = {
+    if use_sketches():
+        return unique_dataset_views(days_ago=days_ago, limit=limit, package_id=package_id, owner_org=owner_org)
+    if use_ingested():
+        sql_file, params = _period_query(days_ago, 'viewed-datasets-unique-ingested.sql')
+    else:
+        sql_file, params = _period_query(
+            days_ago, 'viewed-datasets-unique.sql', UNIQUE_DATASET_VIEWS, 'viewed-datasets-unique-mv.sql'
+        )
+    params.update({
         'limit': limit,
-        'measure_from': measure_from,
-    }
+        'package_id': package_id,
+        'owner_org': owner_org,
+    })
     results = query_results(sql_file, params=params)
 
     ret = []
     for row in results:
-        if package_id and package_id not in [row['package_name'], row['package_id']]:
-            continue
         ret.append({
             'name': row['package_name'],
             'views': row['total_views'],
@@ -39,12 +70,8 @@ def get_dataset_views(days_ago=365, limit=10):
     """ Get an ordered list of most viewed datasets """
 
     log.debug(f'Getting dataset views for the last {days_ago} days')
-    sql_file = 'viewed-datasets.sql'
-    measure_from = datetime.now() - timedelta(days=days_ago)
-    params = {
-        'limit': limit,
-        'measure_from': measure_from,
-    }
+    sql_file, params = _period_query(days_ago, 'viewed-datasets.sql', DATASET_VIEWS, 'viewed-datasets-mv.sql')
+    params['limit'] = limit
     results = query_results(sql_file, params=params)
 
     ret = []
@@ -57,43 +84,52 @@ def get_dataset_views(days_ago=365, limit=10):
     return ret
 
 
-def get_resource_downloads(days_ago=365, limit=10, package_id=None):
-    """ Get an ordered list of most downloaded resources """
+def get_resource_downloads(days_ago=365, limit=10, package_id=None, owner_org=None):
+    """ Get an ordered list of most downloaded resources
+        Optional scope: a dataset or an organization (ID or name)
+    """
 
     log.debug(f'Getting resource downloads for the last {days_ago} days')
     # We take advantage of ckan tracking update to summarize our custom tracking data
-    sql_file = 'downloaded-resources.sql'
-    measure_from = datetime.now() - timedelta(days=days_ago)
-    params = {
+    if use_ingested():
+        sql_file, params = _period_query(days_ago, 'downloaded-resources-ingested.sql')
+    else:
+        sql_file, params = _period_query(
+            days_ago, 'downloaded-resources.sql', RESOURCE_DOWNLOADS, 'downloaded-resources-mv.sql'
+        )
+    params.update({
         'limit': limit,
-        'measure_from': measure_from,
-    }
+        'package_id': package_id,
+        'owner_org': owner_org,
+    })
     results = query_results(sql_file, params=params)
 
     ret = []
     for row in results:
-        url = row['url']
-        # url is like '/dataset/{package_name}/resource/{resource_id}'
-        resource_id = url.split('/')[-1]
-        resource = model.Resource.get(resource_id)
-        if not resource:
-            log.error(f'Resource {resource_id} not found')
-            continue
-        resource_name = resource.name if resource else 'No name'
-        package = model.Package.get(resource.package_id)
-        if not package:
-            log.error(f'Package {resource.package_id} not found for {resource_id}')
-            continue
-
-        if package_id and package_id not in [package.id, package.name]:
-            continue
-
-        package_title = package.title if package.title else package.name
-        name = f'{resource_name} - {package_title}'
+        resource_name = row['resource_name'] or 'No name'
+        package_title = row['package_title'] or row['package_name']
         ret.append({
-            'resource_id': resource_id,
+            'resource_id': row['resource_id'],
             'downloads': row['total_downloads'],
-            'title': name,
-            'url': url,
+            'title': f'{resource_name} - {package_title}',
+            'url': row['url'],
+            'package_id': row['package_id'],
         })
     return ret
+
+
+def get_dataset_usage(package_id, days_ago=30, limit=10):
+    """ Usage of a single dataset: unique views and its most downloaded resources """
+    views = get_unique_dataset_views(days_ago=days_ago, limit=1, package_id=package_id)
+    return {
+        'views': views[0]['views'] if views else 0,
+        'resource_downloads': get_resource_downloads(days_ago=days_ago, limit=limit, package_id=package_id),
+    }
+
+
+def get_organization_usage(owner_org, days_ago=30, limit=10):
+    """ Usage of an organization: its most viewed datasets and most downloaded resources """
+    return {
+        'dataset_views': get_unique_dataset_views(days_ago=days_ago, limit=limit, owner_org=owner_org),
+        'resource_downloads': get_resource_downloads(days_ago=days_ago, limit=limit, owner_org=owner_org),
+    }
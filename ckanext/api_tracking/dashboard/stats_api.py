@@ -3,10 +3,12 @@ Stats about API for our dashboard
 """
 import logging
 from ckan.plugins import toolkit
+from ckanext.api_tracking.queries.latency import get_latency_percentiles
 from ckanext.api_tracking.queries.data import (
     all_token_usage_data,
     most_accessed_token_data,
     most_accessed_dataset_with_token_data,
+    most_accessed_organization_with_token_data,
     most_accessed_resource_with_token_data,
 )
 
@@ -38,21 +40,48 @@ def get_api_token_usage_aggregated(limit=50):
     log.debug('Getting aggregated api token usage')
     download_by_resource_csv = toolkit.url_for('tracking_csv.most_accessed_resource_with_token_csv')
     download_by_dataset_csv = toolkit.url_for('tracking_csv.most_accessed_dataset_with_token_csv')
+    download_by_organization_csv = toolkit.url_for('tracking_csv.most_accessed_organization_with_token_csv')
     download_by_token_csv = toolkit.url_for('tracking_csv.most_accessed_token_csv')
     json_by_resource = toolkit.url_for('api.action', ver=3, logic_function='most_accessed_resource_with_token')
     json_by_dataset = toolkit.url_for('api.action', ver=3, logic_function='most_accessed_dataset_with_token')
+    json_by_organization = toolkit.url_for('api.action', ver=3, logic_function='most_accessed_organization_with_token')
     json_by_token = toolkit.url_for('api.action', ver=3, logic_function='most_accessed_token')
     ret = {
         'links': {
             'download_by_resource_csv': download_by_resource_csv,
             'download_by_dataset_csv': download_by_dataset_csv,
+            'download_by_organization_csv': download_by_organization_csv,
             'download_by_token_csv': download_by_token_csv,
             'json_by_resource': json_by_resource,
             'json_by_dataset': json_by_dataset,
+            'json_by_organization': json_by_organization,
             'json_by_token': json_by_token,
         },
         'by_resource': most_accessed_resource_with_token_data(limit=limit),
         'by_dataset': most_accessed_dataset_with_token_data(limit=limit),
+        'by_organization': most_accessed_organization_with_token_data(limit=limit),
         'by_token_name': most_accessed_token_data(limit=limit),
     }
     return ret
+
+
+def get_latency_stats(days=30, limit=20):
+    """ Latency percentiles by action, token and dataset """
+    log.debug('Getting latency percentiles')
+    ret = {
+        'links': {
+            'json_by_action': toolkit.url_for(
+                'api.action', ver=3, logic_function='latency_percentiles', dimension='action', days=days
+            ),
+            'json_by_token': toolkit.url_for(
+                'api.action', ver=3, logic_function='latency_percentiles', dimension='token', days=days
+            ),
+            'json_by_dataset': toolkit.url_for(
+                'api.action', ver=3, logic_function='latency_percentiles', dimension='dataset', days=days
+            ),
+        },
+        'by_action': get_latency_percentiles('action', days=days, limit=limit),
+        'by_token': get_latency_percentiles('token', days=days, limit=limit),
+        'by_dataset': get_latency_percentiles('dataset', days=days, limit=limit),
+    }
+    return ret
@@ -1,5 +1,6 @@
 import logging
 from ckan.plugins import toolkit
+from ckanext.api_tracking.queries.sketches import unique_active_users, use_sketches
 from ckanext.api_tracking.queries.users import users_active_metrics
 
 
@@ -21,6 +22,10 @@ def get_users_active_metrics(limit=30):
             'view_json': json_url,
         },
         'records': results,
+        # Distinct users in a period, only available with sketches
+        'unique_users': None,
     }
+    if use_sketches():
+        ret['unique_users'] = {days: unique_active_users(days_ago=days) for days in (7, 30, 365)}
 
     return ret
@@ -1,6 +1,8 @@
 from functools import wraps
 from ckan.plugins import toolkit
 
+from ckanext.api_tracking.guardrails import QueryTimeout
+
 
 def require_sysadmin_user(func):
     '''
@@ -16,3 +18,21 @@ def require_sysadmin_user(func):
         return func(*args, **kwargs)
 
     return view_wrapper
+
+
+def narrow_range_on_timeout(func):
+    '''
+    Decorator for actions. A query cancelled by the statement timeout returns a validation error
+    asking for a narrower range instead of a server error.
+    '''
+
+    @wraps(func)
+    def action_wrapper(context, data_dict):
+        try:
+            return func(context, data_dict)
+        except QueryTimeout:
+            raise toolkit.ValidationError({
+                'limit': ['This query took too long. Try a narrower range (a shorter period or fewer results).']
+            })
+
+    return action_wrapper
@@ -0,0 +1,122 @@
+"""
+Range requests coalescing for resource downloads.
+Download managers and browsers request the same file in many chunks
+(HTTP Range requests, 206 Partial Content). We merge the partial requests for the same
+resource from the same token (or user) into a single logical download with the total bytes sent.
+A download is finished when we get no more chunks for the window (seconds).
+"""
+import atexit
+import logging
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+from ckan.plugins import toolkit
+
+
+log = logging.getLogger(__name__)
+
+
+def is_partial_download(data_dict):
+    return data_dict.get('tracking_sub_type') == 'download' and bool(data_dict.get('range_request'))
+
+
+class DownloadSessions:
+    """ Merge the partial requests of the same download """
+
+    def __init__(self, window, max_keys=10000):
+        self.window = timedelta(seconds=window)
+        self.max_keys = max_keys
+        # key -> download. Sorted by last activity
+        self._open = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._open)
+
+    @staticmethod
+    def key(data_dict):
+        return (
+            data_dict.get('token_name') or data_dict.get('user_id'),
+            data_dict.get('object_type'),
+            data_dict.get('object_id'),
+        )
+
+    def add(self, data_dict, now=None):
+        """ Add a partial request
+            Returns the list of finished downloads (could be empty)
+        """
+        now = now or datetime.now()
+        timestamp = data_dict.get('timestamp') or now
+        key = self.key(data_dict)
+        with self._lock:
+            download = self._open.get(key)
+            if download:
+                download['response_bytes'] = (download.get('response_bytes') or 0) + (data_dict.get('response_bytes') or 0)
+                if data_dict.get('duration_ms') is not None:
+                    download['duration_ms'] = (download.get('duration_ms') or 0) + data_dict['duration_ms']
+                download['extras']['range_requests'] += 1
+                download['last_timestamp'] = max(download['last_timestamp'], timestamp)
+                self._open.move_to_end(key)
+            else:
+                download = dict(data_dict)
+                # A single logical download
+                download['count'] = 1
+                download['timestamp'] = timestamp
+                download['last_timestamp'] = timestamp
+                download['extras'] = dict(data_dict.get('extras') or {}, range_requests=1)
+                self._open[key] = download
+            return self._pop_finished(now)
+
+    def pop_finished(self, now=None):
+        """ Release the downloads without activity for the window """
+        now = now or datetime.now()
+        with self._lock:
+            return self._pop_finished(now)
+
+    def _pop_finished(self, now):
+        limit = now - self.window
+        finished = []
+        while self._open:
+            key, download = next(iter(self._open.items()))
+            if download['last_timestamp'] > limit and len(self._open) <= self.max_keys:
+                break
+            finished.append(self._open.pop(key))
+        return finished
+
+    def flush(self):
+        """ Release all the open downloads """
+        with self._lock:
+            finished = list(self._open.values())
+            self._open.clear()
+        return finished
+
+
+_sessions = None
+
+
+def get_download_sessions():
+    """ Get the process download sessions or None if disabled
+        Config:
+            ckanext.api_tracking.download_session_window: seconds, default 0 (disabled)
+            ckanext.api_tracking.download_session_max_keys: max downloads in memory, default 10000
+    """
+    global _sessions
+    window = toolkit.asint(toolkit.config.get('ckanext.api_tracking.download_session_window', 0))
+    if window <= 0:
+        return None
+    if _sessions is None:
+        max_keys = toolkit.asint(toolkit.config.get('ckanext.api_tracking.download_session_max_keys', 10000))
+        _sessions = DownloadSessions(window, max_keys=max_keys)
+        # Do not lose open downloads when the worker stops
+        atexit.register(_flush_at_exit)
+    return _sessions
+
+
+def _flush_at_exit():
+    # Avoid circular imports
+    from ckanext.api_tracking.persistence import flush_pending
+    try:
+        flush_pending()
+    except Exception as e:
+        log.error(f'Unable to save pending downloads: {e}')
@@ -0,0 +1,102 @@
+"""
+Guardrails for the dashboard and report queries.
+Each query class has a statement timeout (SET LOCAL statement_timeout in the read transaction)
+and a row cap (max LIMIT). A cancelled query raises QueryTimeout and the dashboard, CSV files
+and API actions answer "try a narrower range" instead of holding a connection for minutes.
+"""
+import logging
+
+from ckan.plugins import toolkit
+from sqlalchemy import text
+
+from ckanext.api_tracking import metrics
+
+
+log = logging.getLogger(__name__)
+
+# Query class: (statement timeout in ms, max rows). 0 = no limit
+QUERY_CLASSES = {
+    # Dashboard panels (SQL files)
+    'dashboard': (15000, 1000),
+    # API actions and CSV files
+    'report': (30000, 5000),
+    # CLI jobs (sketches, rollups)
+    'batch': (0, 0),
+}
+# PostgreSQL error code for a statement cancelled by statement_timeout
+QUERY_CANCELED = '57014'
+
+query_timeouts = {
+    query_class: metrics.registry.counter(
+        f'api_tracking_{query_class}_query_timeouts_total',
+        f'{query_class.capitalize()} queries cancelled by the statement timeout',
+    )
+    for query_class in QUERY_CLASSES
+}
+limits_capped = metrics.registry.counter(
+    'api_tracking_query_limits_capped_total', 'Report queries with a limit reduced to the max rows'
+)
+
+
+class QueryTimeout(Exception):
+    """ A report query was cancelled by the statement timeout """
+
+    def __init__(self, query_class, timeout):
+        self.query_class = query_class
+        self.timeout = timeout
+        super().__init__(f'The {query_class} query took more than {timeout} ms')
+
+
+def _get_setting(query_class, name):
+    if query_class not in QUERY_CLASSES:
+        raise ValueError(f'Unknown query class: {query_class}')
+    default = QUERY_CLASSES[query_class][0 if name == 'statement_timeout' else 1]
+    return toolkit.asint(toolkit.config.get(f'ckanext.api_tracking.{query_class}_{name}', default))
+
+
+def get_statement_timeout(query_class):
+    """ ckanext.api_tracking.<query_class>_statement_timeout: milliseconds, 0 to disable """
+    return _get_setting(query_class, 'statement_timeout')
+
+
+def get_max_rows(query_class):
+    """ ckanext.api_tracking.<query_class>_max_rows: 0 to disable """
+    return _get_setting(query_class, 'max_rows')
+
+
+def cap_limit(limit, query_class='report'):
+    """ The limit of a query, at most the max rows of its class
+        Raises ValidationError if the limit is not an integer (e.g. a request parameter)
+    """
+    max_rows = get_max_rows(query_class)
+    if limit is None:
+        return max_rows or None
+    try:
+        limit = toolkit.asint(limit)
+    except ValueError:
+        raise toolkit.ValidationError({'limit': ['Invalid integer']})
+    if max_rows and limit > max_rows:
+        log.warning(f'Limit {limit} reduced to {max_rows} ({query_class} queries)')
+        limits_capped.inc()
+        return max_rows
+    return limit
+
+
+def set_statement_timeout(conn, query_class):
+    """ Set the statement timeout for the current transaction (PostgreSQL only). Returns the timeout """
+    timeout = get_statement_timeout(query_class)
+    if timeout and conn.dialect.name == 'postgresql':
+        conn.execute(text(f'SET LOCAL statement_timeout = {int(timeout)}'))
+    return timeout
+
+
+def is_timeout(error):
+    """ Was this DBAPIError raised by the statement timeout? """
+    return getattr(getattr(error, 'orig', None), 'pgcode', None) == QUERY_CANCELED
+
+
+def timeout_error(error, query_class, timeout):
+    """ Count and log a cancelled query. Returns the QueryTimeout to raise """
+    query_timeouts[query_class].inc()
+    log.warning(f'{query_class.capitalize()} query cancelled after {timeout} ms: {str(error.statement)[:200]}')
+    return QueryTimeout(query_class, timeout)
@@ -0,0 +1,60 @@
+"""
+HyperLogLog sketches to count distinct values (users) with a small, fixed size.
+Sketches are merged taking the max of each register, so daily sketches
+give the distinct count for any period. Standard error is 1.04 / sqrt(2 ** precision),
+~3.25% with the default precision (1024 registers, a few hundred bytes compressed).
+"""
+import hashlib
+import math
+import zlib
+
+
+PRECISION = 10
+
+
+class HyperLogLog:
+
+    def __init__(self, precision=PRECISION, registers=None):
+        self.precision = precision
+        self.size = 1 << precision
+        self.registers = bytearray(registers) if registers is not None else bytearray(self.size)
+        if len(self.registers) != self.size:
+            raise ValueError(f'Invalid HyperLogLog registers ({len(self.registers)} for precision {precision})')
+
+    @property
+    def error(self):
+        """ Standard error of the estimation """
+        return 1.04 / math.sqrt(self.size)
+
+    def add(self, value):
+        x = int.from_bytes(hashlib.blake2b(str(value).encode('utf-8'), digest_size=8).digest(), 'big')
+        bits = 64 - self.precision
+        index = x >> bits
+        # Position of the leftmost 1 in the remaining bits
+        rank = bits - (x & ((1 << bits) - 1)).bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other):
+        if other.precision != self.precision:
+            raise ValueError('Unable to merge HyperLogLog sketches with different precision')
+        self.registers = bytearray(map(max, self.registers, other.registers))
+        return self
+
+    def count(self):
+        size = self.size
+        alpha = 0.7213 / (1 + 1.079 / size)
+        estimate = alpha * size * size / sum(2.0 ** -register for register in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * size and zeros:
+            # Small cardinalities, linear counting is more accurate
+            estimate = size * math.log(size / zeros)
+        return int(round(estimate))
+
+    def to_bytes(self):
+        return bytes([self.precision]) + zlib.compress(bytes(self.registers))
+
+    @classmethod
+    def from_bytes(cls, data):
+        data = bytes(data)
+        return cls(precision=data[0], registers=zlib.decompress(data[1:]))
@@ -1,8 +1,8 @@
 import logging
 from ckan import model, plugins
-from ckan.plugins import toolkit
 from ckan.plugins.interfaces import Interface
 from ckanext.api_tracking.models import CKANURL
+from ckanext.api_tracking.persistence import save_tracking_usage
 
 
 log = logging.getLogger(__name__)
@@ -25,18 +25,26 @@ class IUsage(Interface):
         data: dict
             tracking_type: keys from METHOD->TYPE defined in define_paths
             environ: Full request environ
+            ckan_url: CKANURL built by the middleware (shared by all plugins)
+            duration_ms: time to process the request (milliseconds)
+            status_code: response status code
+            response_bytes: response body size
         api_token: ApiToken object or None
         '''
+        # Each plugin gets its own copy, the same data is used by all of them
+        data = dict(data)
 
         for item in plugins.PluginImplementations(IUsage):
             # we can do something with the data after it has been tracked
             data = item.before_track_usage(data)
 
         environ = data.pop('environ', None)
-        if not environ:
-            log.warning('No environment initialized for request. Unable to track')
-            return
-        ckan_url = CKANURL(environ)
+        ckan_url = data.pop('ckan_url', None)
+        if not ckan_url:
+            if not environ:
+                log.warning('No environment initialized for request. Unable to track')
+                return
+            ckan_url = CKANURL(environ)
         method = ckan_url.method.lower()
         tracking_type = data['tracking_type']
         log.debug(f"Track: {method} :: {tracking_type}")
@@ -73,19 +81,21 @@ class IUsage(Interface):
         token_name = api_token.name if api_token else None
         object_id = ret_data.get('object_id')
         object_type = ret_data.get('object_type')
-        ctx = {'ignore_auth': True}
         data_dict = dict(
             user_id=user_id, extras=extras,
             tracking_type=tracking_type, tracking_sub_type=tracking_sub_type,
             token_name=token_name,
             object_type=object_type, object_id=object_id,
+            duration_ms=data.get('duration_ms'),
+            status_code=data.get('status_code'),
+            response_bytes=data.get('response_bytes'),
         )
-        tu = toolkit.get_action('tracking_usage_create')(ctx, data_dict)
-
-        for item in plugins.PluginImplementations(IUsage):
-            # we can do something after saving the TrackingUsage
-            if hasattr(item, 'after_track_usage_save'):
-                item.after_track_usage_save(tu)
+        if tracking_sub_type == 'download':
+            # Partial content, probably one of many chunks of the same download
+            data_dict['range_request'] = bool(ckan_url.environ.get('HTTP_RANGE')) or data.get('status_code') == 206
+        # This could be coalesced with other identical events before saving
+        # after_track_usage_save is called for each saved row
+        save_tracking_usage(data_dict)
 
     def track_get_dataset(self, ckan_url):
         """ Track a dataset/NAME page access """
@@ -160,7 +170,11 @@ class IUsage(Interface):
         method = method.lower()
         fn = getattr(self, f'track_{method}_api_action_{action_name}', None)
         if fn:
-            return fn(ckan_url)
+            ret_data = fn(ckan_url)
+            if ret_data:
+                # Keep the action name, used for latency reports
+                ret_data.setdefault('extras', {})['action'] = action_name
+            return ret_data
         else:
             log.error(f"Unable to track {method} API action '{action_name}'")
 
@@ -0,0 +1,85 @@
+"""
+Mergeable latency histograms (HDR style).
+Durations are counted in logarithmic buckets, BUCKETS_PER_OCTAVE buckets
+each time the duration doubles (~4.5% max relative error).
+Histograms are merged just adding the bucket counts, so we can keep them in
+daily rollups and get percentiles for any period.
+"""
+import math
+
+
+BUCKETS_PER_OCTAVE = 8
+# Durations are in milliseconds, ignore anything below 1 microsecond
+MIN_DURATION_MS = 0.001
+# Merged tracking events (coalesced) keep the histogram of their durations in extras: {bucket: count}
+EXTRAS_KEY = 'latency_buckets'
+
+
+def bucket_for(duration_ms):
+    """ Bucket index for a duration. Same formula used in the rollup SQL """
+    return math.floor(BUCKETS_PER_OCTAVE * math.log2(max(duration_ms, MIN_DURATION_MS)))
+
+
+def bucket_value(bucket):
+    """ Representative duration for a bucket (geometric mean of its bounds) """
+    return 2 ** ((bucket + 0.5) / BUCKETS_PER_OCTAVE)
+
+
+class LatencyHistogram:
+
+    def __init__(self, counts=None):
+        # bucket -> count
+        self.counts = dict(counts or {})
+
+    @property
+    def total(self):
+        return sum(self.counts.values())
+
+    def add(self, duration_ms, count=1):
+        self.add_bucket(bucket_for(duration_ms), count)
+
+    def add_bucket(self, bucket, count):
+        self.counts[bucket] = self.counts.get(bucket, 0) + count
+
+    def merge(self, other):
+        for bucket, count in other.counts.items():
+            self.add_bucket(bucket, count)
+        return self
+
+    def percentile(self, percentile):
+        """ Approximated duration (ms) for a percentile (0-100) """
+        total = self.total
+        if not total:
+            return None
+        rank = math.ceil(total * percentile / 100) or 1
+        seen = 0
+        for bucket in sorted(self.counts):
+            seen += self.counts[bucket]
+            if seen >= rank:
+                return bucket_value(bucket)
+        return bucket_value(max(self.counts))
+
+
+def event_buckets(data_dict):
+    """ Latency histogram counts of a tracking event (tracking_usage_create data dict) """
+    extras = data_dict.get('extras') or {}
+    if extras.get(EXTRAS_KEY):
+        return {int(bucket): count for bucket, count in extras[EXTRAS_KEY].items()}
+    if data_dict.get('duration_ms') is None:
+        return {}
+    count = data_dict.get('count') or 1
+    return {bucket_for(data_dict['duration_ms'] / count): count}
+
+
+def merge_event_latency(event, data_dict):
+    """ Save in the event extras the latency histogram of both events.
+        Call it before adding the durations: the total duration of merged events
+        loses the distribution (one slow request in a hundred fast ones)
+    """
+    histogram = LatencyHistogram(event_buckets(event)).merge(LatencyHistogram(event_buckets(data_dict)))
+    if not histogram.counts:
+        return event
+    # JSON keys are strings
+    buckets = {str(bucket): histogram.counts[bucket] for bucket in sorted(histogram.counts)}
+    event['extras'] = dict(event.get('extras') or {}, **{EXTRAS_KEY: buckets})
+    return event
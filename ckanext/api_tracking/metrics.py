@@ -0,0 +1,144 @@
+"""
+Low-overhead self instrumentation for the tracking pipeline.
+Metrics are kept in memory by each worker process and exposed
+in Prometheus text format at /tracking-dashboard/metrics
+"""
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+
+# Seconds, from 0.1ms to 5s
+TIME_BUCKETS = (0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+SIZE_BUCKETS = (1, 5, 10, 50, 100, 500, 1000, 5000)
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, description):
+        self.name = name
+        self.description = description
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def samples(self):
+        yield self.name, self.value
+
+
+class Gauge:
+    """ Gauge with a value or a function to get it """
+    kind = 'gauge'
+
+    def __init__(self, name, description, function=None):
+        self.name = name
+        self.description = description
+        self.function = function
+        self.value = 0
+
+    def set(self, value):
+        self.value = value
+
+    def get(self):
+        if self.function:
+            return self.function()
+        return self.value
+
+    def samples(self):
+        yield self.name, self.get()
+
+
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, name, description, buckets=TIME_BUCKETS):
+        self.name = name
+        self.description = description
+        self.buckets = tuple(buckets)
+        # The last one is +Inf
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    @contextmanager
+    def time(self):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+    def samples(self):
+        cumulative = 0
+        for bucket, count in zip(self.buckets + ('+Inf', ), self.counts):
+            cumulative += count
+            yield f'{self.name}_bucket{{le="{bucket}"}}', cumulative
+        yield f'{self.name}_sum', self.sum
+        yield f'{self.name}_count', self.count
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = {}
+
+    def register(self, metric):
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, description):
+        return self.register(Counter(name, description))
+
+    def gauge(self, name, description, function=None):
+        return self.register(Gauge(name, description, function))
+
+    def histogram(self, name, description, buckets=TIME_BUCKETS):
+        return self.register(Histogram(name, description, buckets))
+
+    def render_prometheus(self):
+        """ Prometheus text exposition format """
+        lines = []
+        for metric in self.metrics.values():
+            lines.append(f'# HELP {metric.name} {metric.description}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            for name, value in metric.samples():
+                lines.append(f'{name} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+path_match_seconds = registry.histogram(
+    'api_tracking_path_match_seconds', 'Time to match the request path against the tracked URLs'
+)
+token_resolution_seconds = registry.histogram(
+    'api_tracking_token_resolution_seconds', 'Time to get the API token for a tracked request'
+)
+persist_seconds = registry.histogram(
+    'api_tracking_persist_seconds', 'Time to save (or buffer) a tracking event'
+)
+flush_batch_size = registry.histogram(
+    'api_tracking_flush_batch_size', 'Number of rows written to the database in each flush', SIZE_BUCKETS
+)
+events_tracked = registry.counter('api_tracking_events_tracked_total', 'Tracking events received')
+events_dropped = registry.counter('api_tracking_events_dropped_total', 'Tracking events lost (errors, collector down)')
+events_spooled = registry.counter(
+    'api_tracking_events_spooled_total', 'Tracking events buffered to be saved later (coalesced, shared counters, collector)'
+)
+events_saved = registry.counter('api_tracking_events_saved_total', 'Tracking rows saved to the database')
+middleware_errors = registry.counter('api_tracking_middleware_errors_total', 'Unexpected errors in the tracking middleware')
+last_flush_timestamp = registry.gauge(
+    'api_tracking_last_flush_timestamp_seconds', 'Last time this worker saved tracking rows (unix time)'
+)
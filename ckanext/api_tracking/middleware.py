@@ -1,17 +1,27 @@
 import logging
 import re
+import time
 
 from ckan import plugins
 from ckan.common import CKANConfig, config
 from ckan.lib import api_token
 from ckan.model import ApiToken
+from ckan.plugins import toolkit
 from ckan.types import CKANApp
 
+from ckanext.api_tracking import metrics
 from ckanext.api_tracking.interfaces import IUsage
+from ckanext.api_tracking.models import CKANURL
+from ckanext.api_tracking.persistence import get_persist_time, reset_persist_time
+from ckanext.api_tracking.profiling import get_profiler
 
 
 log = logging.getLogger(__name__)
 
+SERVER_TIMING_MODES = ('off', 'sysadmin', 'all')
+# Server-Timing header metrics (in this order). app is CKAN itself, the others are the tracking overhead
+SERVER_TIMINGS = ('match', 'app', 'token', 'track', 'persist')
+
 
 class TrackingUsageMiddleware:
     """
@@ -27,13 +37,26 @@ class TrackingUsageMiddleware:
             paths = item.define_paths(paths)
 
         self.valid_paths = paths
+        # Compile the regexs once
+        self.compiled_paths = {
+            tracking_type: [re.compile(regex) for regex in regexs]
+            for tracking_type, regexs in paths.items()
+        }
+        # Handlers reading the request body (ckan_url.get_data) never read more than this
+        self.max_body_size = toolkit.asint(
+            config.get('ckanext.api_tracking.max_body_size', CKANURL.MAX_BODY_SIZE)
+        )
+        # Redirections (e.g. /dataset/ID -> /dataset/NAME/) and failed requests could be ignored
+        self.skip_redirects = toolkit.asbool(config.get('ckanext.api_tracking.skip_redirects', False))
+        self.skip_errors = toolkit.asbool(config.get('ckanext.api_tracking.skip_errors', False))
+        # Add a Server-Timing header with the tracking overhead: off, sysadmin or all
+        self.server_timing = config.get('ckanext.api_tracking.server_timing', 'off')
+        if self.server_timing not in SERVER_TIMING_MODES:
+            log.error(f"Invalid ckanext.api_tracking.server_timing: {self.server_timing}")
+            self.server_timing = 'off'
 
-    def get_api_token(self, environ):
-        """
-        Based on CKAN ckan.views._get_user_for_apitoken
-          and ckan.lib.api_token.get_user_from_token
-        We want the token object (if exists) in this middleware
-        """
+    def get_api_token_header(self, environ):
+        """ Get the raw API token from the request headers (no DB access) """
         apitoken_header_name = config.get("apikey_header_name")
 
         apitoken: str = environ.get(apitoken_header_name)
@@ -53,6 +76,17 @@ class TrackingUsageMiddleware:
         if not apitoken:
             log.debug("No API token found in request headers")
             return None
+        return apitoken
+
+    def get_api_token(self, environ):
+        """
+        Based on CKAN ckan.views._get_user_for_apitoken
+          and ckan.lib.api_token.get_user_from_token
+        We want the token object (if exists) in this middleware
+        """
+        apitoken = self.get_api_token_header(environ)
+        if not apitoken:
+            return None
 
         data = api_token.decode(apitoken)
         if not data or 'jti' not in data:
@@ -70,49 +104,244 @@ class TrackingUsageMiddleware:
         try:
             return self.process_call(environ, start_response)
         except Exception as e:
+            metrics.middleware_errors.inc()
             import traceback
             trace_str_err = traceback.format_exc()
             log.error(f"TrackingUsageMiddleware CALL error: {e}\n{trace_str_err}")
             return self.app(environ, start_response)
 
     def process_call(self, environ, start_response):
+        started = time.perf_counter()
+        # Sampled requests are profiled from here (path matching and parsing included)
+        # until we call CKAN, and again while we track them. CKAN itself is never profiled
+        profiler = get_profiler()
+        profile = profiler.start() if profiler else None
+        try:
+            data = self.prepare(environ)
+        finally:
+            if profile:
+                profiler.pause(profile)
+
+        if not data:
+            # Only the tracked requests count for the sample
+            if profile:
+                profiler.discard(profile)
+            return self.app(environ, start_response)
+        if profiler:
+            profile = profiler.sample(profile)
 
-        # TODO Do not process redirections (e.g. /dataset/ID -> /dataset/NAME/)
+        # We track the request once the response is finished to know how long it took,
+        # the status code and the bytes sent
+        response = TrackedResponse(self, data, started, profile=profile)
+        response.timings['match'] = (response.app_started - started) * 1000
+        app_iter = self.app(environ, response.wrap_start_response(start_response))
+        return response.wrap_app_iter(app_iter)
 
+    def prepare(self, environ):
+        """ Match the path and parse the request. Returns the tracking data or None if we don't track it """
         url_path = environ['PATH_INFO'].strip('/')
         # check all regexs
         data = None
         # Analyze based on the request method
         method = environ.get('REQUEST_METHOD')
-        to_analize = self.valid_paths
-        for tracking_type, regexs in to_analize.items():
-            for regex in regexs:
-                if re.match(regex, url_path):
-                    data = {
-                        'tracking_type': tracking_type,
-                        'environ': environ,
-                    }
-                    # We found a match, no need to keep looking
-                    # This request will be tracked with the plugin function track_METHOD_TYPE
-                    break
+        to_analize = self.compiled_paths
+        with metrics.path_match_seconds.time():
+            for tracking_type, regexs in to_analize.items():
+                for regex in regexs:
+                    if regex.match(url_path):
+                        data = {
+                            'tracking_type': tracking_type,
+                            'environ': environ,
+                        }
+                        # We found a match, no need to keep looking
+                        # This request will be tracked with the plugin function track_METHOD_TYPE
+                        break
 
         if not data:
             # If we are not interested in this path, just pass it through
             # log.debug(f"No tracking URL: {url_path} :: {method}")
-            return self.app(environ, start_response)
+            return None
+
+        # TODO we are not able to identify the user yet
+        # If we managed to do it, we can also track no-api-token users
+
+        # The token is resolved (DB) only if the response needs to be tracked
+        if not self.get_api_token_header(environ):
+            return None
 
         log.debug(f"Tracking start: {url_path} -> {data['tracking_type']} :: {method}")
+        # Parse the request once, all the handlers share it
+        data['ckan_url'] = CKANURL(environ, max_body_size=self.max_body_size)
+        return data
+
+    def should_track(self, status_code):
+        """ Check the response status before any DB work """
+        if status_code is None:
+            return True
+        if self.skip_redirects and 300 <= status_code < 400:
+            return False
+        if self.skip_errors and status_code >= 400:
+            return False
+        return True
+
+    def resolve_api_token(self, environ, timings):
+        started = time.perf_counter()
         api_token = self.get_api_token(environ)
+        elapsed = time.perf_counter() - started
+        metrics.token_resolution_seconds.observe(elapsed)
+        timings['token'] = elapsed * 1000
+        return api_token
 
-        # TODO we are not able to identify the user yet
-        # If we managed to do it, we can also track no-api-token users
+    def server_timing_enabled(self, response):
+        """ Show the Server-Timing header for this response """
+        if self.server_timing == 'all':
+            return True
+        if self.server_timing == 'sysadmin':
+            api_token = response.get_api_token()
+            return bool(api_token and api_token.owner and api_token.owner.sysadmin)
+        return False
 
-        if not api_token:
-            return self.app(environ, start_response)
+    def track(self, response):
+        """ Run the IUsage plugins for a finished request. Never fails """
+        data = response.data
+        profiler = get_profiler()
+        profile = response.profile if profiler and profiler.resume(response.profile) else None
+        try:
+            if not self.should_track(data.get('status_code')):
+                log.debug(f"Skip tracking, response status {data['status_code']}")
+                return
+            api_token = response.get_api_token()
+            if not api_token:
+                return
+            reset_persist_time()
+            started = time.perf_counter()
+            # Allow this and other extensions to do something with this data
+            for item in plugins.PluginImplementations(IUsage):
+                # Allow multiple plugins to track the same data
+                item.track_usage(data, api_token)
+            # The plugin handlers (track) and saving the events (persist) apart
+            persist = get_persist_time() * 1000
+            response.timings['track'] = (time.perf_counter() - started) * 1000 - persist
+            response.timings['persist'] = persist
+        except Exception as e:
+            metrics.middleware_errors.inc()
+            metrics.events_dropped.inc()
+            import traceback
+            trace_str_err = traceback.format_exc()
+            log.error(f"TrackingUsageMiddleware TRACK error: {e}\n{trace_str_err}")
+        finally:
+            if profile:
+                profiler.stop(profile)
 
-        # Allow this and other extensions to do something with this data
-        for item in plugins.PluginImplementations(IUsage):
-            # Allow multiple plugins to track the same data
-            item.track_usage(data, api_token)
 
-        return self.app(environ, start_response)
+class TrackedResponse:
+    """
+    Wrap the WSGI response of a tracked request to know when it is finished,
+    the status code and the number of bytes sent.
+    Buffered responses (with a Content-Length) are complete when the app calls
+    start_response, we track them right away (still in the request context).
+    Streamed responses are tracked once the body is fully sent (or closed).
+    """
+
+    def __init__(self, middleware, data, started, profile=None):
+        self.middleware = middleware
+        self.data = data
+        self.started = started
+        # Paused profile if this request is sampled by the profiler
+        self.profile = profile
+        self.app_started = time.perf_counter()
+        # milliseconds by step, see SERVER_TIMINGS
+        self.timings = {}
+        self.status_code = None
+        self.response_bytes = 0
+        self.finished = False
+        self._api_token = _UNRESOLVED
+
+    def get_api_token(self):
+        """ Resolve the API token once (DB), only when required """
+        if self._api_token is _UNRESOLVED:
+            self._api_token = self.middleware.resolve_api_token(self.data['environ'], self.timings)
+        return self._api_token
+
+    def wrap_start_response(self, start_response):
+        def tracked_start_response(status, headers, exc_info=None):
+            self.timings['app'] = (time.perf_counter() - self.app_started) * 1000
+            self.status_code = _parse_status(status)
+            content_length = None
+            for name, value in headers:
+                if name.lower() == 'content-length':
+                    content_length = value
+            if content_length is not None and content_length.isdigit():
+                self.response_bytes = int(content_length)
+                self.finish()
+            headers = self.add_server_timing(headers)
+            return start_response(status, headers, exc_info)
+        return tracked_start_response
+
+    def add_server_timing(self, headers):
+        """ Add the Server-Timing header if enabled. Streamed responses only include the steps already done """
+        try:
+            if not self.middleware.server_timing_enabled(self):
+                return headers
+        except Exception as e:
+            log.error(f"Unable to check Server-Timing: {e}")
+            return headers
+        value = ', '.join(
+            f'{name};dur={self.timings[name]:.2f}' for name in SERVER_TIMINGS if name in self.timings
+        )
+        return list(headers) + [('Server-Timing', value)]
+
+    def wrap_app_iter(self, app_iter):
+        if self.finished:
+            return app_iter
+        return _ClosingIterator(app_iter, self.count_bytes, self.finish)
+
+    def count_bytes(self, chunk):
+        self.response_bytes += len(chunk)
+
+    def finish(self):
+        if self.finished:
+            return
+        self.finished = True
+        self.data['duration_ms'] = (time.perf_counter() - self.started) * 1000
+        self.data['status_code'] = self.status_code
+        self.data['response_bytes'] = self.response_bytes
+        self.middleware.track(self)
+
+
+_UNRESOLVED = object()
+
+
+def _parse_status(status):
+    """ '200 OK' -> 200 """
+    code = status.split(' ', 1)[0]
+    return int(code) if code.isdigit() else None
+
+
+class _ClosingIterator:
+    """ Count the bytes sent and call a function when the response body is exhausted or closed """
+
+    def __init__(self, app_iter, on_chunk, on_close):
+        self.app_iter = app_iter
+        self._iter = iter(app_iter)
+        self.on_chunk = on_chunk
+        self.on_close = on_close
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            chunk = next(self._iter)
+        except StopIteration:
+            self.on_close()
+            raise
+        self.on_chunk(chunk)
+        return chunk
+
+    def close(self):
+        try:
+            if hasattr(self.app_iter, 'close'):
+                self.app_iter.close()
+        finally:
+            self.on_close()
@@ -0,0 +1,34 @@
+"""Add count and last_timestamp to tracking_usage
+
+Revision ID: ad23724e08bd
+Revises: 95aed1f25344
+Create Date: 2026-10-19 09:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "ad23724e08bd"
+down_revision = "95aed1f25344"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Coalesced events are stored as a single row
+    # with the number of events and the last time we saw it
+    op.add_column(
+        "tracking_usage",
+        sa.Column("count", sa.Integer, nullable=False, server_default="1"),
+    )
+    op.add_column(
+        "tracking_usage",
+        sa.Column("last_timestamp", sa.DateTime, nullable=True),
+    )
+
+
+def downgrade():
+    op.drop_column("tracking_usage", "last_timestamp")
+    op.drop_column("tracking_usage", "count")
@@ -0,0 +1,36 @@
+"""Add request duration and latency rollups
+
+Revision ID: d8026fe20f80
+Revises: ad23724e08bd
+Create Date: 2026-10-19 10:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "d8026fe20f80"
+down_revision = "ad23724e08bd"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column(
+        "tracking_usage",
+        sa.Column("duration_ms", sa.Float, nullable=True),
+    )
+    op.create_table(
+        "tracking_usage_latency",
+        sa.Column("day", sa.Date, primary_key=True),
+        sa.Column("dimension", sa.UnicodeText, primary_key=True),
+        sa.Column("key", sa.UnicodeText, primary_key=True),
+        sa.Column("bucket", sa.Integer, primary_key=True),
+        sa.Column("count", sa.BigInteger, nullable=False, server_default="0"),
+    )
+
+
+def downgrade():
+    op.drop_table("tracking_usage_latency")
+    op.drop_column("tracking_usage", "duration_ms")
@@ -0,0 +1,32 @@
+"""Add response status and size
+
+Revision ID: 2c0334b11cad
+Revises: d8026fe20f80
+Create Date: 2026-10-19 11:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "2c0334b11cad"
+down_revision = "d8026fe20f80"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column(
+        "tracking_usage",
+        sa.Column("status_code", sa.Integer, nullable=True),
+    )
+    op.add_column(
+        "tracking_usage",
+        sa.Column("response_bytes", sa.BigInteger, nullable=True),
+    )
+
+
+def downgrade():
+    op.drop_column("tracking_usage", "response_bytes")
+    op.drop_column("tracking_usage", "status_code")
@@ -0,0 +1,30 @@
+"""Add distinct users sketches
+
+Revision ID: 0cf9ff048e39
+Revises: 2c0334b11cad
+Create Date: 2026-10-19 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "0cf9ff048e39"
+down_revision = "2c0334b11cad"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "tracking_usage_sketch",
+        sa.Column("day", sa.Date, primary_key=True),
+        sa.Column("kind", sa.UnicodeText, primary_key=True),
+        sa.Column("key", sa.UnicodeText, primary_key=True),
+        sa.Column("sketch", sa.LargeBinary, nullable=False),
+    )
+
+
+def downgrade():
+    op.drop_table("tracking_usage_sketch")
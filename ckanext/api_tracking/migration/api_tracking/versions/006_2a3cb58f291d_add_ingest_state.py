@@ -0,0 +1,36 @@
+"""Add ingestion watermark and tracking_usage type index
+
+Revision ID: 2a3cb58f291d
+Revises: 0cf9ff048e39
+Create Date: 2026-10-19 13:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "2a3cb58f291d"
+down_revision = "0cf9ff048e39"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "tracking_ingest_state",
+        sa.Column("name", sa.UnicodeText, primary_key=True),
+        sa.Column("watermark", sa.DateTime, nullable=False),
+        sa.Column("rows", sa.BigInteger, nullable=False, server_default="0"),
+        sa.Column("updated", sa.DateTime, nullable=True),
+    )
+    op.create_index(
+        "ix_tracking_usage_type_timestamp",
+        "tracking_usage",
+        ["tracking_type", "tracking_sub_type", "timestamp"],
+    )
+
+
+def downgrade():
+    op.drop_index("ix_tracking_usage_type_timestamp", table_name="tracking_usage")
+    op.drop_table("tracking_ingest_state")
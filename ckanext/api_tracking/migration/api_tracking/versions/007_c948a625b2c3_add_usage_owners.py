@@ -0,0 +1,45 @@
+"""Add the dataset and organization of the tracked objects
+
+Revision ID: c948a625b2c3
+Revises: 2a3cb58f291d
+Create Date: 2026-10-19 14:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "c948a625b2c3"
+down_revision = "2a3cb58f291d"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Existing rows are filled with: ckan api-tracking backfill-owners
+    op.add_column(
+        "tracking_usage",
+        sa.Column("package_id", sa.UnicodeText, nullable=True),
+    )
+    op.add_column(
+        "tracking_usage",
+        sa.Column("owner_org", sa.UnicodeText, nullable=True),
+    )
+    op.create_index(
+        "ix_tracking_usage_package_timestamp",
+        "tracking_usage",
+        ["package_id", "timestamp"],
+    )
+    op.create_index(
+        "ix_tracking_usage_owner_org_timestamp",
+        "tracking_usage",
+        ["owner_org", "timestamp"],
+    )
+
+
+def downgrade():
+    op.drop_index("ix_tracking_usage_owner_org_timestamp", table_name="tracking_usage")
+    op.drop_index("ix_tracking_usage_package_timestamp", table_name="tracking_usage")
+    op.drop_column("tracking_usage", "owner_org")
+    op.drop_column("tracking_usage", "package_id")
@@ -0,0 +1,29 @@
+"""Add the API usage by organization index
+
+Revision ID: ffe1c1f8a8be
+Revises: c948a625b2c3
+Create Date: 2026-10-19 15:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "ffe1c1f8a8be"
+down_revision = "c948a625b2c3"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index(
+        "ix_tracking_usage_token_owner_org",
+        "tracking_usage",
+        ["owner_org", "object_type", "count"],
+        postgresql_where=sa.text("token_name IS NOT NULL AND owner_org IS NOT NULL"),
+    )
+
+
+def downgrade():
+    op.drop_index("ix_tracking_usage_token_owner_org", table_name="tracking_usage")
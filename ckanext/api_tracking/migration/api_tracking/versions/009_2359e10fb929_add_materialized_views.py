@@ -0,0 +1,139 @@
+"""Add materialized views for the dashboard aggregates
+
+Revision ID: 2359e10fb929
+Revises: ffe1c1f8a8be
+Create Date: 2026-10-19 16:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "2359e10fb929"
+down_revision = "ffe1c1f8a8be"
+branch_labels = None
+depends_on = None
+
+# Same periods as ckanext.api_tracking.queries.views.PERIODS
+PERIODS = "(VALUES (7), (30), (365)) AS periods(days)"
+SINCE = "now() - periods.days * interval '1 day'"
+
+# name: (definition, unique index columns, sort index columns)
+VIEWS = {
+    "tracking_token_usage_by_object_mv": (
+        """
+        SELECT
+            t.object_type,
+            t.object_id,
+            MAX(t.package_id) AS package_id,
+            MAX(t.owner_org) AS owner_org,
+            SUM(t.count) AS total
+        FROM tracking_usage AS t
+        WHERE t.token_name IS NOT NULL AND t.object_type IS NOT NULL AND t.object_id IS NOT NULL
+        GROUP BY t.object_type, t.object_id
+        """,
+        ["object_type", "object_id"],
+        ["object_type", "total"],
+    ),
+    "tracking_token_usage_by_token_mv": (
+        """
+        SELECT
+            t.token_name,
+            t.user_id,
+            SUM(t.count) AS total,
+            COALESCE(SUM(t.response_bytes), 0) AS response_bytes
+        FROM tracking_usage AS t
+        WHERE t.token_name IS NOT NULL
+        GROUP BY t.token_name, t.user_id
+        """,
+        ["token_name", "user_id"],
+        ["total"],
+    ),
+    "tracking_unique_dataset_views_mv": (
+        f"""
+        SELECT
+            periods.days AS period_days,
+            p.id AS package_id,
+            p.name AS package_name,
+            p.title AS package_title,
+            p.owner_org,
+            COUNT(DISTINCT tr.user_key) AS total_views
+        FROM tracking_raw AS tr
+        JOIN package AS p ON p.name = substring(tr.url FROM '/dataset/([^/]+)')
+        CROSS JOIN {PERIODS}
+        WHERE
+            tr.tracking_type = 'page' AND
+            tr.url LIKE '/dataset/%' AND
+            tr.access_timestamp >= {SINCE}
+        GROUP BY periods.days, p.id, p.name, p.title, p.owner_org
+        """,
+        ["period_days", "package_id"],
+        ["period_days", "total_views"],
+    ),
+    "tracking_dataset_views_mv": (
+        f"""
+        SELECT
+            periods.days AS period_days,
+            p.id AS package_id,
+            p.name AS package_name,
+            p.title AS package_title,
+            p.owner_org,
+            SUM(s.count) AS total_views
+        FROM package AS p
+        JOIN tracking_summary AS s ON s.package_id = p.id
+        CROSS JOIN {PERIODS}
+        WHERE
+            s.tracking_date >= {SINCE} AND
+            s.package_id != '~~not~found~~'
+        GROUP BY periods.days, p.id, p.name, p.title, p.owner_org
+        """,
+        ["period_days", "package_id"],
+        ["period_days", "total_views"],
+    ),
+    "tracking_resource_downloads_mv": (
+        f"""
+        SELECT
+            periods.days AS period_days,
+            '/dataset/' || p.name || '/resource/' || r.id AS url,
+            r.id AS resource_id,
+            r.name AS resource_name,
+            p.id AS package_id,
+            p.name AS package_name,
+            p.title AS package_title,
+            p.owner_org,
+            SUM(t.count) AS total_downloads
+        FROM tracking_summary AS t
+        JOIN resource AS r ON r.id = substring(t.url FROM '/resource/([^/?#]+)')
+        JOIN package AS p ON p.id = r.package_id
+        CROSS JOIN {PERIODS}
+        WHERE
+            t.tracking_type = 'download' AND
+            t.tracking_date >= {SINCE}
+        GROUP BY periods.days, r.id, r.name, p.id, p.name, p.title, p.owner_org
+        """,
+        ["period_days", "resource_id"],
+        ["period_days", "total_downloads"],
+    ),
+}
+
+
+def upgrade():
+    op.create_table(
+        "tracking_view_refresh",
+        sa.Column("name", sa.UnicodeText, primary_key=True),
+        sa.Column("refreshed", sa.DateTime, nullable=False),
+        sa.Column("duration_ms", sa.Float, nullable=True),
+    )
+    for name, (definition, unique_columns, sort_columns) in VIEWS.items():
+        # Filled with: ckan api-tracking refresh-views
+        op.execute(f"CREATE MATERIALIZED VIEW {name} AS {definition} WITH NO DATA")
+        # Required by REFRESH MATERIALIZED VIEW CONCURRENTLY
+        op.create_index(f"ix_{name}_unique", name, unique_columns, unique=True)
+        op.create_index(f"ix_{name}_sort", name, sort_columns)
+
+
+def downgrade():
+    for name in reversed(list(VIEWS)):
+        op.execute(f"DROP MATERIALIZED VIEW IF EXISTS {name}")
+    op.drop_table("tracking_view_refresh")
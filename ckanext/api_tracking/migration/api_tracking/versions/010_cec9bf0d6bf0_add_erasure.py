@@ -0,0 +1,53 @@
+"""Add tracking erasure jobs and user and token indexes
+
+Revision ID: cec9bf0d6bf0
+Revises: 2359e10fb929
+Create Date: 2026-10-19 20:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects.postgresql import JSONB
+
+
+# revision identifiers, used by Alembic.
+revision = "cec9bf0d6bf0"
+down_revision = "2359e10fb929"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "tracking_erasure",
+        sa.Column("id", sa.UnicodeText, primary_key=True),
+        sa.Column("field", sa.UnicodeText, nullable=False),
+        sa.Column("value_hash", sa.UnicodeText, nullable=False),
+        sa.Column("mode", sa.UnicodeText, nullable=False),
+        sa.Column("status", sa.UnicodeText, nullable=False, server_default="running"),
+        sa.Column("rows", sa.BigInteger, nullable=False, server_default="0"),
+        sa.Column("days", JSONB, nullable=False, server_default="[]"),
+        sa.Column("created", sa.DateTime, nullable=False, server_default=sa.func.now()),
+        sa.Column("updated", sa.DateTime, nullable=True),
+    )
+    op.create_index("ix_tracking_erasure_value", "tracking_erasure", ["field", "value_hash"])
+    # Each erasure batch is an index range scan
+    op.create_index(
+        "ix_tracking_usage_user_id",
+        "tracking_usage",
+        ["user_id", "id"],
+        postgresql_where=sa.text("user_id IS NOT NULL"),
+    )
+    op.create_index(
+        "ix_tracking_usage_token_name",
+        "tracking_usage",
+        ["token_name", "id"],
+        postgresql_where=sa.text("token_name IS NOT NULL"),
+    )
+
+
+def downgrade():
+    op.drop_index("ix_tracking_usage_token_name", table_name="tracking_usage")
+    op.drop_index("ix_tracking_usage_user_id", table_name="tracking_usage")
+    op.drop_index("ix_tracking_erasure_value", table_name="tracking_erasure")
+    op.drop_table("tracking_erasure")
@@ -0,0 +1,32 @@
+"""Add the write transaction of each tracking row for the change feed
+
+Revision ID: c3ca9ae2a396
+Revises: cec9bf0d6bf0
+Create Date: 2026-10-19 21:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "c3ca9ae2a396"
+down_revision = "cec9bf0d6bf0"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Added without a default and then set: the existing rows are not rewritten (txid is empty)
+    op.add_column("tracking_usage", sa.Column("txid", sa.BigInteger, nullable=True))
+    op.alter_column("tracking_usage", "txid", server_default=sa.text("txid_current()"))
+    op.create_index(
+        "ix_tracking_usage_changes",
+        "tracking_usage",
+        [sa.text("COALESCE(txid, 0)"), "id"],
+    )
+
+
+def downgrade():
+    op.drop_index("ix_tracking_usage_changes", table_name="tracking_usage")
+    op.drop_column("tracking_usage", "txid")
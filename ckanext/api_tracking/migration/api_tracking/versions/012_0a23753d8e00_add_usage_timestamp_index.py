@@ -0,0 +1,23 @@
+"""Add tracking_usage timestamp index for the archive and the exports
+
+Revision ID: 0a23753d8e00
+Revises: c3ca9ae2a396
+Create Date: 2026-10-19 22:00:00.000000
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = "0a23753d8e00"
+down_revision = "c3ca9ae2a396"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index("ix_tracking_usage_timestamp_id", "tracking_usage", ["timestamp", "id"])
+
+
+def downgrade():
+    op.drop_index("ix_tracking_usage_timestamp_id", table_name="tracking_usage")
@@ -0,0 +1,24 @@
+"""Keep the erased value in the erasure until it is done
+
+Revision ID: 5b1f0e7c9d24
+Revises: 0a23753d8e00
+Create Date: 2026-10-20 10:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "5b1f0e7c9d24"
+down_revision = "0a23753d8e00"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column("tracking_erasure", sa.Column("value", sa.UnicodeText, nullable=True))
+
+
+def downgrade():
+    op.drop_column("tracking_erasure", "value")
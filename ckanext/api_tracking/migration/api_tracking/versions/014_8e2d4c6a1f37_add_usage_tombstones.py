@@ -0,0 +1,31 @@
+"""Add tracking_usage_deleted, the tombstones of the erased rows for the change feed
+
+Revision ID: 8e2d4c6a1f37
+Revises: 5b1f0e7c9d24
+Create Date: 2026-10-20 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "8e2d4c6a1f37"
+down_revision = "5b1f0e7c9d24"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "tracking_usage_deleted",
+        sa.Column("id", sa.UnicodeText, primary_key=True),
+        sa.Column("txid", sa.BigInteger, nullable=False, server_default=sa.text("txid_current()")),
+        sa.Column("deleted", sa.DateTime, nullable=False, server_default=sa.func.now()),
+    )
+    op.create_index("ix_tracking_usage_deleted_changes", "tracking_usage_deleted", ["txid", "id"])
+
+
+def downgrade():
+    op.drop_index("ix_tracking_usage_deleted_changes", table_name="tracking_usage_deleted")
+    op.drop_table("tracking_usage_deleted")
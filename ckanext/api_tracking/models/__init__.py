@@ -1,4 +1,9 @@
 # flake8: noqa: F401
 
-from ckanext.api_tracking.models.tracking import TrackingUsage
+from ckanext.api_tracking.models.tracking import TrackingUsage, TrackingUsageDeleted
+from ckanext.api_tracking.models.erasure import TrackingErasure
+from ckanext.api_tracking.models.ingest import TrackingIngestState
+from ckanext.api_tracking.models.latency import TrackingUsageLatency
+from ckanext.api_tracking.models.sketch import TrackingUsageSketch
 from ckanext.api_tracking.models.url import CKANURL
+from ckanext.api_tracking.models.views import TrackingViewRefresh
@@ -0,0 +1,53 @@
+from sqlalchemy import BigInteger, Column, DateTime, Index
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.sql import func
+from sqlalchemy.types import UnicodeText
+
+from ckan import model
+from ckan.model.types import make_uuid
+
+from ckanext.api_tracking.models.tracking import Base
+
+
+class TrackingErasure(Base):
+    """
+    Erasure (or pseudonymisation) of the tracking history of a user or an API token
+    (see ckanext.api_tracking.queries.erasure)
+    """
+    __tablename__ = "tracking_erasure"
+    __table_args__ = (
+        Index('ix_tracking_erasure_value', 'field', 'value_hash'),
+    )
+
+    id = Column(UnicodeText, primary_key=True, default=make_uuid)
+    # user_id or token_name
+    field = Column(UnicodeText, nullable=False)
+    # Keyed hash of the value, to find the erasure again and to apply it to the archived rows
+    value_hash = Column(UnicodeText, nullable=False)
+    # The erased value, only kept until the erasure is done (the background job reads it from here)
+    value = Column(UnicodeText, nullable=True)
+    # erase or pseudonymize
+    mode = Column(UnicodeText, nullable=False)
+    # running, archives (rewriting the archive files), rebuilding (the rollups) or done
+    status = Column(UnicodeText, nullable=False, default='running')
+    rows = Column(BigInteger, nullable=False, default=0)
+    # Days (YYYY-MM-DD) with changed rows, their rollups are rebuilt at the end
+    days = Column(JSONB, nullable=False, default=list)
+    created = Column(DateTime, nullable=False, server_default=func.now())
+    updated = Column(DateTime, nullable=True)
+
+    @classmethod
+    def get(cls, id):
+        return model.Session.query(cls).get(id)
+
+    def dictize(self):
+        return {
+            'id': self.id,
+            'field': self.field,
+            'mode': self.mode,
+            'status': self.status,
+            'rows': self.rows,
+            'days': len(self.days or []),
+            'created': self.created.isoformat() if self.created else None,
+            'updated': self.updated.isoformat() if self.updated else None,
+        }
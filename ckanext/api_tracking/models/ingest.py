@@ -0,0 +1,18 @@
+from sqlalchemy import BigInteger, Column, DateTime
+from sqlalchemy.types import UnicodeText
+
+from ckanext.api_tracking.models.tracking import Base
+
+
+class TrackingIngestState(Base):
+    """
+    Watermark of the incremental ingestion of other tracking sources
+    (e.g. CKAN core tracking_raw, see ckanext.api_tracking.queries.ingest)
+    """
+    __tablename__ = "tracking_ingest_state"
+
+    name = Column(UnicodeText, primary_key=True)
+    # Everything up to this timestamp (included) has been ingested
+    watermark = Column(DateTime, nullable=False)
+    rows = Column(BigInteger, nullable=False, default=0)
+    updated = Column(DateTime, nullable=True)
@@ -0,0 +1,20 @@
+from sqlalchemy import BigInteger, Column, Date, Integer
+from sqlalchemy.types import UnicodeText
+
+from ckanext.api_tracking.models.tracking import Base
+
+
+class TrackingUsageLatency(Base):
+    """
+    Daily latency rollups (see ckanext.api_tracking.latency)
+    For each day and dimension (action, token or dataset) we keep how many
+    requests took a duration in each histogram bucket
+    """
+    __tablename__ = "tracking_usage_latency"
+
+    day = Column(Date, primary_key=True)
+    # action | token | dataset
+    dimension = Column(UnicodeText, primary_key=True)
+    key = Column(UnicodeText, primary_key=True)
+    bucket = Column(Integer, primary_key=True)
+    count = Column(BigInteger, nullable=False, default=0)
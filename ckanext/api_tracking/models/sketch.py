@@ -0,0 +1,18 @@
+from sqlalchemy import Column, Date, LargeBinary
+from sqlalchemy.types import UnicodeText
+
+from ckanext.api_tracking.models.tracking import Base
+
+
+class TrackingUsageSketch(Base):
+    """
+    Daily HyperLogLog sketches (see ckanext.api_tracking.hll)
+    to count distinct users for any period
+    """
+    __tablename__ = "tracking_usage_sketch"
+
+    day = Column(Date, primary_key=True)
+    # dataset_viewers (key: package id) | active_users (key: empty)
+    kind = Column(UnicodeText, primary_key=True)
+    key = Column(UnicodeText, primary_key=True)
+    sketch = Column(LargeBinary, nullable=False)
@@ -1,10 +1,10 @@
 import logging
 
-from sqlalchemy import Column, DateTime
+from sqlalchemy import BigInteger, Column, DateTime, Float, Index, Integer
 from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.ext.mutable import MutableDict
-from sqlalchemy.sql import func
+from sqlalchemy.sql import func, text
 from sqlalchemy.types import UnicodeText
 
 from ckan import model
@@ -22,6 +22,21 @@ class TrackingUsage(Base):
     The CKAN core tracking method is not sufficient for our needs.
     """
     __tablename__ = "tracking_usage"
+    __table_args__ = (
+        Index('ix_tracking_usage_type_timestamp', 'tracking_type', 'tracking_sub_type', 'timestamp'),
+        # Time ordered batches (archive) and time range exports
+        Index('ix_tracking_usage_timestamp_id', 'timestamp', 'id'),
+        Index('ix_tracking_usage_package_timestamp', 'package_id', 'timestamp'),
+        Index('ix_tracking_usage_owner_org_timestamp', 'owner_org', 'timestamp'),
+        # Index only scans for the API usage by organization
+        Index(
+            'ix_tracking_usage_token_owner_org', 'owner_org', 'object_type', 'count',
+            postgresql_where=text('token_name IS NOT NULL AND owner_org IS NOT NULL'),
+        ),
+        # Erasure batches by user or token (see ckanext.api_tracking.queries.erasure)
+        Index('ix_tracking_usage_user_id', 'user_id', 'id', postgresql_where=text('user_id IS NOT NULL')),
+        Index('ix_tracking_usage_token_name', 'token_name', 'id', postgresql_where=text('token_name IS NOT NULL')),
+    )
 
     id = Column(UnicodeText, primary_key=True, default=make_uuid)
     timestamp = Column(DateTime, nullable=False, server_default=func.now())
@@ -40,6 +55,22 @@ class TrackingUsage(Base):
     object_id = Column(UnicodeText, nullable=True)
     # More information about the usage
     extras = Column(MutableDict.as_mutable(JSONB), nullable=True)
+    # Identical events can be coalesced in a single row (see ckanext.api_tracking.coalesce)
+    # count is the number of events and timestamp/last_timestamp the first and last seen
+    count = Column(Integer, nullable=False, default=1, server_default="1")
+    last_timestamp = Column(DateTime, nullable=True)
+    # Time to process the request (milliseconds). For coalesced rows, the total for all events
+    duration_ms = Column(Float, nullable=True)
+    # Response status and body size (total for coalesced rows)
+    status_code = Column(Integer, nullable=True)
+    response_bytes = Column(BigInteger, nullable=True)
+    # Dataset and organization of the object (see ckanext.api_tracking.owners)
+    # For organizations, only owner_org is defined
+    package_id = Column(UnicodeText, nullable=True)
+    owner_org = Column(UnicodeText, nullable=True)
+    # Write transaction, for the change feed (see ckanext.api_tracking.queries.changes)
+    # Empty for the rows saved before the change feed
+    txid = Column(BigInteger, nullable=True, server_default=text('txid_current()'))
 
     def dictize(self):
         dct = {k: v for k, v in self.__dict__.items() if not k.startswith("_")}
@@ -50,3 +81,39 @@ class TrackingUsage(Base):
         model.Session.commit()
         model.Session.refresh(self)
         return self
+
+    @classmethod
+    def bulk_save(cls, data_dicts):
+        """ Insert many tracking usages in a single statement """
+        fields = [column.name for column in cls.__table__.columns]
+        rows = []
+        for data_dict in data_dicts:
+            row = {field: data_dict[field] for field in fields if data_dict.get(field) is not None}
+            row.setdefault('id', make_uuid())
+            row.setdefault('count', 1)
+            rows.append(row)
+        if not rows:
+            return 0
+        model.Session.bulk_insert_mappings(cls, rows)
+        model.Session.commit()
+        return len(rows)
+
+
+# Change feed order (see ckanext.api_tracking.queries.changes)
+Index('ix_tracking_usage_changes', func.coalesce(TrackingUsage.txid, 0), TrackingUsage.id)
+
+
+class TrackingUsageDeleted(Base):
+    """
+    Tombstones of the erased tracking_usage rows, so the change feed also sends the deletions.
+    The rows moved to the archive files are not included (they are still in the history).
+    """
+    __tablename__ = "tracking_usage_deleted"
+    __table_args__ = (
+        Index('ix_tracking_usage_deleted_changes', 'txid', 'id'),
+    )
+
+    id = Column(UnicodeText, primary_key=True)
+    # Write transaction of the deletion
+    txid = Column(BigInteger, nullable=False, server_default=text('txid_current()'))
+    deleted = Column(DateTime, nullable=False, server_default=func.now())
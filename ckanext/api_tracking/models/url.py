@@ -2,6 +2,8 @@ import json
 import logging
 from urllib.parse import unquote_plus
 
+from werkzeug.datastructures import ImmutableMultiDict
+
 
 log = logging.getLogger(__name__)
 
@@ -9,14 +11,37 @@ log = logging.getLogger(__name__)
 class CKANURL:
     """ This is a CKAN URL we get in the middleware from which we want to track something
         This is a class helper for common CKAN URL operations
+        It's built once per request in the middleware and shared by all the IUsage handlers.
+        Public attributes are read-only, the path parts, query string and request data
+        are parsed lazily and only once.
     """
 
-    def __init__(self, environ):
+    # Max request body size (bytes) we are willing to read to track a request
+    MAX_BODY_SIZE = 64 * 1024
+
+    __slots__ = (
+        'environ', 'url', 'method', 'max_body_size',
+        'request', '_parts', '_query', '_json_data', '_data',
+    )
+    _READ_ONLY = ('environ', 'url', 'method', 'max_body_size')
+
+    def __init__(self, environ, max_body_size=None):
         self.environ = environ
         # Get the wsgi.input data and ensure it is available for the next request
         self.url = environ.get("PATH_INFO", "").strip('/')
         self.method = environ.get("REQUEST_METHOD", "GET")
+        self.max_body_size = self.MAX_BODY_SIZE if max_body_size is None else max_body_size
         self.request = None
+        # Parsed URL parts, query string, JSON body and request data, we only parse them once
+        self._parts = None
+        self._query = None
+        self._json_data = None
+        self._data = None
+
+    def __setattr__(self, name, value):
+        if name in self._READ_ONLY and hasattr(self, name):
+            raise AttributeError(f'CKANURL.{name} is read-only')
+        object.__setattr__(self, name, value)
 
     def __str__(self):
         return f'{self.method} :: {self.url}'
@@ -55,25 +80,39 @@ class CKANURL:
         }
         return base_paths
 
+    @property
+    def parts(self):
+        """ URL parts split by "/" """
+        if self._parts is None:
+            self._parts = tuple(self.url.split('/'))
+        return self._parts
+
+    @property
+    def query(self):
+        """ Parsed query string as a MultiDict (keys can be repeated)
+            Parameters without "=" have a None value
+        """
+        if self._query is None:
+            params = []
+            for param in self.environ.get('QUERY_STRING', '').split('&'):
+                if not param:
+                    continue
+                # Values can include "="
+                key, sep, value = param.partition('=')
+                params.append((unquote_plus(key), unquote_plus(value) if sep else None))
+            self._query = ImmutableMultiDict(params)
+        return self._query
+
     def get_query_string(self):
-        query_args = self.environ.get('QUERY_STRING')
-        if not query_args:
-            return {}
-        params = query_args.split('&')
-        ret = {}
-        for param in params:
-            parts = param.split('=')
-            if len(parts) == 2:
-                key, value = param.split('=')
-                value = unquote_plus(value)
-            elif len(parts) == 1:
-                key = parts[0]
-                value = None
-            ret[key] = value
-        return ret
+        """ Query string as a new dict. For repeated keys, we get the first value """
+        return self.query.to_dict()
 
     def get_query_param(self, key):
-        return self.get_query_string().get(key)
+        return self.query.get(key)
+
+    def get_query_params(self, key):
+        """ All the values for a (probably repeated) query param """
+        return self.query.getlist(key)
 
     def get_api_action(self):
         """
@@ -82,8 +121,7 @@ class CKANURL:
         If it is not an API action, return None
         Returns a tuple with the API version and action name
         """
-        url_path = self.url
-        url_parts = url_path.split('/')
+        url_parts = self.parts
         if url_parts[0] != 'api':
             return None, None
         if len(url_parts) == 3:
@@ -103,9 +141,8 @@ class CKANURL:
         return api_version, action_name
 
     def get_url_part(self, index):
-        """ Split the URL in parts by "/" """
-        parts = self.url.split('/')
-        return parts[index]
+        """ Get a URL part (split by "/") """
+        return self.parts[index]
 
     def _extract_query_data(self):
         """Extract and return query string data"""
@@ -117,12 +154,18 @@ class CKANURL:
 
     def _extract_json_data(self, request):
         """Extract JSON data from request"""
-        try:
-            return request.get_json(cache=True) or {}
-        except Exception as e:
-            error = f"Error parsing JSON data: {e}"
-            log.error(error)
-            return {}
+        if self._json_data is not None:
+            # Already parsed at is_json_request
+            data = self._json_data
+        else:
+            try:
+                data = request.get_json(cache=True)
+            except Exception as e:
+                error = f"Error parsing JSON data: {e}"
+                log.error(error)
+                return {}
+        # We only merge JSON objects
+        return dict(data) if isinstance(data, dict) else {}
 
     def _extract_form_data(self, request):
         """Extract form data from request"""
@@ -143,17 +186,51 @@ class CKANURL:
                 data[key] = value[0]
         return data
 
+    def body_allowed(self):
+        """
+        Check if we can read the request body with a bounded memory cost.
+        We never read multipart bodies (they include files, e.g. resource_create uploads)
+        nor bodies larger than max_body_size
+        """
+        content_type = self.environ.get('CONTENT_TYPE') or ''
+        if content_type.startswith('multipart/'):
+            log.debug("API tracking: multipart body ignored")
+            return False
+        content_length = self.environ.get('CONTENT_LENGTH')
+        if content_length:
+            try:
+                content_length = int(content_length)
+            except ValueError:
+                return False
+            if content_length > self.max_body_size:
+                log.debug(f"API tracking: body too large to inspect ({content_length} bytes)")
+                return False
+        elif self.environ.get('wsgi.input_terminated'):
+            # Chunked request with unknown size
+            return False
+        return True
+
     def get_data(self):
         """
         Get POST or form or args params from the request environ
+        This is lazy, handlers needing the request data should call it.
+        The request body is only read if it is safe (see body_allowed)
+        and the result is cached for the next calls.
+        Each call returns a copy, a handler changing it does not change the data of the next handlers.
         """
+        if self._data is None:
+            self._data = self._read_data()
+        return dict(self._data)
+
+    def _read_data(self):
+
         log.debug("Extracting data from request")
 
         # Start with query string data
         data = self._extract_query_data()
 
         # Only check body for POST/PUT/PATCH methods
-        if self.method not in ('POST', 'PUT', 'PATCH', 'DELETE'):
+        if self.method not in ('POST', 'PUT', 'PATCH', 'DELETE') or not self.body_allowed():
             return self._clean_list_values(data)
 
         # Get werkzeug request object
@@ -161,7 +238,7 @@ class CKANURL:
         if not self.request:
             error = "API-Tracking No werkzeug.request found in environ"
             log.error(error)
-            return data
+            return self._clean_list_values(data)
 
         # Extract request body data based on content type
         extra_data = None
@@ -193,11 +270,12 @@ class CKANURL:
             return False
 
         # Case 3: Verify JSON validity WITHOUT consuming stream
+        # The parsed data is kept so we don't parse the body again
         try:
             # Use cached data if available (Flask's request.get_data(cache=True))
             body = self.request.get_data(cache=True)
-            json.loads(body)  # Test parse (body remains untouched)
+            self._json_data = json.loads(body)
             return True
-        except json.JSONDecodeError:
+        except (json.JSONDecodeError, UnicodeDecodeError):
             log.error("Invalid JSON in request body")
             return False
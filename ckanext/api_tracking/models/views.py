@@ -0,0 +1,16 @@
+from sqlalchemy import Column, DateTime, Float
+from sqlalchemy.types import UnicodeText
+
+from ckanext.api_tracking.models.tracking import Base
+
+
+class TrackingViewRefresh(Base):
+    """
+    Last refresh of each materialized view (see ckanext.api_tracking.queries.views)
+    """
+    __tablename__ = "tracking_view_refresh"
+
+    name = Column(UnicodeText, primary_key=True)
+    # Start of the last refresh, the data is up to date until this time
+    refreshed = Column(DateTime, nullable=False)
+    duration_ms = Column(Float, nullable=True)
@@ -0,0 +1,116 @@
+"""
+Dataset and organization of the tracked objects, saved in each tracking row (package_id, owner_org).
+Reports by dataset or organization then filter an indexed column instead of joining
+tracking_usage.object_id with the resource, package and group tables.
+Owners are resolved at write time with a small in-memory cache (most requests hit the same objects).
+"""
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from ckan import model
+from ckan.plugins import toolkit
+from sqlalchemy import or_, select
+
+
+log = logging.getLogger(__name__)
+
+OWNER_FIELDS = ('package_id', 'owner_org')
+OWNED_TYPES = ('dataset', 'resource', 'organization')
+
+
+def lookup_owners(object_type, object_id):
+    """ Get (package_id, owner_org) from the database. None for unknown objects
+        Lookups run on their own connection, an error never touches the session
+        of the request (tracking_usage_create is called in the request teardown)
+    """
+    if object_type == 'dataset':
+        query = select(model.Package.id, model.Package.owner_org).where(
+            or_(model.Package.id == object_id, model.Package.name == object_id)
+        )
+    elif object_type == 'resource':
+        query = select(model.Resource.package_id, model.Package.owner_org).join(
+            model.Package, model.Package.id == model.Resource.package_id
+        ).where(model.Resource.id == object_id)
+    elif object_type == 'organization':
+        query = select(model.Group.id).where(
+            or_(model.Group.id == object_id, model.Group.name == object_id),
+            model.Group.is_organization.is_(True),
+        )
+    else:
+        return None, None
+    with model.meta.engine.connect() as connection:
+        row = connection.execute(query.limit(1)).first()
+    if row is None:
+        return None, None
+    return (None, row[0]) if object_type == 'organization' else tuple(row)
+
+
+class OwnerResolver:
+    """ Cached object -> (package_id, owner_org) lookups
+        Datasets can move to another organization, entries expire after ttl seconds
+    """
+
+    def __init__(self, ttl=300, max_size=10000, lookup=lookup_owners):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.lookup = lookup
+        # (object_type, object_id) -> (expires, owners)
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._cache)
+
+    def resolve(self, object_type, object_id, now=None):
+        if object_type not in OWNED_TYPES or not object_id:
+            return None, None
+        now = now or time.monotonic()
+        key = (object_type, object_id)
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached and cached[0] > now:
+                self._cache.move_to_end(key)
+                return cached[1]
+        owners = self.lookup(object_type, object_id)
+        with self._lock:
+            self._cache[key] = (now + self.ttl, owners)
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.max_size:
+                self._cache.popitem(last=False)
+        return owners
+
+    def add_owners(self, data_dict):
+        """ Set package_id and owner_org in a tracking_usage_create data dict (if not defined) """
+        if any(data_dict.get(field) for field in OWNER_FIELDS):
+            return data_dict
+        try:
+            package_id, owner_org = self.resolve(data_dict.get('object_type'), data_dict.get('object_id'))
+        except Exception as e:
+            # Never lose the event, the backfill job can fix it later
+            log.error(f'Unable to resolve the owners of {data_dict.get("object_id")}: {e}')
+            return data_dict
+        data_dict['package_id'] = package_id
+        data_dict['owner_org'] = owner_org
+        return data_dict
+
+
+_resolver = None
+
+
+def get_owner_resolver():
+    """ Get the process owner resolver or None if disabled
+        Config:
+            ckanext.api_tracking.resolve_owners: default true
+            ckanext.api_tracking.owners_cache_ttl: seconds, default 300
+            ckanext.api_tracking.owners_cache_size: max objects in memory, default 10000
+    """
+    global _resolver
+    if not toolkit.asbool(toolkit.config.get('ckanext.api_tracking.resolve_owners', True)):
+        return None
+    if _resolver is None:
+        ttl = toolkit.asint(toolkit.config.get('ckanext.api_tracking.owners_cache_ttl', 300))
+        max_size = toolkit.asint(toolkit.config.get('ckanext.api_tracking.owners_cache_size', 10000))
+        _resolver = OwnerResolver(ttl=ttl, max_size=max_size)
+    return _resolver
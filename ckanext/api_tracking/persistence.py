@@ -0,0 +1,293 @@
+"""
+Save tracking events to the database
+"""
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+
+from ckan import model, plugins
+from ckan.plugins import toolkit
+
+from ckanext.api_tracking import metrics
+from ckanext.api_tracking.coalesce import get_coalescer
+from ckanext.api_tracking.collector import get_sender
+from ckanext.api_tracking.downloads import get_download_sessions, is_partial_download
+from ckanext.api_tracking.models import TrackingUsage
+from ckanext.api_tracking.owners import get_owner_resolver
+from ckanext.api_tracking.shared_counters import get_flush_interval, get_shared_counters
+
+
+log = logging.getLogger(__name__)
+
+# Time spent saving events by each thread (see the middleware Server-Timing header)
+_persist_time = threading.local()
+
+
+def reset_persist_time():
+    _persist_time.seconds = 0.0
+
+
+def get_persist_time():
+    """ Seconds spent in save_tracking_usage by this thread since reset_persist_time """
+    return getattr(_persist_time, 'seconds', 0.0)
+
+
+def save_tracking_usage(data_dict):
+    """ Save a tracking event (tracking_usage_create data_dict)
+        If the collector is enabled, the event is sent to it and we never wait on the DB.
+        If shared counters are enabled, the event is counted in the node shared table
+        and saved later by the flush thread of the elected worker.
+        If coalescing is enabled, the event is buffered and we only save
+        the events whose coalescing window is closed.
+        Partial (Range) resource downloads are merged first into a single logical download.
+        Returns the list of saved tracking usages (dicts)
+    """
+    metrics.events_tracked.inc()
+    started = time.perf_counter()
+    try:
+        with metrics.persist_seconds.time():
+            return _save_or_spool(data_dict)
+    finally:
+        _persist_time.seconds = get_persist_time() + time.perf_counter() - started
+
+
+def _save_or_spool(data_dict):
+    partial = is_partial_download(data_dict)
+    data_dict.pop('range_request', None)
+    sessions = get_download_sessions()
+    if sessions is None:
+        return _save_tracking_usage(data_dict)
+    if partial:
+        metrics.events_spooled.inc()
+        events = sessions.add(data_dict)
+        start_flush_thread()
+    else:
+        events = sessions.pop_finished() + [data_dict]
+    saved = []
+    for event in events:
+        saved.extend(_save_tracking_usage(event))
+    return saved
+
+
+def _save_tracking_usage(data_dict):
+    sender = get_sender()
+    if sender is not None:
+        if sender.send(data_dict):
+            metrics.events_spooled.inc()
+        else:
+            metrics.events_dropped.inc()
+        return []
+
+    shared = get_shared_counters()
+    if shared is not None:
+        if shared.increment(data_dict):
+            metrics.events_spooled.inc()
+            # Saved by the flush thread, never in the request
+            start_flush_thread()
+            return []
+        log.warning('Shared counters table is full, saving the event directly')
+
+    coalescer = get_coalescer()
+    if coalescer is None or shared is not None:
+        events = [data_dict]
+    else:
+        metrics.events_spooled.inc()
+        events = coalescer.add(data_dict)
+        start_flush_thread()
+
+    return _save_events(events)
+
+
+def flush_pending():
+    """ Save all events waiting in the download sessions and the coalescing buffer """
+    saved = []
+    sessions = get_download_sessions()
+    if sessions is not None:
+        for event in sessions.flush():
+            saved.extend(_save_tracking_usage(event))
+    coalescer = get_coalescer()
+    if coalescer is not None:
+        saved.extend(_save_events(coalescer.flush()))
+    return saved
+
+
+def flush_expired():
+    """ Save the finished downloads, the buffered events whose window is closed
+        and the shared counters if it's time (even if the worker gets no more requests)
+    """
+    saved = []
+    sessions = get_download_sessions()
+    if sessions is not None:
+        for event in sessions.pop_finished():
+            saved.extend(_save_tracking_usage(event))
+    coalescer = get_coalescer()
+    if coalescer is not None:
+        saved.extend(_save_events(coalescer.pop_ready()))
+    saved.extend(flush_shared_counters())
+    return saved
+
+
+class FlushThread(threading.Thread):
+    """ Call flush every interval seconds, so buffered events are saved after their window
+        and not only when the worker gets a new request
+    """
+
+    def __init__(self, interval, flush):
+        super().__init__(name='api-tracking-flush', daemon=True)
+        self.interval = interval
+        self.flush = flush
+        self.pid = os.getpid()
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                self.flush()
+            except Exception as e:
+                log.error(f'Unable to save pending tracking events: {e}')
+            finally:
+                # This thread has its own session (and connection), do not keep it
+                model.Session.remove()
+
+    def stop(self):
+        self.stopped.set()
+
+
+_flush_thread = None
+_flush_thread_lock = threading.Lock()
+
+
+def start_flush_thread():
+    """ Start the flush thread of this worker (once per process, threads do not survive a fork)
+        Config:
+            ckanext.api_tracking.background_flush_interval: seconds, default 5. 0 to disable
+    """
+    global _flush_thread
+    if _flush_thread is not None and _flush_thread.pid == os.getpid():
+        return _flush_thread
+    interval = toolkit.asint(toolkit.config.get('ckanext.api_tracking.background_flush_interval', 5))
+    if interval <= 0:
+        return None
+    with _flush_thread_lock:
+        if _flush_thread is None or _flush_thread.pid != os.getpid():
+            _flush_thread = FlushThread(interval, flush_expired)
+            _flush_thread.start()
+    return _flush_thread
+
+
+def flush_shared_counters(force=False):
+    """ Save the shared counters if this worker is the elected flusher and it's time to do it """
+    shared = get_shared_counters()
+    if shared is None:
+        return []
+    interval = 0 if force else get_flush_interval()
+    if not force and not shared.flush_due(interval):
+        return []
+    events = shared.drain_if_due(interval)
+    if not events:
+        return []
+    log.info(f'Saving {len(events)} shared tracking counters')
+
+    def restore(unsaved):
+        # Count them again, the next flush saves them
+        model.Session.rollback()
+        lost = shared.restore(unsaved)
+        log.error(f'Unable to save {len(unsaved)} shared tracking counters, {len(lost)} lost')
+        metrics.events_dropped.inc(len(lost))
+
+    return _save_events(events, on_error=restore)
+
+
+def _save_events(events, on_error=None):
+    """ Save the events one by one
+        on_error: called with the events not saved yet if one fails (the error is raised again)
+    """
+    # IUsage uses this module
+    from ckanext.api_tracking.interfaces import IUsage
+
+    if not events:
+        return []
+    metrics.flush_batch_size.observe(len(events))
+    saved = []
+    done = 0
+    try:
+        for event in events:
+            ctx = {'ignore_auth': True}
+            tu = toolkit.get_action('tracking_usage_create')(ctx, event)
+            done += 1
+            if not tu:
+                continue
+            saved.append(tu)
+            for item in plugins.PluginImplementations(IUsage):
+                # we can do something after saving the TrackingUsage
+                if hasattr(item, 'after_track_usage_save'):
+                    item.after_track_usage_save(tu)
+    except Exception:
+        if on_error is not None:
+            on_error(events[done:])
+        raise
+    metrics.events_saved.inc(len(saved))
+    metrics.last_flush_timestamp.set(time.time())
+    return saved
+
+
+def bulk_save_tracking_usage(events):
+    """ Save many events in a single statement.
+        Used by the collector, plugins after_track_usage_save hooks are not called
+    """
+    resolver = get_owner_resolver()
+    if resolver is not None:
+        events = [resolver.add_owners(dict(event)) for event in events]
+    try:
+        saved = TrackingUsage.bulk_save(events)
+    except Exception:
+        model.Session.rollback()
+        metrics.events_dropped.inc(len(events))
+        raise
+    log.info(f'Saved {saved} tracking events')
+    metrics.flush_batch_size.observe(saved)
+    metrics.events_saved.inc(saved)
+    metrics.last_flush_timestamp.set(time.time())
+    return saved
+
+
+def _queue_depth():
+    """ Events waiting in this worker to be saved """
+    coalescer = get_coalescer()
+    sessions = get_download_sessions()
+    return (len(coalescer) if coalescer else 0) + (len(sessions) if sessions else 0)
+
+
+metrics.registry.gauge('api_tracking_queue_depth', 'Tracking events waiting in memory to be saved', _queue_depth)
+
+
+def health_summary():
+    """ Health of the tracking pipeline for this worker """
+    now = time.time()
+    last_flush = metrics.last_flush_timestamp.get() or None
+    coalescer = get_coalescer()
+    oldest = coalescer.oldest_timestamp() if coalescer else None
+    shared = get_shared_counters()
+    shared_last_flush = shared.last_flush if shared else None
+
+    # Lag is the age of the oldest event not saved yet
+    lag = None
+    if oldest:
+        lag = now - oldest.timestamp()
+    elif shared_last_flush:
+        lag = now - shared_last_flush
+
+    return {
+        'last_flush': datetime.fromtimestamp(last_flush).isoformat() if last_flush else None,
+        'seconds_since_last_flush': round(now - last_flush, 3) if last_flush else None,
+        'lag_seconds': round(lag, 3) if lag is not None else None,
+        'queue_depth': _queue_depth(),
+        'shared_counters_last_flush': datetime.fromtimestamp(shared_last_flush).isoformat() if shared_last_flush else None,
+        'collector_enabled': get_sender() is not None,
+        'events_tracked': metrics.events_tracked.value,
+        'events_saved': metrics.events_saved.value,
+        'events_spooled': metrics.events_spooled.value,
+        'events_dropped': metrics.events_dropped.value,
+    }
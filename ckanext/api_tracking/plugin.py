@@ -3,7 +3,7 @@ from ckan import plugins
 from ckan.plugins import toolkit
 from ckan.lib.plugins import DefaultTranslation
 
-from ckanext.api_tracking import blueprints
+from ckanext.api_tracking import blueprints, cli, dashboard, query_stats
 from ckanext.api_tracking.interfaces import IUsage
 from ckanext.api_tracking.middleware import TrackingUsageMiddleware
 from ckanext.api_tracking.auth import base as auth_base
@@ -21,6 +21,7 @@ class TrackingPlugin(plugins.SingletonPlugin, DefaultTranslation):
     plugins.implements(plugins.IActions)
     plugins.implements(plugins.IAuthFunctions)
     plugins.implements(plugins.IBlueprint)
+    plugins.implements(plugins.IClick)
     plugins.implements(plugins.IConfigurer)
     plugins.implements(plugins.IMiddleware, inherit=True)
     plugins.implements(plugins.ISignal)
@@ -33,6 +34,10 @@ class TrackingPlugin(plugins.SingletonPlugin, DefaultTranslation):
         toolkit.add_template_directory(config_, "templates")
         toolkit.add_public_directory(config_, "public")
         toolkit.add_resource("assets", "tracking")
+        # Measure the queries of this extension
+        query_stats.install()
+        # Read the dashboard SQL files once
+        dashboard.queries.load()
 
     def i18n_locales(self):
         """Languages this plugin has translations for."""
@@ -60,13 +65,20 @@ class TrackingPlugin(plugins.SingletonPlugin, DefaultTranslation):
         return {
             "all_token_usage": auth_queries.all_token_usage,
             "all_token_usage_csv": auth_csv.all_token_usage_csv,
+            "latency_percentiles": auth_queries.latency_percentiles,
             "most_accessed_dataset_with_token": auth_queries.most_accessed_dataset_with_token,
             "most_accessed_dataset_with_token_csv": auth_csv.most_accessed_dataset_with_token_csv,
+            "most_accessed_organization_with_token": auth_queries.most_accessed_organization_with_token,
+            "most_accessed_organization_with_token_csv": auth_csv.most_accessed_organization_with_token_csv,
             "most_accessed_resource_with_token": auth_queries.most_accessed_resource_with_token,
             "most_accessed_resource_with_token_csv": auth_csv.most_accessed_resource_with_token_csv,
             "most_accessed_token": auth_queries.most_accessed_token,
             "most_accessed_token_csv": auth_csv.most_accessed_token_csv,
+            "tracking_usage_changes": auth_queries.tracking_usage_changes,
             "tracking_usage_create": auth_base.tracking_usage_create,
+            "tracking_usage_erase": auth_base.tracking_usage_erase,
+            "tracking_usage_erasure_show": auth_base.tracking_usage_erasure_show,
+            "tracking_usage_export": auth_queries.tracking_usage_export,
             "users_active_metrics": auth_queries.users_active_metrics,
         }
 
@@ -75,10 +87,15 @@ class TrackingPlugin(plugins.SingletonPlugin, DefaultTranslation):
     def get_actions(self):
         return {
             "all_token_usage": action_queries.all_token_usage,
+            "latency_percentiles": action_queries.latency_percentiles,
             "most_accessed_dataset_with_token": action_queries.most_accessed_dataset_with_token,
+            "most_accessed_organization_with_token": action_queries.most_accessed_organization_with_token,
             "most_accessed_resource_with_token": action_queries.most_accessed_resource_with_token,
             "most_accessed_token": action_queries.most_accessed_token,
+            "tracking_usage_changes": action_queries.tracking_usage_changes,
             "tracking_usage_create": action_base.tracking_usage_create,
+            "tracking_usage_erase": action_base.tracking_usage_erase,
+            "tracking_usage_erasure_show": action_base.tracking_usage_erasure_show,
             "users_active_metrics": action_queries.get_users_active_metrics,
         }
 
@@ -88,8 +105,14 @@ class TrackingPlugin(plugins.SingletonPlugin, DefaultTranslation):
         return [
             blueprints.tracking_csv_blueprint,
             blueprints.tracking_dashboard_blueprint,
+            blueprints.tracking_export_blueprint,
         ]
 
+    # IClick
+
+    def get_commands(self):
+        return cli.get_commands()
+
     # ISignal
 
     def get_signal_subscriptions(self):
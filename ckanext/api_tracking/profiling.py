@@ -0,0 +1,165 @@
+"""
+Sampling profiler for the tracking code path.
+1 in N tracked requests are profiled (cProfile) while the middleware matches and parses them
+and while we run the IUsage plugins (token resolution, track_usage and persistence).
+The profile starts before the path matching when the next tracked request is sampled,
+requests we don't track are discarded (not counted and not in the stats).
+The profile is paused while CKAN handles the request, CKAN itself is never profiled.
+Stats are aggregated in memory by each worker and dumped periodically as pstats files.
+Use `ckan api-tracking profile-report` to merge and summarise them.
+"""
+import atexit
+import cProfile
+import glob
+import io
+import itertools
+import logging
+import os
+import pstats
+import threading
+import time
+
+from ckan.plugins import toolkit
+
+from ckanext.api_tracking import metrics
+
+
+log = logging.getLogger(__name__)
+
+requests_profiled = metrics.registry.counter(
+    'api_tracking_requests_profiled_total', 'Tracked requests sampled by the profiler'
+)
+
+
+class TrackingProfiler:
+    """ Profile 1 in sample_rate tracked calls and dump the aggregated stats every dump_interval seconds """
+
+    def __init__(self, sample_rate, directory, dump_interval=300):
+        self.sample_rate = sample_rate
+        self.directory = directory
+        self.dump_interval = dump_interval
+        # Tracked calls counted (see sample)
+        self._tracked = 0
+        self._dumps = itertools.count(1)
+        self._stats = None
+        self._samples = 0
+        self._last_dump = time.monotonic()
+        self._lock = threading.Lock()
+
+    def start(self):
+        """ Returns a running profile if the next tracked call is sampled (or None)
+            The call is only counted by sample(), once we know it is tracked
+        """
+        if (self._tracked + 1) % self.sample_rate:
+            return None
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError as e:
+            # Other profiler is active in this thread
+            log.debug(f'Unable to profile the request: {e}')
+            return None
+        return profile
+
+    def sample(self, profile):
+        """ Count a tracked call. Returns the profile if this call is sampled, otherwise it is discarded
+            (other threads could have started a profile for the same sample)
+        """
+        with self._lock:
+            self._tracked += 1
+            sampled = not self._tracked % self.sample_rate
+        if profile is not None and not sampled:
+            self.discard(profile)
+            return None
+        return profile
+
+    def discard(self, profile):
+        """ Stop a profile without counting it (a call we don't track) """
+        profile.disable()
+
+    def pause(self, profile):
+        profile.disable()
+
+    def resume(self, profile):
+        """ Enable a paused profile again. Returns False if we can't (or there is no profile) """
+        if profile is None:
+            return False
+        try:
+            profile.enable()
+        except ValueError as e:
+            log.debug(f'Unable to profile the request: {e}')
+            return False
+        return True
+
+    def stop(self, profile):
+        profile.disable()
+        requests_profiled.inc()
+        with self._lock:
+            if self._stats is None:
+                self._stats = pstats.Stats(profile)
+            else:
+                self._stats.add(profile)
+            self._samples += 1
+            if time.monotonic() - self._last_dump >= self.dump_interval:
+                self._dump()
+
+    def dump(self):
+        """ Save the aggregated stats (if any). Returns the file path """
+        with self._lock:
+            return self._dump()
+
+    def _dump(self):
+        self._last_dump = time.monotonic()
+        if self._stats is None:
+            return None
+        os.makedirs(self.directory, exist_ok=True)
+        # The dump number keeps the name unique if we dump twice in the same millisecond
+        name = f'api-tracking-{os.getpid()}-{int(time.time() * 1000)}-{next(self._dumps)}.pstats'
+        path = os.path.join(self.directory, name)
+        self._stats.dump_stats(path)
+        log.info(f'Saved {self._samples} profiled requests to {path}')
+        self._stats = None
+        self._samples = 0
+        return path
+
+
+def merge_profiles(directory):
+    """ Merge all the pstats files in a directory. Returns (stats, files) """
+    files = sorted(glob.glob(os.path.join(directory, '*.pstats')))
+    if not files:
+        return None, files
+    stats = pstats.Stats(files[0])
+    for path in files[1:]:
+        stats.add(path)
+    return stats, files
+
+
+def summarize(stats, sort='cumulative', limit=30):
+    """ Text report of the merged stats """
+    stream = io.StringIO()
+    stats.stream = stream
+    stats.strip_dirs().sort_stats(sort).print_stats(limit)
+    return stream.getvalue()
+
+
+_profiler = None
+
+
+def get_profiler():
+    """ Get the process profiler or None if disabled
+        Config:
+            ckanext.api_tracking.profile_sample_rate: profile 1 in N tracked requests, default 0 (disabled)
+            ckanext.api_tracking.profile_dir: directory for the pstats files (required to enable it)
+            ckanext.api_tracking.profile_dump_interval: seconds, default 300
+    """
+    global _profiler
+    sample_rate = toolkit.asint(toolkit.config.get('ckanext.api_tracking.profile_sample_rate', 0))
+    directory = toolkit.config.get('ckanext.api_tracking.profile_dir')
+    if sample_rate <= 0 or not directory:
+        return None
+    if _profiler is None:
+        dump_interval = toolkit.asint(toolkit.config.get('ckanext.api_tracking.profile_dump_interval', 300))
+        log.info(f'Profiling 1 in {sample_rate} tracked requests to {directory}')
+        _profiler = TrackingProfiler(sample_rate, directory, dump_interval=dump_interval)
+        atexit.register(_profiler.dump)
+    return _profiler
@@ -1,74 +1,175 @@
 from ckan import model
-from sqlalchemy import func, desc
+from sqlalchemy import case, func, desc
+from ckanext.api_tracking.guardrails import cap_limit
 from ckanext.api_tracking.models import TrackingUsage
+from ckanext.api_tracking.replica import read_all
+from ckanext.api_tracking.queries.views import (
+    TOKEN_USAGE_BY_OBJECT,
+    TOKEN_USAGE_BY_TOKEN,
+    token_usage_by_object,
+    token_usage_by_token,
+    view_ready,
+)
 
 
-def get_most_accessed_resource_with_token(limit=10):
+def _filter_owners(query, package_id=None, owner_org=None):
+    """ Filter by the dataset and organization saved in each row (indexed columns) """
+    if package_id:
+        query = query.filter(TrackingUsage.package_id == package_id)
+    if owner_org:
+        query = query.filter(TrackingUsage.owner_org == owner_org)
+    return query
+
+
+def _most_accessed_objects_from_view(object_type, limit, package_id=None, owner_org=None, with_package=False):
+    """ Same results as the most accessed objects queries, from the materialized view """
+    view = token_usage_by_object
+    columns = [view.c.object_id]
+    if with_package:
+        columns.append(view.c.package_id.label('package_id'))
+    query = model.Session.query(*columns, view.c.total.label('total')).filter(view.c.object_type == object_type)
+    if package_id:
+        query = query.filter(view.c.package_id == package_id)
+    if owner_org:
+        query = query.filter(view.c.owner_org == owner_org)
+    query = query.order_by(desc(view.c.total)).limit(cap_limit(limit)).execution_options(
+        api_tracking_query=f'most_accessed_{object_type}_with_token_mv'
+    )
+    return read_all(query)
+
+
+def get_most_accessed_resource_with_token(limit=10, package_id=None, owner_org=None):
     """
     Get most accessed resources with token
     Returns a query result with the most accessed resources with token
-
+    Optional filters: package_id (resources of a dataset) and owner_org (resources of an organization)
     """
+    if view_ready(TOKEN_USAGE_BY_OBJECT):
+        return _most_accessed_objects_from_view(
+            'resource', limit, package_id=package_id, owner_org=owner_org, with_package=True
+        )
     query = model.Session.query(
         TrackingUsage.object_id,
-        func.count(TrackingUsage.object_id).label('total')
+        func.max(TrackingUsage.package_id).label('package_id'),
+        func.sum(TrackingUsage.count).label('total')
     ).filter(
         TrackingUsage.object_id.isnot(None),
         TrackingUsage.token_name.isnot(None),
         TrackingUsage.object_type == 'resource'
-    ).group_by(TrackingUsage.object_id).order_by(
+    )
+    query = _filter_owners(query, package_id=package_id, owner_org=owner_org)
+    query = query.group_by(TrackingUsage.object_id).order_by(
         desc('total')
-    ).limit(limit)
+    ).limit(cap_limit(limit)).execution_options(api_tracking_query='most_accessed_resource_with_token')
 
-    return query.all()
+    return read_all(query)
 
 
-def get_most_accessed_dataset_with_token(limit=10):
+def get_most_accessed_dataset_with_token(limit=10, owner_org=None):
     """
     Get most accessed datasets with token
     Returns a query result with the most accessed datasets with token
-
+    Optional filter: owner_org (datasets of an organization)
     """
+    if view_ready(TOKEN_USAGE_BY_OBJECT):
+        return _most_accessed_objects_from_view('dataset', limit, owner_org=owner_org)
     query = model.Session.query(
         TrackingUsage.object_id,
-        func.count(TrackingUsage.object_id).label('total')
+        func.sum(TrackingUsage.count).label('total')
     ).filter(
         TrackingUsage.object_id.isnot(None),
         TrackingUsage.token_name.isnot(None),
         TrackingUsage.object_type == 'dataset'
-    ).group_by(TrackingUsage.object_id).order_by(
+    )
+    query = _filter_owners(query, owner_org=owner_org)
+    query = query.group_by(TrackingUsage.object_id).order_by(
         desc('total')
-    ).limit(limit)
+    ).limit(cap_limit(limit)).execution_options(api_tracking_query='most_accessed_dataset_with_token')
 
-    return query.all()
+    return read_all(query)
 
 
-def get_most_accessed_token(limit=10):
+def get_most_accessed_organization_with_token(limit=10):
+    """
+    Get most accessed organizations with token
+    Returns a query result with the requests to the organizations, their datasets and resources
+    Based on the organization saved in each row (see ckanext.api_tracking.owners)
+    """
+    if view_ready(TOKEN_USAGE_BY_OBJECT):
+        # One row per object instead of one per request
+        source = token_usage_by_object.c
+        owner_org, object_type, count = source.owner_org, source.object_type, source.total
+        filters = [owner_org.isnot(None)]
+        query_name = 'most_accessed_organization_with_token_mv'
+    else:
+        owner_org, object_type, count = TrackingUsage.owner_org, TrackingUsage.object_type, TrackingUsage.count
+        filters = [owner_org.isnot(None), TrackingUsage.token_name.isnot(None)]
+        query_name = 'most_accessed_organization_with_token'
+
+    def _requests(requested_type):
+        return func.sum(
+            case((object_type == requested_type, count), else_=0)
+        ).label(f'{requested_type}_requests')
+
+    query = model.Session.query(
+        owner_org.label('owner_org'),
+        _requests('organization'),
+        _requests('dataset'),
+        _requests('resource'),
+        func.sum(count).label('total')
+    ).filter(
+        *filters
+    ).group_by(owner_org).order_by(
+        desc('total')
+    ).limit(cap_limit(limit)).execution_options(api_tracking_query=query_name)
+
+    return read_all(query)
+
+
+def get_most_accessed_token(limit=10, order_by='total'):
     """
     Get most accessed tokens
     Returns a query result with the most accessed tokens
+    Use order_by='response_bytes' to get the tokens downloading more data
     """
+    if order_by not in ('total', 'response_bytes'):
+        raise ValueError(f'Invalid order: {order_by}')
+    if view_ready(TOKEN_USAGE_BY_TOKEN):
+        view = token_usage_by_token
+        query = model.Session.query(
+            view.c.user_id,
+            view.c.token_name,
+            view.c.total.label('total'),
+            view.c.response_bytes.label('response_bytes'),
+        ).order_by(
+            desc(order_by)
+        ).limit(cap_limit(limit)).execution_options(api_tracking_query='most_accessed_token_mv')
+        return read_all(query)
     query = model.Session.query(
         TrackingUsage.user_id,
         TrackingUsage.token_name,
-        func.count(TrackingUsage.token_name).label('total')
+        func.sum(TrackingUsage.count).label('total'),
+        func.coalesce(func.sum(TrackingUsage.response_bytes), 0).label('response_bytes'),
     ).filter(
         TrackingUsage.token_name.isnot(None)
     ).group_by(TrackingUsage.token_name, TrackingUsage.user_id).order_by(
-        desc('total')
-    ).limit(limit)
+        desc(order_by)
+    ).limit(cap_limit(limit)).execution_options(api_tracking_query='most_accessed_token')
 
-    return query.all()
+    return read_all(query)
 
 
 def get_all_token_usage(limit=1000):
     """
     Get all token usage records
     Returns a query result with all token usage (excluding empty tokens)
+    Coalesced rows stand for count events, seen between timestamp and last_timestamp
     """
     query = model.Session.query(
         TrackingUsage.id,
         func.to_char(TrackingUsage.timestamp, 'YYYY-MM-DD HH24:MI:SS').label('timestamp'),
+        func.to_char(TrackingUsage.last_timestamp, 'YYYY-MM-DD HH24:MI:SS').label('last_timestamp'),
+        TrackingUsage.count,
         TrackingUsage.user_id,
         TrackingUsage.tracking_type,
         TrackingUsage.tracking_sub_type,
@@ -79,6 +180,6 @@ def get_all_token_usage(limit=1000):
         TrackingUsage.token_name.isnot(None)
     ).order_by(
         desc(TrackingUsage.timestamp)
-    ).limit(limit)
+    ).limit(cap_limit(limit)).execution_options(api_tracking_query='all_token_usage')
 
-    return query.all()
+    return read_all(query)
@@ -0,0 +1,215 @@
+"""
+Retention for tracking_usage: old rows are moved to compressed files on local disk.
+Rows are read in time-ordered batches, appended to one gzip NDJSON file per day
+(DIRECTORY/YYYY/MM/tracking_usage-YYYY-MM-DD.ndjson.gz) and then deleted,
+each batch in its own short transaction (no long locks, no WAL spikes).
+Files are written (and synced) before the rows are deleted. An interrupted run
+can be started again: the restore skips the rows already in the table.
+"""
+import gzip
+import json
+import logging
+import os
+import re
+import time
+from datetime import date, datetime, timedelta
+from itertools import groupby
+from pathlib import Path
+
+from ckan import model
+from sqlalchemy import bindparam, select, text, tuple_
+from sqlalchemy.dialects.postgresql import insert
+
+from ckanext.api_tracking.models import TrackingUsage
+
+
+log = logging.getLogger(__name__)
+
+FILE_PREFIX = 'tracking_usage-'
+FILE_SUFFIX = '.ndjson.gz'
+DATETIME_FIELDS = ('timestamp', 'last_timestamp')
+AGE_UNITS = {'d': 'days', 'w': 'weeks', 'h': 'hours'}
+
+DELETE_SQL = text('DELETE FROM tracking_usage WHERE id IN :ids').bindparams(bindparam('ids', expanding=True))
+
+
+def parse_age(value):
+    """ 180d, 26w, 12h or a number of days to a timedelta """
+    match = re.fullmatch(r'\s*(\d+)\s*([dwh]?)\s*', str(value))
+    if not match:
+        raise ValueError(f'Invalid age: {value} (use 180d, 26w or 12h)')
+    return timedelta(**{AGE_UNITS[match.group(2) or 'd']: int(match.group(1))})
+
+
+def archive_path(directory, day):
+    """ File for the rows of a day """
+    return Path(directory) / f'{day:%Y}' / f'{day:%m}' / f'{FILE_PREFIX}{day:%Y-%m-%d}{FILE_SUFFIX}'
+
+
+def _to_json(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f'Unable to archive {type(value)}')
+
+
+def write_rows(directory, rows):
+    """ Append rows (time-ordered dicts) to the files of their days
+        Files are synced to disk before we return (the rows can be deleted)
+        Returns the list of files written
+    """
+    files = []
+    for day, day_rows in groupby(rows, key=lambda row: row['timestamp'].date()):
+        path = archive_path(directory, day)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Each append is a new gzip member, gzip readers read them all
+        with open(path, 'ab') as raw:
+            with gzip.GzipFile(fileobj=raw, mode='ab') as archive:
+                for row in day_rows:
+                    archive.write(json.dumps(row, default=_to_json).encode('utf-8') + b'\n')
+            raw.flush()
+            os.fsync(raw.fileno())
+        files.append(path)
+    return files
+
+
+def archive_files(path, since=None, until=None):
+    """ Archive files in a directory (or a single file), optionally for the days in [since, until] """
+    path = Path(path)
+    if path.is_file():
+        return [path]
+    files = []
+    for file in sorted(path.rglob(f'{FILE_PREFIX}*{FILE_SUFFIX}')):
+        day = date.fromisoformat(file.name[len(FILE_PREFIX):-len(FILE_SUFFIX)])
+        if since and day < since:
+            continue
+        if until and day > until:
+            continue
+        files.append(file)
+    return files
+
+
+def read_rows(files):
+    """ Rows (dicts) saved in archive files """
+    for file in files:
+        with gzip.open(file, 'rt', encoding='utf-8') as archive:
+            for line in archive:
+                if not line.strip():
+                    continue
+                row = json.loads(line)
+                for field in DATETIME_FIELDS:
+                    if row.get(field):
+                        row[field] = datetime.fromisoformat(row[field])
+                yield row
+
+
+def rewrite_archive(path, transform, before_replace=None):
+    """ Rewrite an archive file with transform(row) -> row or None (to remove it)
+        The new file replaces the old one only once it is complete and synced
+        before_replace: called before the file is replaced (only if rows changed)
+        Returns the number of rows changed or removed
+    """
+    path = Path(path)
+    changed = 0
+    temporary = path.with_name(f'.{path.name}.tmp')
+    with open(temporary, 'wb') as raw:
+        with gzip.GzipFile(fileobj=raw, mode='wb') as archive:
+            for row in read_rows([path]):
+                new_row = transform(dict(row))
+                if new_row != row:
+                    changed += 1
+                if new_row is not None:
+                    archive.write(json.dumps(new_row, default=_to_json).encode('utf-8') + b'\n')
+        raw.flush()
+        os.fsync(raw.fileno())
+    if changed:
+        if before_replace:
+            try:
+                before_replace()
+            except Exception:
+                os.unlink(temporary)
+                raise
+        os.replace(temporary, path)
+    else:
+        os.unlink(temporary)
+    return changed
+
+
+def archive_tracking_usage(directory, older_than, batch_size=5000, sleep=0, delete=True):
+    """ Move the tracking_usage rows older than a timedelta to the archive files
+        sleep: seconds to wait between batches (to spread the I/O and WAL)
+        delete: False to only write the files
+        Returns (rows archived, files written)
+    """
+    cutoff = datetime.now() - older_than
+    table = TrackingUsage.__table__
+    total = 0
+    files = set()
+    last = None
+    while True:
+        query = select(table).where(table.c.timestamp < cutoff)
+        if last is not None:
+            query = query.where(tuple_(table.c.timestamp, table.c.id) > tuple_(*last))
+        query = query.order_by(table.c.timestamp, table.c.id).limit(batch_size)
+        try:
+            rows = [dict(row._mapping) for row in model.Session.execute(
+                query.execution_options(api_tracking_query='archive_select')
+            )]
+            if not rows:
+                model.Session.commit()
+                break
+            files.update(write_rows(directory, rows))
+            if delete:
+                model.Session.execute(
+                    DELETE_SQL.execution_options(api_tracking_query='archive_delete'),
+                    {'ids': [row['id'] for row in rows]},
+                )
+            model.Session.commit()
+        except Exception:
+            model.Session.rollback()
+            raise
+        last = (rows[-1]['timestamp'], rows[-1]['id'])
+        total += len(rows)
+        log.info(f'Archive: {total} rows archived (until {last[0]})')
+        if sleep:
+            time.sleep(sleep)
+    return total, sorted(files)
+
+
+def restore_tracking_usage(path, since=None, until=None, batch_size=5000):
+    """ Load archived rows back into tracking_usage (rows already there are skipped)
+        The erasures (see ckanext.api_tracking.queries.erasure) are applied to the restored rows
+        Restored rows get a new txid: the change feed sends them again (pseudonymised if required)
+        Returns (rows restored, files read)
+    """
+    # Avoid circular imports
+    from ckanext.api_tracking.queries.erasure import KnownErasures
+
+    erasures = KnownErasures()
+    files = archive_files(path, since=since, until=until)
+    columns = [column.name for column in TrackingUsage.__table__.columns if column.name != 'txid']
+    statement = insert(TrackingUsage.__table__).on_conflict_do_nothing(index_elements=['id'])
+    total = 0
+    batch = []
+
+    def save(batch):
+        try:
+            model.Session.execute(statement.execution_options(api_tracking_query='archive_restore'), batch)
+            model.Session.commit()
+        except Exception:
+            model.Session.rollback()
+            raise
+
+    for row in read_rows(files):
+        row = erasures.apply(row)
+        if row is None:
+            continue
+        batch.append({column: row.get(column) for column in columns})
+        if len(batch) >= batch_size:
+            save(batch)
+            total += len(batch)
+            batch = []
+            log.info(f'Restore: {total} rows read')
+    if batch:
+        save(batch)
+        total += len(batch)
+    return total, files
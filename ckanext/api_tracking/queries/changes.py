@@ -0,0 +1,128 @@
+"""
+Change feed of tracking_usage for the incremental ETL.
+Rows are returned after a cursor in the order of their write transaction (txid, then id).
+Only the transactions older than all the running ones (the snapshot xmin) are returned,
+so a row committed later can never appear before a cursor already returned,
+even if its timestamp is older (coalesced events, the collector or the core tracking ingestion).
+Rows saved before the change feed (empty txid) come first.
+Updated rows (owners backfill, pseudonymised or restored rows) get a new txid and are sent again:
+consumers upsert the rows by id. Erased rows are sent as tombstones ({'id', 'deleted': True})
+from tracking_usage_deleted (see ckanext.api_tracking.queries.erasure).
+Rows moved to the archive files are not deleted from the feed (they are still in the history).
+"""
+import re
+
+from ckan import model
+from ckan.plugins import toolkit
+from sqlalchemy import func, tuple_
+
+from ckanext.api_tracking.guardrails import cap_limit
+from ckanext.api_tracking.models import TrackingUsage, TrackingUsageDeleted
+from ckanext.api_tracking.replica import read_all
+
+
+CHANGE_TXID = func.coalesce(TrackingUsage.txid, 0)
+# Before the first row
+START = (-1, '')
+
+
+def get_page_size():
+    """ ckanext.api_tracking.changes_page_size: default 1000 """
+    return toolkit.asint(toolkit.config.get('ckanext.api_tracking.changes_page_size', 1000))
+
+
+def format_cursor(txid, id):
+    return f'{txid}:{id}'
+
+
+def parse_cursor(cursor):
+    """ (txid, id) from a cursor returned by the change feed. None for the start """
+    if not cursor:
+        return START
+    match = re.fullmatch(r'(\d+):([\w-]+)', cursor)
+    if not match:
+        raise ValueError(f'Invalid cursor: {cursor}')
+    return int(match.group(1)), match.group(2)
+
+
+def _to_dict(row):
+    change = {column.name: getattr(row, column.name) for column in TrackingUsage.__table__.columns}
+    for field in ('timestamp', 'last_timestamp'):
+        if change[field]:
+            change[field] = change[field].isoformat()
+    change.pop('txid')
+    change['deleted'] = False
+    change['cursor'] = format_cursor(row.change_txid, row.id)
+    return change
+
+
+def _tombstone_to_dict(row):
+    return {
+        'id': row.id,
+        'deleted': True,
+        'cursor': format_cursor(row.txid, row.id),
+    }
+
+
+def merge_changes(rows, tombstones, limit):
+    """ Rows and tombstones (each ordered by cursor) in the feed order, up to limit """
+    changes = sorted(rows + tombstones, key=lambda change: parse_cursor(change['cursor']))
+    return changes[:limit]
+
+
+def get_changes(cursor=None, limit=None):
+    """ Tracking rows after a cursor, oldest first
+        Returns {'results': [rows with their cursor], 'cursor': resume cursor, 'has_more': bool}
+    """
+    after = parse_cursor(cursor)
+    limit = cap_limit(limit or get_page_size())
+    xmin = func.txid_snapshot_xmin(func.txid_current_snapshot())
+    query = model.Session.query(
+        *TrackingUsage.__table__.columns,
+        CHANGE_TXID.label('change_txid'),
+    ).filter(
+        CHANGE_TXID < xmin,
+        tuple_(CHANGE_TXID, TrackingUsage.id) > tuple_(*after),
+    ).order_by(
+        CHANGE_TXID,
+        TrackingUsage.id,
+    ).limit(limit + 1).execution_options(api_tracking_query='tracking_usage_changes')
+    tombstones = model.Session.query(
+        TrackingUsageDeleted.id,
+        TrackingUsageDeleted.txid,
+    ).filter(
+        TrackingUsageDeleted.txid < xmin,
+        tuple_(TrackingUsageDeleted.txid, TrackingUsageDeleted.id) > tuple_(*after),
+    ).order_by(
+        TrackingUsageDeleted.txid,
+        TrackingUsageDeleted.id,
+    ).limit(limit + 1).execution_options(api_tracking_query='tracking_usage_changes_deleted')
+    rows = merge_changes(
+        [_to_dict(row) for row in read_all(query)],
+        [_tombstone_to_dict(row) for row in read_all(tombstones)],
+        limit + 1,
+    )
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    return {
+        'results': rows,
+        'cursor': rows[-1]['cursor'] if rows else (cursor or None),
+        'has_more': has_more,
+    }
+
+
+def stream_changes(cursor=None, max_rows=None):
+    """ Tracking rows after a cursor, page by page (each page is a short query)
+        max_rows: stop after this number of rows (the client continues from the last cursor)
+    """
+    total = 0
+    while True:
+        limit = get_page_size()
+        if max_rows:
+            limit = min(limit, max_rows - total)
+        page = get_changes(cursor=cursor, limit=limit)
+        yield from page['results']
+        total += len(page['results'])
+        cursor = page['cursor']
+        if not page['has_more'] or (max_rows and total >= max_rows):
+            break
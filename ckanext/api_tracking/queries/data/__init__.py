@@ -2,6 +2,7 @@
 
 from ckanext.api_tracking.queries.data.all import all_token_usage_data
 from ckanext.api_tracking.queries.data.dataset import most_accessed_dataset_with_token_data
+from ckanext.api_tracking.queries.data.organization import most_accessed_organization_with_token_data
 from ckanext.api_tracking.queries.data.resource import most_accessed_resource_with_token_data
 from ckanext.api_tracking.queries.data.token import most_accessed_token_data
 from ckanext.api_tracking.queries.data.users import users_active_metrics_dict
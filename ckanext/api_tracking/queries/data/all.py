@@ -31,6 +31,8 @@ def all_token_usage_data(limit=1000):
         rows.append({
             'id': row['id'],
             'timestamp': row['timestamp'],
+            'last_timestamp': row['last_timestamp'],
+            'count': row['count'],
             'user_id': user_id,
             'user_name': user_name,
             'user_fullname': user_fullname,
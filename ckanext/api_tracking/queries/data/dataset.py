@@ -12,8 +12,8 @@ from ckanext.api_tracking.queries.api import get_most_accessed_dataset_with_toke
 log = logging.getLogger(__name__)
 
 
-def most_accessed_dataset_with_token_data(limit=10):
-    data = get_most_accessed_dataset_with_token(limit=limit)
+def most_accessed_dataset_with_token_data(limit=10, owner_org=None):
+    data = get_most_accessed_dataset_with_token(limit=limit, owner_org=owner_org)
 
     # Create CSV including package details
     rows = []
@@ -0,0 +1,45 @@
+"""
+Post-preocessed data after the DB queries and before the CSV generation
+"""
+
+import logging
+from ckan import model
+from ckan.plugins import toolkit
+
+from ckanext.api_tracking.queries.api import get_most_accessed_organization_with_token
+
+
+log = logging.getLogger(__name__)
+
+
+def most_accessed_organization_with_token_data(limit=10):
+    data = get_most_accessed_organization_with_token(limit=limit)
+
+    ids = [row['owner_org'] for row in data]
+    orgs = {}
+    if ids:
+        orgs = {org.id: org for org in model.Session.query(model.Group).filter(model.Group.id.in_(ids))}
+
+    # Create CSV including organization details
+    rows = []
+    for row in data:
+        org_id = row['owner_org']
+        org = orgs.get(org_id)
+        if org:
+            org_title = org.title or org.name
+            org_url = toolkit.url_for('organization.read', id=org.name, qualified=True)
+        else:
+            org_title = None
+            org_url = None
+
+        rows.append({
+            'organization_id': org_id,
+            'organization_title': org_title,
+            'organization_url': org_url,
+            'organization_requests': row['organization_requests'],
+            'dataset_requests': row['dataset_requests'],
+            'resource_requests': row['resource_requests'],
+            'total': row['total'],
+        })
+
+    return rows
@@ -12,39 +12,50 @@ from ckanext.api_tracking.queries.api import get_most_accessed_resource_with_tok
 log = logging.getLogger(__name__)
 
 
-def most_accessed_resource_with_token_data(limit=10):
-    data = get_most_accessed_resource_with_token(limit=limit)
+def _get_by_ids(model_class, ids):
+    """ Load many objects in a single query """
+    ids = [id_ for id_ in set(ids) if id_]
+    if not ids:
+        return {}
+    return {obj.id: obj for obj in model.Session.query(model_class).filter(model_class.id.in_(ids))}
+
+
+def most_accessed_resource_with_token_data(limit=10, package_id=None, owner_org=None):
+    data = get_most_accessed_resource_with_token(limit=limit, package_id=package_id, owner_org=owner_org)
+
+    # Resources, datasets and organizations are loaded once for all the rows
+    resources = _get_by_ids(model.Resource, [row['object_id'] for row in data])
+    packages = _get_by_ids(
+        model.Package,
+        [resource.package_id for resource in resources.values()] + [row['package_id'] for row in data],
+    )
+    orgs = _get_by_ids(model.Group, [package.owner_org for package in packages.values()])
 
     # Create CSV including package details
     rows = []
-    known_packages = {}
-    know_orgs = {}
     for row in data:
         object_id = row['object_id']
         obj_title = None
         object_url = None
+        package_id = row['package_id']
         package_title = None
         package_url = None
         org_title = None
         org_url = None
         org_id = None
 
-        obj = model.Resource.get(object_id)
+        obj = resources.get(object_id)
         if obj:
             obj_title = obj.name if obj.name else f'Resource ID {obj.id}'
             package_id = obj.package_id
-            if package_id in known_packages:
-                package = known_packages[package_id]
-            else:
-                package = model.Package.get(package_id)
+        package = packages.get(package_id)
+        if package:
             package_name = package.name
-            object_url = toolkit.url_for('dataset_resource.read', id=package_name, resource_id=object_id, qualified=True)
+            if obj:
+                object_url = toolkit.url_for('dataset_resource.read', id=package_name, resource_id=object_id, qualified=True)
             package_title = package.title or package.name
             package_url = toolkit.url_for('dataset.read', id=package_name, qualified=True)
-            if package.owner_org in know_orgs:
-                org = know_orgs[package.owner_org]
-            else:
-                org = model.Group.get(package.owner_org)
+            org = orgs.get(package.owner_org)
             if org:
                 org_id = org.id
                 org_title = org.title
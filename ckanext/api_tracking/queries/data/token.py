@@ -12,9 +12,9 @@ from ckanext.api_tracking.queries.api import get_most_accessed_token
 log = logging.getLogger(__name__)
 
 
-def most_accessed_token_data(limit=10):
+def most_accessed_token_data(limit=10, order_by='total'):
     """ Get most accessed tokens """
-    data = get_most_accessed_token(limit=limit)
+    data = get_most_accessed_token(limit=limit, order_by=order_by)
     # Create CSV including package details
     rows = []
     for row in data:
@@ -36,6 +36,7 @@ def most_accessed_token_data(limit=10):
             'user_url': user_url,
             'token_name': row['token_name'],
             'total': row['total'],
+            'response_bytes': row['response_bytes'],
         })
 
     return rows
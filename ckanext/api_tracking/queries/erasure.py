@@ -0,0 +1,302 @@
+"""
+Erase (or pseudonymise) the tracking history of a user or an API token.
+Rows are deleted or updated in small batches (an index range scan and a short transaction each)
+with a pause between batches, so the table is never locked and the replicas keep up.
+Changed rows no longer match: a stopped erasure continues where it stopped when started again.
+The archive files (see ckanext.api_tracking.queries.archive) are rewritten without the value,
+and the restore applies all the erasures to the archived rows it loads.
+The change feed sends the pseudonymised rows again and a tombstone for each erased row
+(archived rows included, as a pseudonymised archived row is not in the table to be sent again).
+The days with changed rows are saved in the job (tracking_erasure) and their rollups
+(latency histograms, active users sketches, materialized views) are rebuilt at the end.
+The token latency rollups of the other (archived) days are deleted or renamed to the pseudonym.
+The erased value is saved in the job until it is done (the background job reads it from there).
+"""
+import hashlib
+import hmac
+import logging
+import os
+import time
+from datetime import date, datetime, timedelta
+
+from ckan import model
+from ckan.plugins import toolkit
+from sqlalchemy import text
+
+from ckanext.api_tracking.models import TrackingErasure
+from ckanext.api_tracking.queries.archive import archive_files, rewrite_archive
+from ckanext.api_tracking.queries.latency import rebuild_latency_rollups
+from ckanext.api_tracking.queries.sketches import ACTIVE_USERS, rebuild_sketches, use_sketches
+from ckanext.api_tracking.queries.views import refresh_views, use_views
+
+
+log = logging.getLogger(__name__)
+
+FIELDS = ('user_id', 'token_name')
+MODES = ('erase', 'pseudonymize')
+
+_BATCH = 'SELECT id FROM tracking_usage WHERE {field} = :value ORDER BY id LIMIT :batch_size'
+# Deleted rows leave a tombstone for the change feed (see ckanext.api_tracking.queries.changes)
+_TOMBSTONE = """
+    INSERT INTO tracking_usage_deleted (id) SELECT id FROM {rows}
+    ON CONFLICT (id) DO UPDATE SET txid = txid_current(), deleted = now()
+"""
+ERASE_SQL = {
+    field: text(f"""
+        WITH deleted AS (
+            DELETE FROM tracking_usage
+            WHERE id IN ({_BATCH.format(field=field)})
+            RETURNING id, date(timestamp) AS day
+        ), tombstones AS ({_TOMBSTONE.format(rows='deleted')})
+        SELECT day FROM deleted
+    """)
+    for field in FIELDS
+}
+TOMBSTONE_SQL = text(_TOMBSTONE.format(rows='unnest(CAST(:ids AS text[])) AS id'))
+# Updated rows get a new txid, the change feed sends them again
+PSEUDONYMIZE_SQL = {
+    # Login and logout rows also have the user as object
+    'user_id': text(f"""
+        UPDATE tracking_usage SET
+            user_id = :pseudonym,
+            txid = txid_current(),
+            object_id = CASE WHEN object_type = 'user' AND object_id = :value THEN :pseudonym ELSE object_id END
+        WHERE id IN ({_BATCH.format(field='user_id')})
+        RETURNING date(timestamp) AS day
+    """),
+    'token_name': text(f"""
+        UPDATE tracking_usage SET token_name = :pseudonym, txid = txid_current()
+        WHERE id IN ({_BATCH.format(field='token_name')})
+        RETURNING date(timestamp) AS day
+    """),
+}
+
+# Token rollups of the days not rebuilt (archived days): the erased token is their key
+LATENCY_TOKEN_SQL = {
+    'erase': text("DELETE FROM tracking_usage_latency WHERE dimension = 'token' AND key = :value"),
+    'pseudonymize': text("""
+        WITH moved AS (
+            DELETE FROM tracking_usage_latency
+            WHERE dimension = 'token' AND key = :value
+            RETURNING day, dimension, bucket, count
+        )
+        INSERT INTO tracking_usage_latency (day, dimension, key, bucket, count)
+        SELECT day, dimension, :pseudonym, bucket, count FROM moved
+        ON CONFLICT (day, dimension, key, bucket) DO UPDATE SET count = tracking_usage_latency.count + EXCLUDED.count
+    """),
+}
+
+
+def get_erase_settings():
+    """ Batches of the erasures started with the action
+        Config:
+            ckanext.api_tracking.erase_batch_size: rows changed in each transaction, default 1000
+            ckanext.api_tracking.erase_sleep: seconds between batches, default 0.5
+    """
+    return {
+        'batch_size': toolkit.asint(toolkit.config.get('ckanext.api_tracking.erase_batch_size', 1000)),
+        'sleep': float(toolkit.config.get('ckanext.api_tracking.erase_sleep', 0.5)),
+    }
+
+
+def _digest(value):
+    secret = toolkit.config.get('ckanext.api_tracking.pseudonym_secret') or toolkit.config.get('SECRET_KEY') or ''
+    return hmac.new(secret.encode('utf-8'), value.encode('utf-8'), hashlib.sha256).hexdigest()
+
+
+def pseudonym(value):
+    """ Stable pseudonym of a user ID or token name (the same value always gets the same pseudonym) """
+    return f'pseudonym-{_digest(value)[:16]}'
+
+
+def get_archive_dir():
+    """ ckanext.api_tracking.archive_dir: the archive files to rewrite, default empty """
+    return toolkit.config.get('ckanext.api_tracking.archive_dir')
+
+
+def erase_row(row, field, value, mode):
+    """ Apply an erasure to a row (dict). Returns None if the row is erased """
+    if row.get(field) != value:
+        return row
+    if mode == 'erase':
+        return None
+    row = dict(row)
+    row[field] = pseudonym(value)
+    # Same as PSEUDONYMIZE_SQL, login and logout rows also have the user as object
+    if field == 'user_id' and row.get('object_type') == 'user' and row.get('object_id') == value:
+        row['object_id'] = row[field]
+    return row
+
+
+class KnownErasures:
+    """ All the erasures (values and modes), to apply them to rows loaded again (restored archives) """
+
+    def __init__(self):
+        self.modes = {
+            (erasure.field, erasure.value_hash): erasure.mode
+            for erasure in model.Session.query(TrackingErasure.field, TrackingErasure.value_hash, TrackingErasure.mode)
+        }
+
+    def apply(self, row):
+        """ Returns the row (pseudonymised if required) or None if it was erased """
+        if not self.modes:
+            return row
+        for field in FIELDS:
+            value = row.get(field)
+            mode = self.modes.get((field, _digest(value))) if value else None
+            if mode:
+                row = erase_row(row, field, value, mode)
+                if row is None:
+                    return None
+        return row
+
+
+def day_ranges(days):
+    """ Consecutive days (YYYY-MM-DD) as [since, until) date ranges """
+    ranges = []
+    for day in sorted(date.fromisoformat(day) for day in set(days)):
+        if ranges and ranges[-1][1] == day:
+            ranges[-1][1] = day + timedelta(days=1)
+        else:
+            ranges.append([day, day + timedelta(days=1)])
+    return [tuple(day_range) for day_range in ranges]
+
+
+def start_erasure(field, value, mode='erase'):
+    """ Get the unfinished erasure of this value (to continue it) or create a new one """
+    if field not in FIELDS:
+        raise ValueError(f'Invalid field: {field}')
+    if mode not in MODES:
+        raise ValueError(f'Invalid mode: {mode}')
+    if not value:
+        raise ValueError(f'Missing {field}')
+    value_hash = _digest(value)
+    erasure = model.Session.query(TrackingErasure).filter(
+        TrackingErasure.field == field,
+        TrackingErasure.value_hash == value_hash,
+        TrackingErasure.mode == mode,
+        TrackingErasure.status != 'done',
+    ).first()
+    if erasure is None:
+        erasure = TrackingErasure(
+            field=field, value_hash=value_hash, value=value, mode=mode, status='running', rows=0, days=[]
+        )
+        model.Session.add(erasure)
+        model.Session.commit()
+    elif erasure.value is None:
+        erasure.value = value
+        model.Session.commit()
+    return erasure
+
+
+def run_erasure(erasure_id, value=None, batch_size=1000, sleep=0.5, progress=None):
+    """ Erase the rows in batches, then the archived rows, then rebuild the rollups of the changed days
+        value: default, the value saved in the erasure
+        progress: function called with the erasure after each batch
+        Returns the erasure
+    """
+    erasure = model.Session.query(TrackingErasure).get(erasure_id)
+    if erasure is None:
+        raise ValueError(f'Erasure not found: {erasure_id}')
+    if erasure.status == 'done':
+        return erasure
+    value = value or erasure.value
+    if not value:
+        raise ValueError(f'The value of erasure {erasure_id} is not known, start it again')
+    if not hmac.compare_digest(_digest(value), erasure.value_hash):
+        raise ValueError('The value does not match this erasure')
+    if erasure.status == 'running':
+        _erase_rows(erasure, value, batch_size, sleep, progress)
+    if erasure.status == 'archives':
+        _erase_archives(erasure, value)
+    if erasure.status == 'rebuilding':
+        _rebuild_rollups(erasure, value)
+    return erasure
+
+
+def _erase_rows(erasure, value, batch_size, sleep, progress):
+    statement = (ERASE_SQL if erasure.mode == 'erase' else PSEUDONYMIZE_SQL)[erasure.field]
+    statement = statement.execution_options(api_tracking_query=f'{erasure.mode}_{erasure.field}')
+    params = {'value': value, 'pseudonym': pseudonym(value), 'batch_size': batch_size}
+    while True:
+        try:
+            rows = model.Session.execute(statement, params).fetchall()
+            if rows:
+                erasure.rows += len(rows)
+                erasure.days = sorted(set(erasure.days or []) | {row.day.isoformat() for row in rows})
+            else:
+                erasure.status = 'archives'
+            erasure.updated = datetime.now()
+            model.Session.commit()
+        except Exception:
+            model.Session.rollback()
+            raise
+        log.info(f'Erasure {erasure.id}: {erasure.rows} rows ({erasure.mode})')
+        if progress:
+            progress(erasure)
+        if not rows:
+            break
+        if sleep:
+            time.sleep(sleep)
+
+
+def _erase_archives(erasure, value):
+    """ Rewrite the archive files with rows of this value. Files without them are not changed """
+    directory = get_archive_dir()
+    changed = 0
+    if directory and os.path.isdir(directory):
+        for path in archive_files(directory):
+            ids = []
+
+            def transform(row):
+                new_row = erase_row(row, erasure.field, value, erasure.mode)
+                if new_row != row:
+                    ids.append(row['id'])
+                return new_row
+
+            # Tombstones are saved before the file is replaced: a failure in between only repeats them
+            changed += rewrite_archive(path, transform, before_replace=lambda: _add_tombstones(ids))
+    # The rollups of the archived days can't be rebuilt (their rows are not in the table anymore),
+    # only the token ones have the value (see _erase_latency_tokens)
+    log.info(f'Erasure {erasure.id}: {changed} archived rows ({erasure.mode})')
+    erasure.status = 'rebuilding'
+    erasure.updated = datetime.now()
+    model.Session.commit()
+
+
+def _add_tombstones(ids):
+    try:
+        model.Session.execute(TOMBSTONE_SQL, {'ids': ids})
+        model.Session.commit()
+    except Exception:
+        model.Session.rollback()
+        raise
+
+
+def _erase_latency_tokens(erasure, value):
+    """ Delete (or rename to the pseudonym) the token latency rollups of the days we can't rebuild """
+    statement = LATENCY_TOKEN_SQL[erasure.mode].execution_options(api_tracking_query=f'{erasure.mode}_latency_token')
+    try:
+        model.Session.execute(statement, {'value': value, 'pseudonym': pseudonym(value)})
+        model.Session.commit()
+    except Exception:
+        model.Session.rollback()
+        raise
+
+
+def _rebuild_rollups(erasure, value):
+    for since, until in day_ranges(erasure.days or []):
+        rebuild_latency_rollups(since, until)
+        # Only login rows (by user) are counted in the sketches built from tracking_usage
+        if erasure.field == 'user_id' and use_sketches():
+            rebuild_sketches(since, until, kinds=(ACTIVE_USERS, ))
+    if erasure.field == 'token_name':
+        _erase_latency_tokens(erasure, value)
+    if erasure.days and use_views():
+        refresh_views()
+    erasure.status = 'done'
+    # We do not keep the erased value
+    erasure.value = None
+    erasure.updated = datetime.now()
+    model.Session.commit()
+    log.info(f'Erasure {erasure.id} done: {erasure.rows} rows, rollups rebuilt for {len(erasure.days or [])} days')
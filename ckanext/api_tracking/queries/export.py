@@ -0,0 +1,144 @@
+"""
+Columnar export of tracking_usage (Parquet) for offline analytics (pandas, DuckDB, Spark).
+Rows of a time range are read from a server side cursor and written in row groups,
+so memory does not grow with the range. Dimension columns (types, tokens, users, objects)
+are dictionary encoded and the file is compressed: files are much smaller than the CSV
+and load with their types.
+The download is written to a temporary file first: the read transaction never waits for the client
+and a failed export is never sent as a complete file.
+Requires pyarrow (pip install ckanext-api-tracking[export]).
+"""
+import json
+import logging
+import tempfile
+
+from ckan.plugins import toolkit
+from sqlalchemy import text
+
+from ckanext.api_tracking.replica import read_stream
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+
+log = logging.getLogger(__name__)
+
+DICTIONARY_COLUMNS = (
+    'user_id',
+    'tracking_type',
+    'tracking_sub_type',
+    'token_name',
+    'object_type',
+    'object_id',
+    'package_id',
+    'owner_org',
+)
+JSON_COLUMNS = ('extras', )
+DEFAULT_ROW_GROUP_SIZE = 100000
+
+EXPORT_SQL = text("""
+SELECT
+    id, timestamp, last_timestamp, user_id, tracking_type, tracking_sub_type, token_name,
+    object_type, object_id, package_id, owner_org, count, duration_ms, status_code, response_bytes, extras
+FROM tracking_usage
+WHERE timestamp >= :since AND timestamp < :until
+ORDER BY timestamp, id
+""").execution_options(api_tracking_query='export_tracking_usage')
+
+
+def get_max_days():
+    """ ckanext.api_tracking.export_max_days: longest time range of the Parquet download, default 31 """
+    return toolkit.asint(toolkit.config.get('ckanext.api_tracking.export_max_days', 31))
+
+
+def check_range(since, until):
+    """ Raise ValueError if the download range [since, until) is empty or longer than the limit """
+    if since >= until:
+        raise ValueError('since must be before until')
+    max_days = get_max_days()
+    if (until - since).days > max_days:
+        raise ValueError(f'The range is limited to {max_days} days, use the export command for longer ones')
+
+
+def available():
+    return pa is not None
+
+
+def get_schema():
+    if not available():
+        raise RuntimeError('The columnar export requires pyarrow: pip install ckanext-api-tracking[export]')
+    dimension = pa.dictionary(pa.int32(), pa.string())
+    return pa.schema([
+        ('id', pa.string()),
+        ('timestamp', pa.timestamp('us')),
+        ('last_timestamp', pa.timestamp('us')),
+        *[(column, dimension) for column in DICTIONARY_COLUMNS],
+        ('count', pa.int32()),
+        ('duration_ms', pa.float64()),
+        ('status_code', pa.int16()),
+        ('response_bytes', pa.int64()),
+        # JSON text, the keys change between rows
+        ('extras', pa.string()),
+    ])
+
+
+def to_table(rows, schema):
+    """ Arrow table from a list of row mappings """
+    columns = {}
+    for field in schema:
+        values = [row[field.name] for row in rows]
+        if field.name in JSON_COLUMNS:
+            values = [json.dumps(value) if value is not None else None for value in values]
+        columns[field.name] = pa.array(values, type=field.type)
+    return pa.Table.from_pydict(columns, schema=schema)
+
+
+def write_row_groups(rows, sink, row_group_size=DEFAULT_ROW_GROUP_SIZE, compression='zstd'):
+    """ Write rows (mappings) to a Parquet file (path or file object), a row group every row_group_size rows
+        Yields the number of rows written after each row group, the last time once the file is complete
+    """
+    schema = get_schema()
+    total = 0
+    batch = []
+    with pq.ParquetWriter(sink, schema, compression=compression, use_dictionary=list(DICTIONARY_COLUMNS)) as writer:
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= row_group_size:
+                writer.write_table(to_table(batch, schema), row_group_size=row_group_size)
+                total += len(batch)
+                batch = []
+                yield total
+        if batch:
+            writer.write_table(to_table(batch, schema), row_group_size=row_group_size)
+            total += len(batch)
+    yield total
+
+
+def export_tracking_usage(sink, since, until, row_group_size=DEFAULT_ROW_GROUP_SIZE, query_class='batch'):
+    """ Export the tracking rows in [since, until) to a Parquet file
+        Yields the number of rows written after each row group, the last time once the file is complete
+    """
+    rows = (
+        row._mapping
+        for row in read_stream(EXPORT_SQL, {'since': since, 'until': until}, query_class=query_class)
+    )
+    yield from write_row_groups(rows, sink, row_group_size=row_group_size)
+
+
+def export_to_temporary_file(since, until, query_class='batch'):
+    """ Export the tracking rows in [since, until) to an anonymous temporary file (deleted once closed)
+        Returns (the complete file at its start, the number of rows)
+    """
+    parquet = tempfile.TemporaryFile(suffix='.parquet')
+    try:
+        total = 0
+        for total in export_tracking_usage(parquet, since, until, query_class=query_class):
+            pass
+    except Exception:
+        parquet.close()
+        raise
+    parquet.seek(0)
+    return parquet, total
@@ -0,0 +1,132 @@
+"""
+Incremental ingestion of CKAN core tracking (tracking_raw) into tracking_usage.
+tracking_raw URLs are parsed once into dataset and resource IDs and saved as
+tracking_usage rows (tracking_type core), one row per visitor, object and day with the count.
+Dashboards can then query one indexed store instead of parsing URLs on every view.
+A watermark (tracking_ingest_state) keeps the last ingested timestamp.
+Row IDs are derived from the visits they count (first visit, visitor and object),
+ingesting a window again skips the rows already saved.
+"""
+import logging
+from datetime import datetime, timedelta
+
+from ckan import model
+from ckan.plugins import toolkit
+from sqlalchemy import func, text
+
+from ckanext.api_tracking.models import TrackingIngestState
+
+
+log = logging.getLogger(__name__)
+
+SOURCE = 'tracking_raw'
+TRACKING_TYPE = 'core'
+# Rows with a timestamp newer than this (seconds) could still be written, wait for them
+DEFAULT_LAG = 60
+
+_VISIT_COLUMNS = 'tr.access_timestamp, tr.user_key'
+_WINDOW = 'tr.access_timestamp > :since AND tr.access_timestamp <= :until'
+
+INGEST_SQL = f"""
+INSERT INTO tracking_usage (
+    id, timestamp, last_timestamp, count,
+    tracking_type, tracking_sub_type, object_type, object_id, extras, package_id, owner_org
+)
+SELECT
+    md5(concat_ws('|',
+        MIN(visits.access_timestamp), visits.user_key, visits.sub_type, visits.object_type, visits.object_id
+    ))::uuid::text,
+    MIN(visits.access_timestamp), MAX(visits.access_timestamp), COUNT(*),
+    '{TRACKING_TYPE}', visits.sub_type, visits.object_type, visits.object_id,
+    jsonb_build_object('source', '{SOURCE}', 'user_key', visits.user_key, 'package_id', visits.package_id),
+    visits.package_id, visits.owner_org
+FROM (
+    -- Dataset pages
+    SELECT {_VISIT_COLUMNS}, 'view' AS sub_type, 'dataset' AS object_type, p.id AS object_id,
+        p.id AS package_id, p.owner_org AS owner_org
+    FROM tracking_raw AS tr
+    JOIN package AS p ON p.name = substring(tr.url FROM '/dataset/([^/?#]+)')
+    WHERE tr.tracking_type = 'page' AND tr.url LIKE '/dataset/%' AND {_WINDOW}
+    UNION ALL
+    -- Downloads of uploaded resources (.../resource/ID/download/...)
+    SELECT {_VISIT_COLUMNS}, 'download', 'resource', r.id, r.package_id, p.owner_org
+    FROM tracking_raw AS tr
+    JOIN resource AS r ON r.id = substring(tr.url FROM '/resource/([^/?#]+)')
+    JOIN package AS p ON p.id = r.package_id
+    WHERE tr.tracking_type IN ('resource', 'download') AND {_WINDOW}
+    UNION ALL
+    -- Downloads of linked resources
+    SELECT {_VISIT_COLUMNS}, 'download', 'resource', r.id, r.package_id, p.owner_org
+    FROM tracking_raw AS tr
+    JOIN resource AS r ON r.url = tr.url
+    JOIN package AS p ON p.id = r.package_id
+    WHERE tr.tracking_type IN ('resource', 'download') AND tr.url NOT LIKE '%/resource/%' AND {_WINDOW}
+) AS visits
+GROUP BY date(visits.access_timestamp), visits.user_key, visits.sub_type,
+    visits.object_type, visits.object_id, visits.package_id, visits.owner_org
+ON CONFLICT (id) DO NOTHING
+"""
+
+
+def use_ingested():
+    """ ckanext.api_tracking.core_tracking_source: raw (default) or ingested """
+    return toolkit.config.get('ckanext.api_tracking.core_tracking_source', 'raw') == 'ingested'
+
+
+def ingest_windows(since, until, hours=24):
+    """ Split the period (since, until] in windows of hours """
+    step = timedelta(hours=hours)
+    start = since
+    while start < until:
+        end = min(start + step, until)
+        yield start, end
+        start = end
+
+
+def get_watermark():
+    state = model.Session.query(TrackingIngestState).get(SOURCE)
+    return state.watermark if state else None
+
+
+def _first_raw_timestamp():
+    first = model.Session.execute(text('SELECT MIN(access_timestamp) FROM tracking_raw')).scalar()
+    # The window excludes the start
+    return first - timedelta(microseconds=1) if first else None
+
+
+def ingest_tracking_raw(hours=24, lag=DEFAULT_LAG, since=None):
+    """ Ingest the new tracking_raw rows, in windows of hours, saving the watermark after each one
+        since: only for the first run, where to start (default: the first tracking_raw row)
+        Returns (rows saved, watermark)
+    """
+    state = model.Session.query(TrackingIngestState).get(SOURCE)
+    if state is None:
+        start = since or _first_raw_timestamp()
+        if start is None:
+            log.info('No tracking_raw rows to ingest')
+            return 0, None
+        state = TrackingIngestState(name=SOURCE, watermark=start, rows=0)
+        model.Session.add(state)
+        model.Session.commit()
+    elif since:
+        raise ValueError(f'{SOURCE} was already ingested up to {state.watermark}')
+
+    until = datetime.now() - timedelta(seconds=lag)
+    total = 0
+    for window_start, window_end in ingest_windows(state.watermark, until, hours=hours):
+        try:
+            result = model.Session.execute(
+                text(INGEST_SQL).execution_options(api_tracking_query='ingest_tracking_raw'),
+                {'since': window_start, 'until': window_end},
+            )
+            state.watermark = window_end
+            state.rows = (state.rows or 0) + result.rowcount
+            state.updated = func.now()
+            # The rows and the watermark are saved together
+            model.Session.commit()
+        except Exception:
+            model.Session.rollback()
+            raise
+        total += result.rowcount
+        log.info(f'Ingested {result.rowcount} tracking_raw rows up to {window_end}')
+    return total, state.watermark
@@ -0,0 +1,125 @@
+"""
+Latency rollups and percentiles
+Raw durations (tracking_usage.duration_ms) are rolled up daily into
+log-bucketed histograms (tracking_usage_latency) so percentiles for any
+period are computed merging a few rows per key
+"""
+import logging
+from datetime import date, timedelta
+
+from ckan import model
+from sqlalchemy import func, text
+
+from ckanext.api_tracking.latency import BUCKETS_PER_OCTAVE, EXTRAS_KEY, MIN_DURATION_MS, LatencyHistogram
+from ckanext.api_tracking.models import TrackingUsageLatency
+from ckanext.api_tracking.replica import read_all
+
+
+log = logging.getLogger(__name__)
+
+DIMENSIONS = ('action', 'token', 'dataset')
+PERCENTILES = (50, 95, 99)
+
+# Same bucket formula as ckanext.api_tracking.latency.bucket_for
+# Merged rows keep the histogram of their durations in extras (latency_buckets), other rows
+# (a single request, or merged requests in the same bucket) are counted in the bucket of their average duration
+_BUCKET_SQL = 'floor(:buckets * log(2.0, greatest(t.duration_ms / t.count, :min_ms)::numeric))::integer'
+
+ROLLUP_SQL = f"""
+WITH samples AS (
+    SELECT
+        date(t.timestamp) AS day,
+        t.tracking_type,
+        t.tracking_sub_type,
+        t.object_type,
+        t.object_id,
+        t.token_name,
+        t.extras->>'action' AS action,
+        COALESCE(h.bucket::integer, {_BUCKET_SQL}) AS bucket,
+        COALESCE(h.count::integer, t.count) AS count
+    FROM tracking_usage AS t
+    LEFT JOIN LATERAL jsonb_each_text(
+        CASE WHEN jsonb_typeof(t.extras->'{EXTRAS_KEY}') = 'object' THEN t.extras->'{EXTRAS_KEY}' END
+    ) AS h(bucket, count) ON true
+    WHERE t.duration_ms IS NOT NULL AND t.timestamp >= :since AND t.timestamp < :until
+)
+INSERT INTO tracking_usage_latency (day, dimension, key, bucket, count)
+SELECT day, dimension, key, bucket, SUM(count)
+FROM (
+    SELECT
+        day,
+        'action' AS dimension,
+        COALESCE(action, tracking_type || '.' || tracking_sub_type || '.' || COALESCE(object_type, '')) AS key,
+        bucket,
+        count
+    FROM samples
+    UNION ALL
+    SELECT day, 'token', token_name, bucket, count
+    FROM samples
+    WHERE token_name IS NOT NULL
+    UNION ALL
+    SELECT day, 'dataset', object_id, bucket, count
+    FROM samples
+    WHERE object_type = 'dataset' AND object_id IS NOT NULL
+) AS events
+GROUP BY day, dimension, key, bucket
+"""
+
+
+def refresh_latency_rollups(days=2):
+    """ Rebuild the latency rollups for the last days (today included) """
+    since = date.today() - timedelta(days=days - 1)
+    rebuild_latency_rollups(since, date.today() + timedelta(days=1))
+    return since
+
+
+def rebuild_latency_rollups(since, until):
+    """ Rebuild the latency rollups for the days in [since, until) """
+    log.info(f'Refreshing latency rollups since {since} until {until}')
+    try:
+        model.Session.query(TrackingUsageLatency).filter(
+            TrackingUsageLatency.day >= since,
+            TrackingUsageLatency.day < until,
+        ).delete(synchronize_session=False)
+        model.Session.execute(
+            text(ROLLUP_SQL).execution_options(api_tracking_query='latency_rollup'),
+            {'since': since, 'until': until, 'buckets': BUCKETS_PER_OCTAVE, 'min_ms': MIN_DURATION_MS},
+        )
+        model.Session.commit()
+    except Exception:
+        model.Session.rollback()
+        raise
+
+
+def get_latency_percentiles(dimension='action', days=30, limit=20, percentiles=PERCENTILES):
+    """ Latency percentiles (ms) by action, token or dataset for the last days
+        Most used keys first
+    """
+    if dimension not in DIMENSIONS:
+        raise ValueError(f'Invalid dimension: {dimension}')
+    since = date.today() - timedelta(days=days - 1)
+    query = model.Session.query(
+        TrackingUsageLatency.key,
+        TrackingUsageLatency.bucket,
+        func.sum(TrackingUsageLatency.count),
+    ).filter(
+        TrackingUsageLatency.dimension == dimension,
+        TrackingUsageLatency.day >= since,
+    ).group_by(
+        TrackingUsageLatency.key,
+        TrackingUsageLatency.bucket,
+    ).execution_options(api_tracking_query='latency_percentiles')
+    rows = read_all(query)
+
+    histograms = {}
+    for key, bucket, count in rows:
+        histograms.setdefault(key, LatencyHistogram()).add_bucket(bucket, int(count))
+
+    results = []
+    for key, histogram in histograms.items():
+        result = {'key': key, 'total': histogram.total}
+        for percentile in percentiles:
+            result[f'p{percentile}'] = round(histogram.percentile(percentile), 2)
+        results.append(result)
+    results.sort(key=lambda result: result['total'], reverse=True)
+    return results[:limit]
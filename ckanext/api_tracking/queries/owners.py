@@ -0,0 +1,84 @@
+"""
+Backfill the dataset and organization (package_id, owner_org) of the tracking rows
+saved before they were resolved at write time (see ckanext.api_tracking.owners).
+Rows are updated in batches (ordered by id), each batch in its own transaction.
+Updated rows get the txid of the batch, so the change feed sends them again.
+"""
+import logging
+
+from ckan import model
+from sqlalchemy import bindparam, text
+
+from ckanext.api_tracking.owners import OWNED_TYPES
+
+
+log = logging.getLogger(__name__)
+
+SELECT_SQL = text("""
+SELECT t.id, t.object_type
+FROM tracking_usage AS t
+WHERE t.id > :after
+    AND t.object_type IN :object_types
+    AND t.object_id IS NOT NULL
+    AND t.package_id IS NULL AND t.owner_org IS NULL
+ORDER BY t.id
+LIMIT :batch_size
+""").bindparams(bindparam('object_types', expanding=True))
+
+UPDATE_SQL = {
+    'dataset': """
+        UPDATE tracking_usage AS t SET package_id = p.id, owner_org = p.owner_org, txid = txid_current()
+        FROM package AS p
+        WHERE t.id IN :ids AND (p.id = t.object_id OR p.name = t.object_id)
+    """,
+    'resource': """
+        UPDATE tracking_usage AS t SET package_id = r.package_id, owner_org = p.owner_org, txid = txid_current()
+        FROM resource AS r
+        JOIN package AS p ON p.id = r.package_id
+        WHERE t.id IN :ids AND r.id = t.object_id
+    """,
+    'organization': """
+        UPDATE tracking_usage AS t SET owner_org = g.id, txid = txid_current()
+        FROM "group" AS g
+        WHERE t.id IN :ids AND (g.id = t.object_id OR g.name = t.object_id) AND g.is_organization
+    """,
+}
+UPDATE_SQL = {
+    object_type: text(sql).bindparams(bindparam('ids', expanding=True))
+    for object_type, sql in UPDATE_SQL.items()
+}
+
+
+def backfill_owners(batch_size=5000):
+    """ Fill package_id and owner_org for the old tracking rows
+        Rows of deleted objects stay empty
+        Returns (rows checked, rows updated)
+    """
+    after = ''
+    checked = 0
+    updated = 0
+    while True:
+        rows = model.Session.execute(
+            SELECT_SQL.execution_options(api_tracking_query='backfill_owners_select'),
+            {'after': after, 'object_types': list(OWNED_TYPES), 'batch_size': batch_size},
+        ).fetchall()
+        if not rows:
+            break
+        try:
+            for object_type in OWNED_TYPES:
+                ids = [row.id for row in rows if row.object_type == object_type]
+                if not ids:
+                    continue
+                result = model.Session.execute(
+                    UPDATE_SQL[object_type].execution_options(api_tracking_query=f'backfill_owners_{object_type}'),
+                    {'ids': ids},
+                )
+                updated += result.rowcount
+            model.Session.commit()
+        except Exception:
+            model.Session.rollback()
+            raise
+        after = rows[-1].id
+        checked += len(rows)
+        log.info(f'Owners backfill: {checked} rows checked, {updated} updated')
+    return checked, updated
@@ -0,0 +1,145 @@
+"""
+Distinct users counts from daily HyperLogLog sketches
+Counting distinct users (COUNT(DISTINCT ...)) needs a full scan of the period.
+We keep a sketch per day (and dataset) and merge them to count for any period.
+Days are immutable once finished, we only rebuild the last days.
+"""
+import logging
+from collections import defaultdict
+from datetime import date, datetime, time, timedelta
+
+from ckan import model
+from ckan.plugins import toolkit
+
+from ckanext.api_tracking.dashboard import stream_query_results
+from ckanext.api_tracking.guardrails import cap_limit
+from ckanext.api_tracking.hll import HyperLogLog
+from ckanext.api_tracking.models import TrackingUsageSketch
+from ckanext.api_tracking.replica import read_all
+
+
+log = logging.getLogger(__name__)
+
+DATASET_VIEWERS = 'dataset_viewers'
+ACTIVE_USERS = 'active_users'
+
+
+def use_sketches():
+    """ ckanext.api_tracking.unique_counts: exact (default) or sketch """
+    return toolkit.config.get('ckanext.api_tracking.unique_counts', 'exact') == 'sketch'
+
+
+def build_sketches(days=2):
+    """ Rebuild the sketches for the last days (today included) """
+    since = date.today() - timedelta(days=days - 1)
+    total = rebuild_sketches(since, date.today() + timedelta(days=1))
+    return since, total
+
+
+def rebuild_sketches(since, until, kinds=(DATASET_VIEWERS, ACTIVE_USERS)):
+    """ Rebuild the sketches of some kinds for the days in [since, until). Returns the number of sketches """
+    params = {'measure_from': datetime.combine(since, time.min), 'measure_to': datetime.combine(until, time.min)}
+    sketches = defaultdict(HyperLogLog)
+    if DATASET_VIEWERS in kinds:
+        for row in stream_query_results('dataset-viewers-by-day.sql', params):
+            sketches[(row.day, DATASET_VIEWERS, row.package_id)].add(row.user_key)
+    if ACTIVE_USERS in kinds:
+        for row in stream_query_results('active-users-by-day.sql', params):
+            sketches[(row.day, ACTIVE_USERS, '')].add(row.user_id)
+
+    log.info(f'Saving {len(sketches)} sketches since {since} until {until}')
+    try:
+        model.Session.query(TrackingUsageSketch).filter(
+            TrackingUsageSketch.day >= since,
+            TrackingUsageSketch.day < until,
+            TrackingUsageSketch.kind.in_(kinds),
+        ).delete(synchronize_session=False)
+        model.Session.bulk_insert_mappings(TrackingUsageSketch, [
+            {'day': day, 'kind': kind, 'key': key, 'sketch': sketch.to_bytes()}
+            for (day, kind, key), sketch in sketches.items()
+        ])
+        model.Session.commit()
+    except Exception:
+        model.Session.rollback()
+        raise
+    return len(sketches)
+
+
+def merge_sketches(kind, since, keys=None):
+    """ Merge the daily sketches since a date. Returns {key: HyperLogLog} """
+    query = model.Session.query(
+        TrackingUsageSketch.key,
+        TrackingUsageSketch.sketch,
+    ).filter(
+        TrackingUsageSketch.kind == kind,
+        TrackingUsageSketch.day >= since,
+    )
+    if keys is not None:
+        query = query.filter(TrackingUsageSketch.key.in_(keys))
+    merged = {}
+    for key, sketch in read_all(query.execution_options(api_tracking_query=f'merge_sketches_{kind}')):
+        sketch = HyperLogLog.from_bytes(sketch)
+        if key in merged:
+            merged[key].merge(sketch)
+        else:
+            merged[key] = sketch
+    return merged
+
+
+def unique_dataset_views(days_ago=365, limit=10, package_id=None, owner_org=None):
+    """ Same results as dashboard.stats.get_unique_dataset_views, from the sketches """
+    since = (datetime.now() - timedelta(days=days_ago)).date()
+    keys = None
+    if package_id:
+        package = model.Package.get(package_id)
+        if not package:
+            return []
+        keys = [package.id]
+    if owner_org:
+        organization = model.Group.get(owner_org)
+        if not organization:
+            return []
+        query = model.Session.query(model.Package.id).filter(model.Package.owner_org == organization.id)
+        if keys is not None:
+            query = query.filter(model.Package.id.in_(keys))
+        keys = [row.id for row in query]
+    counts = sorted(
+        ((sketch.count(), key) for key, sketch in merge_sketches(DATASET_VIEWERS, since, keys).items()),
+        reverse=True,
+    )[:limit]
+    packages = {}
+    if counts:
+        ids = [key for _, key in counts]
+        packages = {package.id: package for package in model.Session.query(model.Package).filter(model.Package.id.in_(ids))}
+    ret = []
+    for views, key in counts:
+        package = packages.get(key)
+        if not package:
+            continue
+        ret.append({
+            'name': package.name,
+            'views': views,
+            'title': package.title,
+            'id': package.id,
+        })
+    return ret
+
+
+def users_active_metrics(limit=30):
+    """ Same results as queries.users.users_active_metrics, from the sketches """
+    query = model.Session.query(
+        TrackingUsageSketch.day,
+        TrackingUsageSketch.sketch,
+    ).filter(
+        TrackingUsageSketch.kind == ACTIVE_USERS,
+    ).order_by(
+        TrackingUsageSketch.day.desc()
+    ).limit(cap_limit(limit)).execution_options(api_tracking_query='users_active_metrics_sketch')
+    return [{'day': day, 'total': HyperLogLog.from_bytes(sketch).count()} for day, sketch in read_all(query)]
+
+
+def unique_active_users(days_ago=30):
+    """ Distinct users logged in in the period """
+    since = (datetime.now() - timedelta(days=days_ago)).date()
+    sketch = merge_sketches(ACTIVE_USERS, since).get('')
+    return sketch.count() if sketch else 0
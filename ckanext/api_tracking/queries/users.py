@@ -1,6 +1,9 @@
 from ckan import model
 from sqlalchemy import func, desc
+from ckanext.api_tracking.guardrails import cap_limit
 from ckanext.api_tracking.models import TrackingUsage
+from ckanext.api_tracking.queries import sketches
+from ckanext.api_tracking.replica import read_all
 
 
 def users_active_metrics(limit=30):
@@ -12,6 +15,8 @@ def users_active_metrics(limit=30):
     and group by day
 
     """
+    if sketches.use_sketches():
+        return sketches.users_active_metrics(limit=limit)
 
     query = model.Session.query(
         func.date(TrackingUsage.timestamp).label('day'),
@@ -22,6 +27,6 @@ def users_active_metrics(limit=30):
         func.date(TrackingUsage.timestamp)
     ).order_by(
         desc('day')
-    ).limit(limit)
+    ).limit(cap_limit(limit)).execution_options(api_tracking_query='users_active_metrics')
 
-    return query.all()
+    return read_all(query)
@@ -0,0 +1,108 @@
+"""
+Materialized views with the dashboard and report aggregates.
+The views are created by the migrations (empty) and refreshed periodically
+with `ckan api-tracking refresh-views`. Once a view is refreshed, the dashboard
+reads it (a few rows, indexed) instead of aggregating the tracking tables on each request.
+"""
+import logging
+import time
+from datetime import datetime
+
+from ckan import model
+from ckan.plugins import toolkit
+from sqlalchemy import text
+from sqlalchemy.sql import column, table
+
+from ckanext.api_tracking.models import TrackingViewRefresh
+
+
+log = logging.getLogger(__name__)
+
+# Periods (days) pre-computed in the views by period. Same as in the migration
+PERIODS = (7, 30, 365)
+
+TOKEN_USAGE_BY_OBJECT = 'tracking_token_usage_by_object_mv'
+TOKEN_USAGE_BY_TOKEN = 'tracking_token_usage_by_token_mv'
+UNIQUE_DATASET_VIEWS = 'tracking_unique_dataset_views_mv'
+DATASET_VIEWS = 'tracking_dataset_views_mv'
+RESOURCE_DOWNLOADS = 'tracking_resource_downloads_mv'
+VIEWS = (
+    TOKEN_USAGE_BY_OBJECT,
+    TOKEN_USAGE_BY_TOKEN,
+    UNIQUE_DATASET_VIEWS,
+    DATASET_VIEWS,
+    RESOURCE_DOWNLOADS,
+)
+
+token_usage_by_object = table(
+    TOKEN_USAGE_BY_OBJECT,
+    column('object_type'),
+    column('object_id'),
+    column('package_id'),
+    column('owner_org'),
+    column('total'),
+)
+token_usage_by_token = table(
+    TOKEN_USAGE_BY_TOKEN,
+    column('token_name'),
+    column('user_id'),
+    column('total'),
+    column('response_bytes'),
+)
+
+
+def use_views():
+    """ ckanext.api_tracking.materialized_views: default false """
+    return toolkit.asbool(toolkit.config.get('ckanext.api_tracking.materialized_views', False))
+
+
+def get_freshness(name):
+    """ Time of the last refresh of a view (None if it was never refreshed or the views are disabled) """
+    if not use_views():
+        return None
+    state = model.Session.query(TrackingViewRefresh).get(name)
+    return state.refreshed if state else None
+
+
+def view_ready(name, days_ago=None):
+    """ Read this view? days_ago for the views by period """
+    if days_ago is not None and days_ago not in PERIODS:
+        return False
+    return get_freshness(name) is not None
+
+
+def _is_populated(name):
+    return model.Session.execute(
+        text("SELECT relispopulated FROM pg_class WHERE relname = :name AND relkind = 'm'"),
+        {'name': name},
+    ).scalar()
+
+
+def refresh_view(name):
+    """ Refresh a view without locking the readers (the first refresh locks it)
+        Returns (seconds, concurrently)
+    """
+    if name not in VIEWS:
+        raise ValueError(f'Unknown view: {name}')
+    started = datetime.now()
+    start = time.perf_counter()
+    try:
+        concurrently = bool(_is_populated(name))
+        sql = f'REFRESH MATERIALIZED VIEW {"CONCURRENTLY " if concurrently else ""}{name}'
+        model.Session.execute(text(sql).execution_options(api_tracking_query=f'refresh_{name}'))
+        duration = time.perf_counter() - start
+        state = model.Session.query(TrackingViewRefresh).get(name) or TrackingViewRefresh(name=name)
+        state.refreshed = started
+        state.duration_ms = duration * 1000
+        model.Session.add(state)
+        model.Session.commit()
+    except Exception:
+        model.Session.rollback()
+        raise
+    log.info(f'Materialized view {name} refreshed in {duration:.1f}s')
+    return duration, concurrently
+
+
+def refresh_views(names=None):
+    """ Refresh all (or some) views. Returns {name: seconds} """
+    return {name: refresh_view(name)[0] for name in (names or VIEWS)}
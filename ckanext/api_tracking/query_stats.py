@@ -0,0 +1,113 @@
+"""
+Instrumentation for the SQL queries of this extension (dashboard and reports).
+Only statements with the `api_tracking_query` execution option (the query name)
+are measured, other CKAN queries are not affected.
+
+    query.execution_options(api_tracking_query='most_accessed_token')
+
+Slow queries are logged with their parameters and per-query stats
+are available at /tracking-dashboard/query-stats
+"""
+import logging
+import threading
+import time
+
+from ckan.plugins import toolkit
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from ckanext.api_tracking.latency import LatencyHistogram
+
+
+log = logging.getLogger(__name__)
+
+QUERY_OPTION = 'api_tracking_query'
+
+
+class QueryStats:
+    """ Stats for a single named query """
+
+    def __init__(self, name):
+        self.name = name
+        self.calls = 0
+        self.rows = 0
+        self.total_ms = 0
+        self.max_ms = 0
+        self.histogram = LatencyHistogram()
+
+    def add(self, duration_ms, rows):
+        self.calls += 1
+        self.rows += rows or 0
+        self.total_ms += duration_ms
+        self.max_ms = max(self.max_ms, duration_ms)
+        self.histogram.add(duration_ms)
+
+    def as_dict(self):
+        return {
+            'name': self.name,
+            'calls': self.calls,
+            'avg_rows': round(self.rows / self.calls, 1) if self.calls else None,
+            'total_ms': round(self.total_ms, 2),
+            'avg_ms': round(self.total_ms / self.calls, 2) if self.calls else None,
+            'p50_ms': round(self.histogram.percentile(50), 2) if self.calls else None,
+            'p95_ms': round(self.histogram.percentile(95), 2) if self.calls else None,
+            'max_ms': round(self.max_ms, 2),
+        }
+
+
+class QueryStatsRegistry:
+    """ Stats for all the named queries (in this worker) """
+
+    def __init__(self):
+        self._queries = {}
+        self._lock = threading.Lock()
+
+    def record(self, name, duration_ms, rows):
+        with self._lock:
+            stats = self._queries.get(name)
+            if stats is None:
+                stats = self._queries[name] = QueryStats(name)
+            stats.add(duration_ms, rows)
+
+    def summary(self):
+        """ Stats for all the queries, the most expensive first """
+        with self._lock:
+            rows = [stats.as_dict() for stats in self._queries.values()]
+        return sorted(rows, key=lambda row: row['total_ms'], reverse=True)
+
+    def reset(self):
+        with self._lock:
+            self._queries = {}
+
+
+registry = QueryStatsRegistry()
+
+
+def get_slow_query_threshold():
+    """ ckanext.api_tracking.slow_query_ms: log queries slower than this (ms), default 1000. 0 to disable """
+    return toolkit.asint(toolkit.config.get('ckanext.api_tracking.slow_query_ms', 1000))
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None and context.execution_options.get(QUERY_OPTION):
+        context._api_tracking_started = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, '_api_tracking_started', None)
+    if started is None:
+        return
+    duration_ms = (time.perf_counter() - started) * 1000
+    name = context.execution_options[QUERY_OPTION]
+    rows = cursor.rowcount if cursor.rowcount >= 0 else None
+    registry.record(name, duration_ms, rows)
+    threshold = get_slow_query_threshold()
+    if threshold and duration_ms >= threshold:
+        log.warning(f'Slow query {name}: {duration_ms:.1f} ms, {rows} rows, params: {parameters}')
+
+
+def install():
+    """ Listen to all the engines (once). Not named queries are ignored """
+    if not event.contains(Engine, 'before_cursor_execute', _before_cursor_execute):
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
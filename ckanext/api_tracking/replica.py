@@ -0,0 +1,170 @@
+"""
+Optional read replica for the dashboards, reports and API queries.
+Heavy reads are sent to a read-only database (PostgreSQL streaming replica) so they
+do not compete with CKAN writes. We fall back to the primary if the replica is not
+available or is lagging more than the max staleness. Writes always use the primary.
+"""
+import logging
+import threading
+import time
+
+from ckan import model
+from ckan.plugins import toolkit
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.orm import Session
+
+from ckanext.api_tracking import metrics
+from ckanext.api_tracking.guardrails import cap_limit, is_timeout, set_statement_timeout, timeout_error
+
+
+log = logging.getLogger(__name__)
+
+# Seconds behind the primary. 0 if the replica replayed everything received
+LAG_SQL = """
+SELECT CASE
+    WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+    ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+END
+"""
+
+replica_fallbacks = metrics.registry.counter(
+    'api_tracking_replica_fallbacks_total', 'Read queries sent to the primary because the replica was down or lagging'
+)
+
+
+class ReplicaRouter:
+    """ Decide if reads can go to the replica. Health and lag are checked every check_interval seconds """
+
+    def __init__(self, url, max_staleness=300, check_interval=30, engine=None):
+        self.url = url
+        self.max_staleness = max_staleness
+        self.check_interval = check_interval
+        self._engine = engine
+        self._healthy = False
+        self._checked = None
+        self._lock = threading.Lock()
+
+    @property
+    def engine(self):
+        if self._engine is None:
+            self._engine = create_engine(self.url, pool_pre_ping=True)
+        return self._engine
+
+    def get_lag(self):
+        with self.engine.connect() as conn:
+            return float(conn.execute(text(LAG_SQL)).scalar() or 0)
+
+    def available(self, now=None):
+        """ Can we read from the replica now? """
+        now = now or time.monotonic()
+        with self._lock:
+            if self._checked is not None and now - self._checked < self.check_interval:
+                return self._healthy
+            self._checked = now
+        try:
+            lag = self.get_lag()
+        except DBAPIError as e:
+            log.warning(f'Read replica not available: {e}')
+            healthy = False
+        else:
+            healthy = lag <= self.max_staleness
+            if not healthy:
+                log.warning(f'Read replica lagging {lag:.0f}s (max {self.max_staleness}s)')
+        self._healthy = healthy
+        return healthy
+
+    def mark_down(self, error, now=None):
+        """ A query failed on the replica, use the primary until the next check """
+        log.warning(f'Read replica query failed, using the primary: {error}')
+        with self._lock:
+            self._healthy = False
+            self._checked = now or time.monotonic()
+
+
+_router = None
+
+
+def get_router():
+    """ Get the replica router or None if there is no read replica
+        Config:
+            ckanext.api_tracking.read_replica_url: SQLAlchemy URL, default empty (disabled)
+            ckanext.api_tracking.read_replica_max_staleness: seconds, default 300
+            ckanext.api_tracking.read_replica_check_interval: seconds, default 30
+    """
+    global _router
+    url = toolkit.config.get('ckanext.api_tracking.read_replica_url')
+    if not url:
+        return None
+    if _router is None:
+        max_staleness = toolkit.asint(toolkit.config.get('ckanext.api_tracking.read_replica_max_staleness', 300))
+        check_interval = toolkit.asint(toolkit.config.get('ckanext.api_tracking.read_replica_check_interval', 30))
+        _router = ReplicaRouter(url, max_staleness=max_staleness, check_interval=check_interval)
+    return _router
+
+
+def _replica():
+    """ The router if reads should go to the replica now """
+    router = get_router()
+    if router is None:
+        return None
+    if not router.available():
+        replica_fallbacks.inc()
+        return None
+    return router
+
+
+def _read(run, query_class):
+    """ Run a read in a transaction with the statement timeout of its class,
+        on the replica if available, falling back to the primary
+    """
+    router = _replica()
+    engines = [router.engine, model.meta.engine] if router else [model.meta.engine]
+    for engine in engines:
+        try:
+            with engine.connect() as conn, conn.begin():
+                timeout = set_statement_timeout(conn, query_class)
+                return run(conn)
+        except DBAPIError as e:
+            if is_timeout(e):
+                # Do not run it again on the primary
+                raise timeout_error(e, query_class, timeout) from e
+            if engine is model.meta.engine:
+                raise
+            router.mark_down(e)
+            replica_fallbacks.inc()
+
+
+def read_all(query, query_class='report'):
+    """ Run an ORM query (built with model.Session) on a read session. Returns all the rows """
+    def run(conn):
+        session = Session(bind=conn)
+        try:
+            return query.with_session(session).all()
+        finally:
+            session.close()
+    return _read(run, query_class)
+
+
+def read_execute(statement, params=None, query_class='dashboard'):
+    """ Run a core statement on a read connection. Returns all the rows (mappings)
+        The limit param is capped to the max rows of the query class
+    """
+    params = dict(params or {})
+    if 'limit' in params:
+        params['limit'] = cap_limit(params['limit'], query_class)
+    return _read(lambda conn: conn.execute(statement, params).mappings().all(), query_class)
+
+
+def read_stream(statement, params=None, query_class='batch'):
+    """ Run a core statement on a read connection, fetching the rows in batches (server side cursor) """
+    router = _replica()
+    engine = router.engine if router else model.meta.engine
+    with engine.connect() as conn, conn.begin():
+        timeout = set_statement_timeout(conn, query_class)
+        try:
+            yield from conn.execution_options(stream_results=True).execute(statement, params or {})
+        except DBAPIError as e:
+            if is_timeout(e):
+                raise timeout_error(e, query_class, timeout) from e
+            raise
@@ -0,0 +1,317 @@
+"""
+Usage counters shared by all the CKAN workers in the same node.
+Each gunicorn/uWSGI worker is an isolated process so any in-process aggregation
+is fragmented. This module keeps a fixed-size hash table in a memory mapped file,
+all workers increment it and a single elected worker saves the counters periodically.
+
+File layout:
+    header: magic, version, slots, stripes, last flush (epoch)
+    slots: key hash, count, first seen, last seen, total duration (ms), total bytes, key length, key (JSON)
+
+The table is split in stripes, each stripe owns a contiguous range of slots
+and has its own lock (a byte-range lock on the file + a thread lock).
+"""
+import atexit
+import fcntl
+import hashlib
+import json
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+from datetime import datetime
+
+from ckan.plugins import toolkit
+
+from ckanext.api_tracking.coalesce import KEY_FIELDS
+from ckanext.api_tracking.latency import bucket_for
+
+
+log = logging.getLogger(__name__)
+
+MAGIC = b'CKANTRK1'
+HEADER = struct.Struct('<8sIIId')
+SLOT_HEAD = struct.Struct('<QQdddQH')
+VERSION = 3
+SLOT_SIZE = 512
+KEY_SIZE = SLOT_SIZE - SLOT_HEAD.size
+HEADER_SIZE = 64
+LATENCY_KEY = '_latency_bucket'
+
+
+class SharedCounterTable:
+    """ Fixed-size lock-striped hash table in a memory mapped file """
+
+    def __init__(self, path, slots=4096, stripes=64):
+        if slots % stripes:
+            raise ValueError('slots must be a multiple of stripes')
+        self.path = path
+        self.slots = slots
+        self.stripes = stripes
+        self.slots_per_stripe = slots // stripes
+        self.size = HEADER_SIZE + slots * SLOT_SIZE
+        self._pid = None
+        self._fd = None
+        self._mmap = None
+        self._open()
+
+    def _close(self):
+        """ Close the file and the mapping (inherited from the parent process after a fork) """
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def _open(self):
+        """ Open (and create if required) the shared file.
+            Called again after a fork, file descriptors and locks are per process
+        """
+        self._close()
+        self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        self._flusher_lock_offset = self.size + self.stripes
+        with self._file_lock(0, HEADER_SIZE):
+            if os.fstat(self._fd).st_size == 0:
+                os.ftruncate(self._fd, self.size)
+                os.pwrite(self._fd, HEADER.pack(MAGIC, VERSION, self.slots, self.stripes, time.time()), 0)
+            magic, version, slots, stripes, _last_flush = HEADER.unpack(os.pread(self._fd, HEADER.size, 0))
+        same_geometry = slots == self.slots and stripes == self.stripes and os.fstat(self._fd).st_size == self.size
+        if magic != MAGIC or version != VERSION or not same_geometry:
+            self._close()
+            raise ValueError(f'{self.path} was created with a different configuration ({slots} slots, {stripes} stripes)')
+        self._mmap = mmap.mmap(self._fd, self.size)
+        self._thread_locks = [threading.Lock() for _ in range(self.stripes)]
+        # File locks do not exclude the threads of the same process
+        self._flusher_thread_lock = threading.Lock()
+        self._pid = os.getpid()
+
+    def _ensure_process(self):
+        if self._pid != os.getpid():
+            self._open()
+
+    def _file_lock(self, offset, length, blocking=True):
+        return _FileLock(self._fd, offset, length, blocking)
+
+    def _stripe_lock(self, stripe):
+        # Lock bytes beyond the table so they never overlap with the header lock
+        return _StripeLock(self._thread_locks[stripe], self._file_lock(self.size + stripe, 1))
+
+    @staticmethod
+    def encode_key(data_dict):
+        dimensions = {field: data_dict.get(field) for field in KEY_FIELDS}
+        dimensions['extras'] = data_dict.get('extras') or {}
+        # Slots only keep the total duration: events with different latency buckets are counted apart
+        # so the average duration of a slot is still in the right bucket
+        if data_dict.get('duration_ms') is not None:
+            dimensions[LATENCY_KEY] = bucket_for(data_dict['duration_ms'] / (data_dict.get('count') or 1))
+        key = json.dumps(dimensions, sort_keys=True, default=str).encode('utf-8')
+        key_hash = int.from_bytes(hashlib.blake2b(key, digest_size=8).digest(), 'little')
+        # 0 means empty slot
+        return key, key_hash or 1
+
+    def _slot_offset(self, stripe, index):
+        return HEADER_SIZE + (stripe * self.slots_per_stripe + index) * SLOT_SIZE
+
+    def increment(self, data_dict, count=1, now=None):
+        """ Count an event.
+            Returns False if the event can't be stored here (key too long or stripe full)
+        """
+        now = now or time.time()
+        return self._add(
+            data_dict, count, now, now, data_dict.get('duration_ms') or 0, data_dict.get('response_bytes') or 0
+        )
+
+    def restore(self, events):
+        """ Count again drained events (that we were not able to save)
+            Returns the events that can't be stored anymore
+        """
+        lost = []
+        for event in events:
+            restored = self._add(
+                event, event['count'], event['timestamp'].timestamp(), event['last_timestamp'].timestamp(),
+                event.get('duration_ms') or 0, event.get('response_bytes') or 0,
+            )
+            if not restored:
+                lost.append(event)
+        return lost
+
+    def _add(self, data_dict, count, first, last, duration, response_bytes):
+        self._ensure_process()
+        key, key_hash = self.encode_key(data_dict)
+        if len(key) > KEY_SIZE:
+            return False
+        stripe = key_hash % self.stripes
+        start = (key_hash // self.stripes) % self.slots_per_stripe
+        with self._stripe_lock(stripe):
+            for probe in range(self.slots_per_stripe):
+                offset = self._slot_offset(stripe, (start + probe) % self.slots_per_stripe)
+                slot_hash, slot_count, slot_first, slot_last, total_duration, total_bytes, key_len = (
+                    SLOT_HEAD.unpack_from(self._mmap, offset)
+                )
+                if slot_hash == 0:
+                    SLOT_HEAD.pack_into(self._mmap, offset, key_hash, count, first, last, duration, response_bytes, len(key))
+                    start_key = offset + SLOT_HEAD.size
+                    self._mmap[start_key:start_key + len(key)] = key
+                    return True
+                if slot_hash == key_hash:
+                    start_key = offset + SLOT_HEAD.size
+                    if self._mmap[start_key:start_key + key_len] != key:
+                        # hash collision, keep looking
+                        continue
+                    SLOT_HEAD.pack_into(
+                        self._mmap, offset, key_hash, slot_count + count, min(slot_first, first), max(slot_last, last),
+                        total_duration + duration, total_bytes + response_bytes, key_len,
+                    )
+                    return True
+        return False
+
+    def drain(self):
+        """ Read and reset all the counters. Returns a list of tracking_usage_create data dicts """
+        self._ensure_process()
+        events = []
+        empty = bytes(SLOT_SIZE)
+        for stripe in range(self.stripes):
+            with self._stripe_lock(stripe):
+                for index in range(self.slots_per_stripe):
+                    offset = self._slot_offset(stripe, index)
+                    slot_hash, count, first, last, total_duration, total_bytes, key_len = SLOT_HEAD.unpack_from(
+                        self._mmap, offset
+                    )
+                    if slot_hash == 0:
+                        continue
+                    start_key = offset + SLOT_HEAD.size
+                    event = json.loads(self._mmap[start_key:start_key + key_len].decode('utf-8'))
+                    event.pop(LATENCY_KEY, None)
+                    event['count'] = count
+                    event['timestamp'] = datetime.fromtimestamp(first)
+                    event['last_timestamp'] = datetime.fromtimestamp(last)
+                    event['duration_ms'] = total_duration or None
+                    event['response_bytes'] = total_bytes or None
+                    events.append(event)
+                    self._mmap[offset:offset + SLOT_SIZE] = empty
+        return events
+
+    @property
+    def last_flush(self):
+        self._ensure_process()
+        return HEADER.unpack_from(self._mmap, 0)[4]
+
+    def flush_due(self, interval, now=None):
+        now = now or time.time()
+        return now - self.last_flush >= interval
+
+    def drain_if_due(self, interval):
+        """ Only one worker (the one getting the flusher lock) drains the table
+            Returns the drained events or None if we are not the flusher or it is not time yet
+        """
+        self._ensure_process()
+        if not self._flusher_thread_lock.acquire(blocking=False):
+            return None
+        try:
+            lock = self._file_lock(self._flusher_lock_offset, 1, blocking=False)
+            if not lock.acquire():
+                return None
+            try:
+                # Other worker could flush while we were waiting
+                if not self.flush_due(interval):
+                    return None
+                events = self.drain()
+                HEADER.pack_into(self._mmap, 0, MAGIC, VERSION, self.slots, self.stripes, time.time())
+                return events
+            finally:
+                lock.release()
+        finally:
+            self._flusher_thread_lock.release()
+
+
+class _FileLock:
+    """ Byte-range lock on a file, shared between processes """
+
+    def __init__(self, fd, offset, length, blocking=True):
+        self.fd = fd
+        self.offset = offset
+        self.length = length
+        self.blocking = blocking
+
+    def acquire(self):
+        flags = fcntl.LOCK_EX if self.blocking else fcntl.LOCK_EX | fcntl.LOCK_NB
+        try:
+            fcntl.lockf(self.fd, flags, self.length, self.offset)
+        except (BlockingIOError, PermissionError):
+            return False
+        return True
+
+    def release(self):
+        fcntl.lockf(self.fd, fcntl.LOCK_UN, self.length, self.offset)
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *args):
+        self.release()
+
+
+class _StripeLock:
+    """ File locks are per process, we also need a thread lock for threaded workers """
+
+    def __init__(self, thread_lock, file_lock):
+        self.thread_lock = thread_lock
+        self.file_lock = file_lock
+
+    def __enter__(self):
+        self.thread_lock.acquire()
+        self.file_lock.acquire()
+        return self
+
+    def __exit__(self, *args):
+        try:
+            self.file_lock.release()
+        finally:
+            self.thread_lock.release()
+
+
+_table = None
+_table_failed = False
+
+
+def get_shared_counters():
+    """ Get the shared counters table or None if not enabled
+        Config:
+            ckanext.api_tracking.shared_counters_path: file to share, default empty (disabled)
+            ckanext.api_tracking.shared_counters_slots: table size, default 4096
+            ckanext.api_tracking.shared_counters_stripes: number of locks, default 64
+    """
+    global _table, _table_failed
+    path = toolkit.config.get('ckanext.api_tracking.shared_counters_path')
+    if not path or _table_failed:
+        return None
+    if _table is None:
+        slots = toolkit.asint(toolkit.config.get('ckanext.api_tracking.shared_counters_slots', 4096))
+        stripes = toolkit.asint(toolkit.config.get('ckanext.api_tracking.shared_counters_stripes', 64))
+        try:
+            _table = SharedCounterTable(path, slots=slots, stripes=stripes)
+        except (OSError, ValueError) as e:
+            log.error(f'Unable to use shared counters at {path}: {e}')
+            _table_failed = True
+            return None
+        # Do not leave the last counters in the file when the worker stops
+        atexit.register(_flush_at_exit)
+    return _table
+
+
+def _flush_at_exit():
+    # Avoid circular imports
+    from ckanext.api_tracking.persistence import flush_shared_counters
+    try:
+        flush_shared_counters(force=True)
+    except Exception as e:
+        log.error(f'Unable to save the shared counters: {e}')
+
+
+def get_flush_interval():
+    """ ckanext.api_tracking.shared_counters_flush_interval: seconds, default 60 """
+    return toolkit.asint(toolkit.config.get('ckanext.api_tracking.shared_counters_flush_interval', 60))
@@ -93,6 +93,12 @@ class TrackingUsageAPIDataset(TrackingUsageF):
     object_type = 'dataset'
 
 
+class TrackingUsageAPIOrganization(TrackingUsageF):
+    tracking_type = 'api'
+    tracking_sub_type = 'show'
+    object_type = 'organization'
+
+
 class TrackingUsageAPIResource(TrackingUsageF):
     tracking_type = 'api'
     tracking_sub_type = 'show'
@@ -0,0 +1,117 @@
+from datetime import date, datetime, timedelta
+
+import pytest
+from ckan import model
+
+from ckanext.api_tracking.models import TrackingUsage
+from ckanext.api_tracking.queries.archive import (
+    archive_files,
+    archive_path,
+    archive_tracking_usage,
+    parse_age,
+    read_rows,
+    restore_tracking_usage,
+    write_rows,
+)
+from ckanext.api_tracking.tests import factories as tf
+
+
+def _row(id, timestamp, **kwargs):
+    row = {
+        'id': id,
+        'timestamp': timestamp,
+        'last_timestamp': None,
+        'tracking_type': 'api',
+        'tracking_sub_type': 'show',
+        'count': 1,
+        'extras': {'source': 'test'},
+    }
+    row.update(kwargs)
+    return row
+
+
+class TestArchive:
+    """ Test the archive files (one gzip NDJSON file per day) """
+
+    def test_parse_age(self):
+        assert parse_age('180d') == timedelta(days=180)
+        assert parse_age('26w') == timedelta(weeks=26)
+        assert parse_age('12h') == timedelta(hours=12)
+        assert parse_age(30) == timedelta(days=30)
+        with pytest.raises(ValueError):
+            parse_age('six months')
+
+    def test_round_trip(self, tmp_path):
+        rows = [
+            _row('a', datetime(2026, 1, 1, 10, 0), last_timestamp=datetime(2026, 1, 1, 11, 0)),
+            _row('b', datetime(2026, 1, 1, 12, 0)),
+            _row('c', datetime(2026, 1, 2, 9, 0)),
+        ]
+        files = write_rows(tmp_path, rows)
+        assert files == [archive_path(tmp_path, date(2026, 1, 1)), archive_path(tmp_path, date(2026, 1, 2))]
+        assert files[0].relative_to(tmp_path).as_posix() == '2026/01/tracking_usage-2026-01-01.ndjson.gz'
+        assert list(read_rows(files)) == rows
+
+    def test_append(self, tmp_path):
+        """ Batches of the same day are appended to the same file """
+        write_rows(tmp_path, [_row('a', datetime(2026, 1, 1, 10, 0))])
+        write_rows(tmp_path, [_row('b', datetime(2026, 1, 1, 11, 0))])
+        files = archive_files(tmp_path)
+        assert len(files) == 1
+        assert [row['id'] for row in read_rows(files)] == ['a', 'b']
+
+    def test_files_by_day(self, tmp_path):
+        write_rows(tmp_path, [_row(str(day), datetime(2026, 1, day)) for day in range(1, 6)])
+        files = archive_files(tmp_path, since=date(2026, 1, 2), until=date(2026, 1, 4))
+        assert [row['id'] for row in read_rows(files)] == ['2', '3', '4']
+        assert archive_files(files[0]) == [files[0]]
+
+
+def _saved_rows():
+    rows = model.Session.query(TrackingUsage).order_by(TrackingUsage.timestamp, TrackingUsage.id).all()
+    return [(row.id, row.timestamp, row.object_id, row.count, row.extras) for row in rows]
+
+
+@pytest.mark.usefixtures('clean_db')
+class TestArchiveTrackingUsage:
+    """ Test the old rows are moved to the archive files and restored """
+
+    @pytest.fixture
+    def rows(self):
+        now = datetime.now()
+        old = now - timedelta(days=200)
+        for n in range(5):
+            # Two days, more rows than a batch
+            tf.TrackingUsageF(
+                user_id='user-1', object_id=f'dataset-{n}', count=n + 1,
+                timestamp=old + timedelta(days=n % 2, minutes=n), extras={'n': n},
+            )
+        for n in range(2):
+            tf.TrackingUsageF(user_id='user-1', object_id=f'recent-{n}', timestamp=now - timedelta(days=n))
+        return _saved_rows()
+
+    def test_archive_and_restore(self, tmp_path, rows):
+        total, files = archive_tracking_usage(tmp_path, timedelta(days=180), batch_size=2)
+        assert total == 5
+        assert len(files) == 2
+        assert [row[2] for row in _saved_rows()] == ['recent-1', 'recent-0']
+        assert sorted(row['id'] for row in read_rows(files)) == sorted(row[0] for row in rows[:5])
+
+        # Nothing else to archive
+        assert archive_tracking_usage(tmp_path, timedelta(days=180), batch_size=2)[0] == 0
+
+        total, restored_files = restore_tracking_usage(tmp_path, batch_size=2)
+        assert total == 5
+        assert restored_files == files
+        assert _saved_rows() == rows
+
+        # Rows already in the table are skipped
+        restore_tracking_usage(tmp_path, batch_size=2)
+        assert _saved_rows() == rows
+
+    def test_keep_rows(self, tmp_path, rows):
+        total, files = archive_tracking_usage(tmp_path, timedelta(days=180), batch_size=2, delete=False)
+        assert total == 5
+        assert len(files) == 2
+        assert _saved_rows() == rows
+        assert len(list(read_rows(files))) == 5
@@ -0,0 +1,91 @@
+from datetime import datetime
+from types import SimpleNamespace
+
+import pytest
+
+from ckanext.api_tracking.models import TrackingUsage
+from ckanext.api_tracking.queries import changes
+from ckanext.api_tracking.queries.changes import START, format_cursor, get_changes, merge_changes, parse_cursor
+from ckanext.api_tracking.queries.erasure import pseudonym, run_erasure, start_erasure
+from ckanext.api_tracking.tests import factories as tf
+
+
+class TestChanges:
+    """ Test the change feed cursors and pages """
+
+    def test_cursor(self):
+        assert parse_cursor(None) == START
+        assert parse_cursor('') == START
+        cursor = format_cursor(1234, 'b5e1a2c0-0000-4000-8000-000000000001')
+        assert parse_cursor(cursor) == (1234, 'b5e1a2c0-0000-4000-8000-000000000001')
+        # Rows saved before the change feed
+        assert parse_cursor(format_cursor(0, 'abc')) == (0, 'abc')
+
+    @pytest.mark.parametrize('cursor', ['1234', 'abc:def', '12:a b', "12:x' OR 1=1"])
+    def test_invalid_cursor(self, cursor):
+        with pytest.raises(ValueError):
+            parse_cursor(cursor)
+
+    def test_stream_pages(self, monkeypatch):
+        """ The stream continues page by page from the last cursor and stops at max_rows """
+        rows = [{'id': str(i), 'cursor': format_cursor(i, str(i))} for i in range(1, 8)]
+        calls = []
+
+        def get_changes(cursor=None, limit=None):
+            calls.append((cursor, limit))
+            start = int(parse_cursor(cursor)[0]) if cursor else 0
+            page = rows[start:start + limit]
+            return {'results': page, 'cursor': page[-1]['cursor'], 'has_more': start + limit < len(rows)}
+
+        monkeypatch.setattr(changes, 'get_changes', get_changes)
+        monkeypatch.setattr(changes, 'get_page_size', lambda: 3)
+        assert [row['id'] for row in changes.stream_changes()] == [str(i) for i in range(1, 8)]
+        assert calls == [(None, 3), ('3:3', 3), ('6:6', 3)]
+        assert [row['id'] for row in changes.stream_changes(max_rows=4)] == ['1', '2', '3', '4']
+
+    def test_to_dict(self):
+        values = {column.name: None for column in TrackingUsage.__table__.columns}
+        values.update(id='abc', timestamp=datetime(2026, 1, 1, 10, 0), txid=None, change_txid=0)
+        change = changes._to_dict(SimpleNamespace(**values))
+        assert change['timestamp'] == '2026-01-01T10:00:00'
+        assert change['cursor'] == '0:abc'
+        assert change['deleted'] is False
+        assert 'txid' not in change
+
+    def test_merge_tombstones(self):
+        rows = [{'id': 'a', 'cursor': '5:a'}, {'id': 'c', 'cursor': '12:c'}]
+        tombstones = [changes._tombstone_to_dict(SimpleNamespace(id='b', txid=9))]
+        assert tombstones == [{'id': 'b', 'deleted': True, 'cursor': '9:b'}]
+        assert [change['id'] for change in merge_changes(rows, tombstones, 10)] == ['a', 'b', 'c']
+        assert [change['id'] for change in merge_changes(rows, tombstones, 2)] == ['a', 'b']
+
+
+@pytest.mark.usefixtures('clean_db')
+class TestChangeFeed:
+    """ Test updated and erased rows are sent again """
+
+    def _sync(self, cursor=None):
+        page = get_changes(cursor=cursor, limit=100)
+        return page['results'], page['cursor']
+
+    def test_updated_rows_are_sent_again(self):
+        tf.TrackingUsageF(user_id='user-1', token_name='token-1')
+        tf.TrackingUsageF(user_id='user-2', token_name='token-2')
+        results, cursor = self._sync()
+        assert len(results) == 2
+
+        run_erasure(start_erasure('user_id', 'user-1', mode='pseudonymize').id, sleep=0)
+        results, cursor = self._sync(cursor)
+        assert [(change['user_id'], change['deleted']) for change in results] == [(pseudonym('user-1'), False)]
+        assert self._sync(cursor)[0] == []
+
+    def test_erased_rows_are_tombstones(self):
+        erased = tf.TrackingUsageF(user_id='user-1', token_name='token-1')
+        tf.TrackingUsageF(user_id='user-2', token_name='token-2')
+        results, cursor = self._sync()
+        assert len(results) == 2
+
+        run_erasure(start_erasure('token_name', 'token-1').id, sleep=0)
+        results, cursor = self._sync(cursor)
+        assert results == [{'id': erased.id, 'deleted': True, 'cursor': results[0]['cursor']}]
+        assert self._sync(cursor)[0] == []
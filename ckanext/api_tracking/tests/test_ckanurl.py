@@ -1,4 +1,5 @@
-from unittest.mock import Mock
+import pytest
+from unittest.mock import Mock, patch
 from werkzeug.datastructures import MultiDict, ImmutableMultiDict
 
 from ckanext.api_tracking.models.url import CKANURL
@@ -314,3 +315,141 @@ class TestCKANURL:
         # Test API action patterns
         assert re.match(regexs['api_action'][0], 'api/action/package_search')
         assert re.match(regexs['api_action'][1], 'api/3/action/package_search')
+
+
+class TestCKANURLBody:
+    """ Test we only read the request body when it is safe """
+
+    def _json_request(self):
+        mock_request = Mock()
+        mock_request.is_json = True
+        mock_request.get_json.return_value = {'name': 'test-dataset'}
+        mock_request.form = MultiDict()
+        return mock_request
+
+    def test_multipart_body_is_never_read(self):
+        mock_request = Mock()
+        environ = {
+            'REQUEST_METHOD': 'POST',
+            'QUERY_STRING': 'id=test',
+            'CONTENT_TYPE': 'multipart/form-data; boundary=xxx',
+            'CONTENT_LENGTH': '100',
+            'werkzeug.request': mock_request,
+        }
+        url = CKANURL(environ)
+        assert url.get_data() == {'id': 'test'}
+        mock_request.get_data.assert_not_called()
+        mock_request.get_json.assert_not_called()
+        mock_request.form.to_dict.assert_not_called()
+
+    def test_large_body_is_not_read(self):
+        mock_request = self._json_request()
+        environ = {
+            'REQUEST_METHOD': 'POST',
+            'QUERY_STRING': 'id=test',
+            'CONTENT_TYPE': 'application/json',
+            'CONTENT_LENGTH': '2000',
+            'werkzeug.request': mock_request,
+        }
+        url = CKANURL(environ, max_body_size=1000)
+        assert url.get_data() == {'id': 'test'}
+        mock_request.get_json.assert_not_called()
+
+    def test_small_body_is_read(self):
+        mock_request = self._json_request()
+        environ = {
+            'REQUEST_METHOD': 'POST',
+            'CONTENT_TYPE': 'application/json',
+            'CONTENT_LENGTH': '20',
+            'werkzeug.request': mock_request,
+        }
+        url = CKANURL(environ, max_body_size=1000)
+        assert url.get_data() == {'name': 'test-dataset'}
+
+    def test_chunked_body_is_not_read(self):
+        mock_request = self._json_request()
+        environ = {
+            'REQUEST_METHOD': 'POST',
+            'CONTENT_TYPE': 'application/json',
+            'wsgi.input_terminated': True,
+            'werkzeug.request': mock_request,
+        }
+        url = CKANURL(environ)
+        assert url.get_data() == {}
+        mock_request.get_json.assert_not_called()
+
+    def test_json_body_parsed_once(self):
+        """ A JSON body without JSON content type is parsed once and cached """
+        mock_request = Mock()
+        mock_request.is_json = False
+        mock_request.stream.peek.return_value = b'{'
+        mock_request.get_data.return_value = b'{"name": "test-dataset"}'
+        environ = {
+            'REQUEST_METHOD': 'POST',
+            'CONTENT_LENGTH': '24',
+            'werkzeug.request': mock_request,
+        }
+        url = CKANURL(environ)
+        assert url.get_data() == {'name': 'test-dataset'}
+        assert url.get_data() == {'name': 'test-dataset'}
+        mock_request.get_data.assert_called_once_with(cache=True)
+        mock_request.get_json.assert_not_called()
+
+    def test_get_data_is_a_copy(self):
+        """ A handler changing the data does not change it for the next handlers """
+        url = CKANURL({'QUERY_STRING': 'id=test'})
+        data = url.get_data()
+        data['id'] = 'changed'
+        data['new'] = 'value'
+        assert url.get_data() == {'id': 'test'}
+
+    def test_get_data_no_werkzeug_request_cached(self):
+        """ The data is also cached when the werkzeug request is missing """
+        environ = {
+            'REQUEST_METHOD': 'POST',
+            'CONTENT_LENGTH': '10',
+            'QUERY_STRING': 'id=test',
+        }
+        url = CKANURL(environ)
+        with patch.object(CKANURL, '_extract_query_data', return_value={'id': 'test'}) as extract:
+            assert url.get_data() == {'id': 'test'}
+            assert url.get_data() == {'id': 'test'}
+        extract.assert_called_once()
+
+
+class TestCKANURLParseOnce:
+    """ Test the request is parsed once and values are not mishandled """
+
+    def test_query_value_with_equal_sign(self):
+        environ = {'QUERY_STRING': 'fq=name%3Dtest&q=a=b'}
+        url = CKANURL(environ)
+        assert url.get_query_param('fq') == 'name=test'
+        assert url.get_query_param('q') == 'a=b'
+
+    def test_repeated_query_keys(self):
+        environ = {'QUERY_STRING': 'facet.field=tags&facet.field=organization&rows=1'}
+        url = CKANURL(environ)
+        assert url.get_query_params('facet.field') == ['tags', 'organization']
+        assert url.get_query_param('facet.field') == 'tags'
+        assert url.get_query_string() == {'facet.field': 'tags', 'rows': '1'}
+
+    def test_query_parsed_once(self):
+        url = CKANURL({'QUERY_STRING': 'id=test'})
+        assert url.query is url.query
+        # get_query_string returns a new dict every time
+        data = url.get_query_string()
+        data['other'] = 'value'
+        assert url.get_query_string() == {'id': 'test'}
+
+    def test_url_parts(self):
+        url = CKANURL({'PATH_INFO': '/dataset/test/resource/res-id'})
+        assert url.parts == ('dataset', 'test', 'resource', 'res-id')
+        assert url.get_url_part(-1) == 'res-id'
+        assert url.parts is url.parts
+
+    def test_read_only(self):
+        url = CKANURL({'PATH_INFO': '/dataset/test'})
+        with pytest.raises(AttributeError):
+            url.url = 'dataset/other'
+        with pytest.raises(AttributeError):
+            url.other_attribute = 'value'
@@ -0,0 +1,133 @@
+import threading
+from datetime import datetime, timedelta
+from unittest import mock
+
+from ckanext.api_tracking.coalesce import EventCoalescer
+from ckanext.api_tracking.persistence import FlushThread
+
+
+def _event(**kwargs):
+    event = {
+        'user_id': 'user-1',
+        'token_name': 'token-1',
+        'tracking_type': 'api',
+        'tracking_sub_type': 'show',
+        'object_type': 'dataset',
+        'object_id': 'dataset-1',
+        'extras': {'method': 'GET'},
+    }
+    event.update(kwargs)
+    return event
+
+
+class TestEventCoalescer:
+    """ Test identical events are merged in memory """
+
+    def test_identical_events_are_merged(self):
+        coalescer = EventCoalescer(window=60)
+        start = datetime(2026, 1, 1, 10, 0, 0)
+        for second in range(10):
+            ready = coalescer.add(_event(), now=start + timedelta(seconds=second))
+            assert ready == []
+
+        assert len(coalescer) == 1
+        events = coalescer.flush()
+        assert len(events) == 1
+        event = events[0]
+        assert event['count'] == 10
+        assert event['timestamp'] == start
+        assert event['last_timestamp'] == start + timedelta(seconds=9)
+        assert event['extras'] == {'method': 'GET'}
+        assert len(coalescer) == 0
+
+    def test_different_events_are_not_merged(self):
+        coalescer = EventCoalescer(window=60)
+        now = datetime(2026, 1, 1, 10, 0, 0)
+        coalescer.add(_event(), now=now)
+        coalescer.add(_event(object_id='dataset-2'), now=now)
+        coalescer.add(_event(token_name='token-2'), now=now)
+        coalescer.add(_event(tracking_sub_type='edit'), now=now)
+
+        events = coalescer.flush()
+        assert len(events) == 4
+        assert all(event['count'] == 1 for event in events)
+
+    def test_events_are_released_after_the_window(self):
+        coalescer = EventCoalescer(window=60)
+        start = datetime(2026, 1, 1, 10, 0, 0)
+        coalescer.add(_event(), now=start)
+        coalescer.add(_event(), now=start + timedelta(seconds=30))
+        ready = coalescer.add(_event(object_id='dataset-2'), now=start + timedelta(seconds=61))
+
+        assert len(ready) == 1
+        assert ready[0]['object_id'] == 'dataset-1'
+        assert ready[0]['count'] == 2
+        # The new event is still waiting
+        assert len(coalescer) == 1
+
+    def test_max_keys(self):
+        coalescer = EventCoalescer(window=60, max_keys=2)
+        now = datetime(2026, 1, 1, 10, 0, 0)
+        coalescer.add(_event(object_id='dataset-1'), now=now)
+        coalescer.add(_event(object_id='dataset-2'), now=now)
+        ready = coalescer.add(_event(object_id='dataset-3'), now=now)
+
+        # The oldest event is released to keep memory bounded
+        assert [event['object_id'] for event in ready] == ['dataset-1']
+        assert len(coalescer) == 2
+
+    def test_merge_already_coalesced_events(self):
+        coalescer = EventCoalescer(window=60)
+        start = datetime(2026, 1, 1, 10, 0, 0)
+        end = start + timedelta(seconds=20)
+        coalescer.add(_event(count=5, timestamp=start, last_timestamp=end), now=end)
+        coalescer.add(_event(count=3, timestamp=end), now=end)
+
+        event = coalescer.flush()[0]
+        assert event['count'] == 8
+        assert event['timestamp'] == start
+        assert event['last_timestamp'] == end
+
+    def test_pop_ready_without_new_events(self):
+        """ The flush thread releases closed windows even if no more events arrive """
+        coalescer = EventCoalescer(window=60)
+        start = datetime(2026, 1, 1, 10, 0, 0)
+        coalescer.add(_event(), now=start)
+        assert coalescer.pop_ready(now=start + timedelta(seconds=30)) == []
+        ready = coalescer.pop_ready(now=start + timedelta(seconds=61))
+        assert [event['object_id'] for event in ready] == ['dataset-1']
+        assert len(coalescer) == 0
+
+
+class TestFlushThread:
+    """ Test the worker thread saving the buffered events """
+
+    def test_flush_every_interval(self):
+        called = threading.Event()
+        flush = mock.Mock(side_effect=lambda: called.set())
+        with mock.patch('ckanext.api_tracking.persistence.model') as model:
+            thread = FlushThread(0.01, flush)
+            thread.start()
+            assert called.wait(2)
+            thread.stop()
+            thread.join(2)
+        assert not thread.is_alive()
+        assert model.Session.remove.called
+
+    def test_errors_do_not_stop_the_thread(self):
+        calls = []
+        done = threading.Event()
+
+        def flush():
+            calls.append(1)
+            if len(calls) == 1:
+                raise RuntimeError('database is down')
+            done.set()
+
+        with mock.patch('ckanext.api_tracking.persistence.model'):
+            thread = FlushThread(0.01, flush)
+            thread.start()
+            assert done.wait(2)
+            thread.stop()
+            thread.join(2)
+        assert len(calls) >= 2
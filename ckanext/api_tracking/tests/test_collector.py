@@ -0,0 +1,84 @@
+import socket
+import threading
+from datetime import datetime
+
+import pytest
+
+from ckanext.api_tracking.collector import (
+    Collector,
+    DatagramSender,
+    decode_event,
+    encode_event,
+    parse_address,
+)
+
+
+def _event(**kwargs):
+    event = {
+        'user_id': 'user-1',
+        'token_name': 'token-1',
+        'tracking_type': 'api',
+        'tracking_sub_type': 'show',
+        'object_type': 'dataset',
+        'object_id': 'dataset-1',
+        'extras': {'method': 'GET'},
+    }
+    event.update(kwargs)
+    return event
+
+
+class TestCollector:
+    """ Test the datagram transport and the collector """
+
+    def test_parse_address(self):
+        assert parse_address('udp://127.0.0.1:8799') == (socket.AF_INET, ('127.0.0.1', 8799))
+        assert parse_address('unix:///tmp/tracking.sock') == (socket.AF_UNIX, '/tmp/tracking.sock')
+        with pytest.raises(ValueError):
+            parse_address('tcp://127.0.0.1:8799')
+        with pytest.raises(ValueError):
+            parse_address('udp://127.0.0.1')
+
+    def test_encode_decode(self):
+        now = datetime(2026, 1, 1, 10, 0, 0)
+        event = decode_event(encode_event(_event(timestamp=now)))
+        assert event['timestamp'] == now
+        assert event['object_id'] == 'dataset-1'
+        assert event['event_id']
+
+    def test_send_without_collector(self, tmp_path):
+        """ Events are dropped, the request is never blocked """
+        sender = DatagramSender(f'unix://{tmp_path}/missing.sock')
+        assert sender.send(_event()) is False
+
+    def test_dedupe_and_merge(self):
+        written = []
+        collector = Collector('udp://127.0.0.1:0', written.extend, batch_size=100)
+        payload = encode_event(_event())
+        assert collector.handle_datagram(payload)
+        # The same datagram received twice
+        assert not collector.handle_datagram(payload)
+        assert collector.handle_datagram(encode_event(_event()))
+        assert collector.handle_datagram(encode_event(_event(object_id='dataset-2')))
+        assert not collector.handle_datagram(b'not json')
+
+        collector.flush()
+        assert len(written) == 2
+        counts = {event['object_id']: event['count'] for event in written}
+        assert counts == {'dataset-1': 2, 'dataset-2': 1}
+
+    def test_unix_socket(self, tmp_path):
+        address = f'unix://{tmp_path}/tracking.sock'
+        written = []
+        collector = Collector(address, written.extend, batch_size=3, flush_interval=60)
+        collector.bind()
+        stop = threading.Event()
+        thread = threading.Thread(target=collector.serve_forever, kwargs={'stop': stop})
+        thread.start()
+
+        sender = DatagramSender(address)
+        for n in range(3):
+            assert sender.send(_event(object_id=f'dataset-{n}'))
+
+        stop.set()
+        thread.join(timeout=5)
+        assert sorted(event['object_id'] for event in written) == ['dataset-0', 'dataset-1', 'dataset-2']
@@ -0,0 +1,59 @@
+import pytest
+from types import SimpleNamespace
+from ckan.plugins import toolkit
+from ckan.lib.helpers import url_for
+from ckan.tests import factories
+
+from ckanext.api_tracking.tests import factories as tf
+
+
+@pytest.fixture
+def base_data():
+    obj = SimpleNamespace()
+    obj.sysadmin = factories.SysadminWithToken()
+    obj.user1 = factories.UserWithToken()
+    obj.org1 = factories.Organization()
+    obj.org2 = factories.Organization()
+    obj.dataset1 = factories.Dataset(owner_org=obj.org1['id'])
+    obj.dataset2 = factories.Dataset(owner_org=obj.org2['id'])
+    obj.resource11 = factories.Resource(package_id=obj.dataset1['id'])
+    for dataset in [obj.dataset1, obj.dataset1, obj.dataset2]:
+        tf.TrackingUsageAPIDataset(
+            user=obj.user1, object_id=dataset['id'], package_id=dataset['id'], owner_org=dataset['owner_org']
+        )
+    for _ in range(3):
+        tf.TrackingUsageAPIResource(
+            user=obj.user1, object_id=obj.resource11['id'], package_id=obj.dataset1['id'], owner_org=obj.org1['id']
+        )
+    tf.TrackingUsageAPIOrganization(user=obj.user1, object_id=obj.org2['id'], owner_org=obj.org2['id'])
+    return obj
+
+
+@pytest.mark.usefixtures('clean_db')
+class TestTrackingCSVOrganization:
+    """ Test the API usage by organization CSV """
+    def test_organization_with_token_csv_no_auth(self, app, base_data):
+        url = url_for('tracking_csv.most_accessed_organization_with_token_csv')
+        auth = {"Authorization": base_data.user1['token']}
+        with pytest.raises(toolkit.NotAuthorized):
+            app.get(url, headers=auth)
+
+    def test_organization_with_token_csv(self, app, base_data):
+        url = url_for('tracking_csv.most_accessed_organization_with_token_csv')
+        auth = {"Authorization": base_data.sysadmin['token']}
+        response = app.get(url, headers=auth)
+        assert response.status_code == 200
+
+        lines = response.body.splitlines()
+        header = lines[0].split(',')
+        assert header == [
+            'organization_id', 'organization_title', 'organization_url',
+            'organization_requests', 'dataset_requests', 'resource_requests', 'total',
+        ]
+        rows = [line.split(',') for line in lines[1:]]
+        assert len(rows) == 2
+        # Sorted by total
+        assert rows[0][0] == base_data.org1['id']
+        assert rows[0][3:] == ['0', '2', '3', '5']
+        assert rows[1][0] == base_data.org2['id']
+        assert rows[1][3:] == ['1', '1', '0', '2']
@@ -0,0 +1,39 @@
+import csv
+from datetime import datetime
+from io import StringIO
+
+import pytest
+from ckan.lib.helpers import url_for
+from ckan.tests import factories
+
+from ckanext.api_tracking.tests import factories as tf
+
+
+@pytest.mark.usefixtures('clean_db')
+class TestAllTokenUsageCSV:
+    """ Test the all token usage CSV (one row by tracking row) """
+
+    def test_coalesced_rows(self, app):
+        sysadmin = factories.SysadminWithToken()
+        dataset = factories.Dataset()
+        tf.TrackingUsageAPIDataset(
+            object_id=dataset['id'],
+            timestamp=datetime(2026, 1, 1, 10, 0, 0),
+            last_timestamp=datetime(2026, 1, 1, 10, 4, 59),
+            count=500,
+        )
+        tf.TrackingUsageAPIDataset(object_id=dataset['id'], timestamp=datetime(2026, 1, 1, 9, 0, 0))
+
+        url = url_for('tracking_csv.all_token_usage_csv')
+        response = app.get(url, headers={"Authorization": sysadmin['token']})
+        assert response.status_code == 200
+
+        rows = list(csv.DictReader(StringIO(response.body)))
+        assert 'count' in rows[0]
+        assert 'last_timestamp' in rows[0]
+        assert [(row['timestamp'], row['last_timestamp'], row['count']) for row in rows] == [
+            ('2026-01-01 10:00:00', '2026-01-01 10:04:59', '500'),
+            ('2026-01-01 09:00:00', '', '1'),
+        ]
+        # The exported rows add up to the number of requests
+        assert sum(int(row['count']) for row in rows) == 501
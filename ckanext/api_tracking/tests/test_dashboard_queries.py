@@ -0,0 +1,44 @@
+import pytest
+from sqlalchemy import DateTime, Integer, String
+
+from ckanext.api_tracking.dashboard import QueryRegistry
+
+
+class TestQueryRegistry:
+    """ Test the dashboard SQL files are loaded and compiled once """
+
+    def test_all_files_loaded(self):
+        registry = QueryRegistry()
+        names = registry.names()
+        assert 'viewed-datasets.sql' in names
+        assert 'downloaded-resources.sql' in names
+        # Same compiled statement for each call
+        assert registry.get('viewed-datasets.sql') is registry.get('viewed-datasets.sql')
+
+    def test_typed_binds(self):
+        registry = QueryRegistry()
+        binds = registry.get('viewed-datasets-unique.sql').compile().binds
+        assert isinstance(binds['limit'].type, Integer)
+        assert isinstance(binds['measure_from'].type, DateTime)
+
+    def test_scope_binds(self):
+        """ Dataset and organization filters are applied in SQL, before the LIMIT """
+        registry = QueryRegistry()
+        for name in ('viewed-datasets-unique.sql', 'downloaded-resources.sql'):
+            binds = registry.get(name).compile().binds
+            assert isinstance(binds['package_id'].type, String)
+            assert isinstance(binds['owner_org'].type, String)
+
+    def test_view_binds(self):
+        """ Materialized views are read by period """
+        binds = QueryRegistry().get('downloaded-resources-mv.sql').compile().binds
+        assert isinstance(binds['period_days'].type, Integer)
+        assert 'measure_from' not in binds
+
+    def test_named_for_stats(self):
+        statement = QueryRegistry().get('downloaded-resources.sql')
+        assert statement.get_execution_options()['api_tracking_query'] == 'downloaded-resources.sql'
+
+    def test_unknown_query(self):
+        with pytest.raises(ValueError):
+            QueryRegistry().get('missing.sql')
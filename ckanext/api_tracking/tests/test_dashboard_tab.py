@@ -33,3 +33,31 @@ class TestDashboardTab:
         response = app.get(url, headers=auth)
         assert response.status_code == 200
         assert 'Most Viewed Datasets' in response.body
+
+    def test_dataset_usage(self, app, setup_data):
+        dataset = factories.Dataset(owner_org=setup_data.organization['id'])
+        url = url_for('tracking_dashboard.dataset_usage', package_id=dataset['name'])
+        auth = {"Authorization": setup_data.sysadmin['token']}
+        response = app.get(url, headers=auth)
+        assert response.status_code == 200
+        assert dataset['title'] in response.body
+
+        auth = {"Authorization": setup_data.user_member_admin['token']}
+        app.get(url, headers=auth, status=403)
+
+        missing = url_for('tracking_dashboard.dataset_usage', package_id='missing-dataset')
+        app.get(missing, headers={"Authorization": setup_data.sysadmin['token']}, status=404)
+
+    def test_organization_usage(self, app, setup_data):
+        organization = setup_data.organization
+        url = url_for('tracking_dashboard.organization_usage', org_id=organization['name'])
+        auth = {"Authorization": setup_data.sysadmin['token']}
+        response = app.get(url, headers=auth)
+        assert response.status_code == 200
+        assert organization['title'] in response.body
+
+        auth = {"Authorization": setup_data.user_member_admin['token']}
+        app.get(url, headers=auth, status=403)
+
+        missing = url_for('tracking_dashboard.organization_usage', org_id='missing-organization')
+        app.get(missing, headers={"Authorization": setup_data.sysadmin['token']}, status=404)
@@ -26,6 +26,10 @@ def setup_data():
         'most_create',
         'latest_api_token_usage',
         'api_token_usage_aggregated',
+        'latency',
+        'query_stats',
+        'metrics',
+        'health',
     ]
     return obj
 
@@ -0,0 +1,77 @@
+from datetime import datetime, timedelta
+from unittest import mock
+
+from ckanext.api_tracking.downloads import DownloadSessions, is_partial_download
+from ckanext.api_tracking.persistence import flush_expired
+
+
+def _chunk(**kwargs):
+    event = {
+        'user_id': 'user-1',
+        'token_name': 'token-1',
+        'tracking_type': 'ui',
+        'tracking_sub_type': 'download',
+        'object_type': 'resource',
+        'object_id': 'resource-1',
+        'extras': {'method': 'GET'},
+        'status_code': 206,
+        'response_bytes': 1000,
+        'range_request': True,
+    }
+    event.update(kwargs)
+    return event
+
+
+class TestDownloadSessions:
+    """ Test partial requests are merged into a single download """
+
+    def test_is_partial_download(self):
+        assert is_partial_download(_chunk())
+        assert not is_partial_download(_chunk(range_request=False))
+        assert not is_partial_download(_chunk(tracking_sub_type='show'))
+
+    def test_chunks_are_merged(self):
+        sessions = DownloadSessions(window=60)
+        start = datetime(2026, 1, 1, 10, 0, 0)
+        for n in range(5):
+            assert sessions.add(_chunk(), now=start + timedelta(seconds=n * 30)) == []
+
+        downloads = sessions.flush()
+        assert len(downloads) == 1
+        download = downloads[0]
+        assert download['count'] == 1
+        assert download['response_bytes'] == 5000
+        assert download['extras'] == {'method': 'GET', 'range_requests': 5}
+        assert download['timestamp'] == start
+        assert download['last_timestamp'] == start + timedelta(seconds=120)
+
+    def test_downloads_by_token_and_resource(self):
+        sessions = DownloadSessions(window=60)
+        now = datetime(2026, 1, 1, 10, 0, 0)
+        sessions.add(_chunk(), now=now)
+        sessions.add(_chunk(object_id='resource-2'), now=now)
+        sessions.add(_chunk(token_name='token-2'), now=now)
+        assert len(sessions) == 3
+
+    def test_finished_after_inactivity(self):
+        sessions = DownloadSessions(window=60)
+        start = datetime(2026, 1, 1, 10, 0, 0)
+        sessions.add(_chunk(), now=start)
+        assert sessions.pop_finished(now=start + timedelta(seconds=30)) == []
+        finished = sessions.pop_finished(now=start + timedelta(seconds=61))
+        assert len(finished) == 1
+        # A new chunk later is a new download
+        sessions.add(_chunk(), now=start + timedelta(seconds=120))
+        assert len(sessions) == 1
+
+    def test_finished_downloads_are_saved_by_the_flush_thread(self):
+        """ A finished download is saved even if the worker gets no more requests """
+        sessions = DownloadSessions(window=60)
+        sessions.add(_chunk(), now=datetime.now() - timedelta(seconds=120))
+        with mock.patch('ckanext.api_tracking.persistence.get_download_sessions', return_value=sessions), \
+                mock.patch('ckanext.api_tracking.persistence.get_coalescer', return_value=None), \
+                mock.patch('ckanext.api_tracking.persistence.flush_shared_counters', return_value=[]), \
+                mock.patch('ckanext.api_tracking.persistence._save_tracking_usage', side_effect=lambda event: [event]):
+            saved = flush_expired()
+        assert [download['extras']['range_requests'] for download in saved] == [1]
+        assert len(sessions) == 0
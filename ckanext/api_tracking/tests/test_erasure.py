@@ -0,0 +1,200 @@
+from datetime import date, datetime, timedelta
+from unittest import mock
+
+import pytest
+from ckan import model
+from ckan.plugins import toolkit
+
+from ckanext.api_tracking.models import TrackingErasure, TrackingUsage, TrackingUsageDeleted, TrackingUsageLatency
+from ckanext.api_tracking.queries.archive import read_rows, restore_tracking_usage, write_rows
+from ckanext.api_tracking.queries.erasure import (
+    KnownErasures,
+    day_ranges,
+    erase_row,
+    pseudonym,
+    run_erasure,
+    start_erasure,
+)
+from ckanext.api_tracking.queries.latency import rebuild_latency_rollups
+from ckanext.api_tracking.tests import factories as tf
+
+
+class TestErasure:
+    """ Test the erasure helpers """
+
+    def test_pseudonym(self):
+        assert pseudonym('user-1') == pseudonym('user-1')
+        assert pseudonym('user-1') != pseudonym('user-2')
+        assert pseudonym('user-1').startswith('pseudonym-')
+        assert 'user-1' not in pseudonym('user-1')
+
+    def test_day_ranges(self):
+        days = ['2026-01-03', '2026-01-01', '2026-01-02', '2026-01-05', '2026-01-02']
+        assert day_ranges(days) == [
+            (date(2026, 1, 1), date(2026, 1, 4)),
+            (date(2026, 1, 5), date(2026, 1, 6)),
+        ]
+        assert day_ranges([]) == []
+
+    def test_erase_row(self):
+        login = {'user_id': 'user-1', 'object_type': 'user', 'object_id': 'user-1', 'token_name': None}
+        assert erase_row(login, 'user_id', 'user-1', 'erase') is None
+        assert erase_row(login, 'user_id', 'user-2', 'erase') == login
+        pseudonymised = erase_row(login, 'user_id', 'user-1', 'pseudonymize')
+        assert pseudonymised['user_id'] == pseudonym('user-1')
+        assert pseudonymised['object_id'] == pseudonym('user-1')
+        # The original row is not changed
+        assert login['user_id'] == 'user-1'
+
+    def test_invalid(self):
+        with pytest.raises(ValueError):
+            start_erasure('object_id', 'dataset-1')
+        with pytest.raises(ValueError):
+            start_erasure('user_id', 'user-1', mode='hide')
+        with pytest.raises(ValueError):
+            start_erasure('token_name', '')
+
+
+def _row(n, user_id='user-1', token_name='token-1', day=None, **kwargs):
+    timestamp = datetime.combine(day or date.today(), datetime.min.time()) + timedelta(minutes=n)
+    return tf.TrackingUsageF(
+        user_id=user_id, token_name=token_name, tracking_type='api', tracking_sub_type='show',
+        object_type='dataset', object_id=f'dataset-{n}', timestamp=timestamp, **kwargs
+    )
+
+
+def _values(field):
+    return sorted(getattr(row, field) for row in model.Session.query(TrackingUsage))
+
+
+@pytest.mark.usefixtures('clean_db')
+class TestRunErasure:
+    """ Test the rows are erased in batches, the erasure can continue and the rollups are rebuilt """
+
+    def test_erase(self):
+        yesterday = date.today() - timedelta(days=1)
+        for n in range(5):
+            _row(n, day=yesterday if n % 2 else None)
+        _row(10, user_id='user-2', token_name='token-2')
+
+        erasure = start_erasure('user_id', 'user-1')
+        batches = []
+        erasure = run_erasure(erasure.id, batch_size=2, sleep=0, progress=lambda erasure: batches.append(erasure.rows))
+
+        assert _values('user_id') == ['user-2']
+        assert batches == [2, 4, 5, 5]
+        assert erasure.status == 'done'
+        assert erasure.rows == 5
+        assert sorted(erasure.days) == sorted([yesterday.isoformat(), date.today().isoformat()])
+        # We do not keep the value once done
+        assert erasure.value is None
+        assert erasure.value_hash
+
+    def test_pseudonymize(self):
+        _row(1)
+        tf.TrackingUsageUILogin(user_id='user-1', object_id='user-1')
+        erasure = start_erasure('user_id', 'user-1', mode='pseudonymize')
+        run_erasure(erasure.id, batch_size=1, sleep=0)
+
+        assert _values('user_id') == [pseudonym('user-1')] * 2
+        login = model.Session.query(TrackingUsage).filter(TrackingUsage.object_type == 'user').one()
+        assert login.object_id == pseudonym('user-1')
+
+    def test_continue_after_a_failure(self):
+        for n in range(5):
+            _row(n)
+        erasure = start_erasure('token_name', 'token-1')
+
+        def stop(erasure):
+            raise RuntimeError('worker killed')
+
+        with pytest.raises(RuntimeError):
+            run_erasure(erasure.id, batch_size=2, sleep=0, progress=stop)
+        assert len(_values('token_name')) == 3
+
+        # Starting it again continues the same erasure
+        again = start_erasure('token_name', 'token-1')
+        assert again.id == erasure.id
+        assert again.rows == 2
+        run_erasure(again.id, batch_size=2, sleep=0)
+        assert _values('token_name') == []
+        assert TrackingErasure.get(erasure.id).rows == 5
+
+    def test_rollups_are_rebuilt(self):
+        for n in range(3):
+            _row(n, duration_ms=10)
+        _row(5, user_id='user-2', token_name='token-2', duration_ms=10)
+        rebuild_latency_rollups(date.today(), date.today() + timedelta(days=1))
+        tokens = model.Session.query(TrackingUsageLatency.key).filter(TrackingUsageLatency.dimension == 'token')
+        assert sorted({row.key for row in tokens}) == ['token-1', 'token-2']
+
+        erasure = start_erasure('token_name', 'token-1')
+        run_erasure(erasure.id, batch_size=10, sleep=0)
+        assert sorted({row.key for row in tokens}) == ['token-2']
+
+    @pytest.mark.parametrize('mode', ['erase', 'pseudonymize'])
+    def test_archived_days_token_rollups(self, mode):
+        """ The token rollups of the archived days can't be rebuilt, the erased token is not kept as their key """
+        archived = date(2025, 1, 1)
+        for key, bucket, count in [('token-1', 10, 5), ('token-2', 10, 3), (pseudonym('token-1'), 10, 1)]:
+            model.Session.add(TrackingUsageLatency(day=archived, dimension='token', key=key, bucket=bucket, count=count))
+        model.Session.add(TrackingUsageLatency(day=archived, dimension='action', key='package_show', bucket=10, count=8))
+        model.Session.commit()
+
+        run_erasure(start_erasure('token_name', 'token-1', mode=mode).id, sleep=0)
+        rows = model.Session.query(TrackingUsageLatency).filter(TrackingUsageLatency.dimension == 'token')
+        counts = {row.key: row.count for row in rows}
+        if mode == 'erase':
+            assert counts == {'token-2': 3, pseudonym('token-1'): 1}
+        else:
+            assert counts == {'token-2': 3, pseudonym('token-1'): 6}
+        # Other dimensions are not changed
+        assert model.Session.query(TrackingUsageLatency).filter(TrackingUsageLatency.dimension == 'action').count() == 1
+
+    def test_job_arguments(self):
+        """ The erased value is not saved in the job (RQ keeps the job arguments) """
+        with mock.patch.object(toolkit, 'enqueue_job') as enqueue_job:
+            erasure = toolkit.get_action('tracking_usage_erase')({'ignore_auth': True}, {'user_id': 'user-1'})
+        args = enqueue_job.call_args
+        assert args[0][1] == [erasure['id']]
+        assert 'user-1' not in repr(args)
+        assert TrackingErasure.get(erasure['id']).value == 'user-1'
+
+    def test_archives(self, tmp_path, ckan_config, monkeypatch):
+        monkeypatch.setitem(ckan_config, 'ckanext.api_tracking.archive_dir', str(tmp_path))
+        old = datetime(2025, 1, 1, 10, 0)
+        rows = [
+            {'id': f'archived-{n}', 'timestamp': old + timedelta(hours=n), 'user_id': user_id, 'token_name': None,
+             'tracking_type': 'api', 'tracking_sub_type': 'show', 'count': 1}
+            for n, user_id in enumerate(['user-1', 'user-2', 'user-1'])
+        ]
+        files = write_rows(tmp_path, rows)
+
+        erasure = start_erasure('user_id', 'user-1')
+        run_erasure(erasure.id, sleep=0)
+        assert [row['user_id'] for row in read_rows(files)] == ['user-2']
+        # Tombstones for the change feed
+        tombstones = model.Session.query(TrackingUsageDeleted.id).order_by(TrackingUsageDeleted.id)
+        assert [row.id for row in tombstones] == ['archived-0', 'archived-2']
+        # Not in the rollups of the table
+        assert TrackingErasure.get(erasure.id).days == []
+
+    def test_restore_applies_the_erasures(self, tmp_path):
+        old = datetime(2025, 1, 1, 10, 0)
+        rows = [
+            {'id': f'archived-{n}', 'timestamp': old + timedelta(hours=n), 'user_id': user_id, 'token_name': token_name,
+             'tracking_type': 'api', 'tracking_sub_type': 'show', 'count': 1}
+            for n, (user_id, token_name) in enumerate([('user-1', 'token-1'), ('user-2', 'token-2'), ('user-3', 'token-3')])
+        ]
+        # Archives copied somewhere else before the erasures
+        write_rows(tmp_path, rows)
+        run_erasure(start_erasure('user_id', 'user-1').id, sleep=0)
+        run_erasure(start_erasure('token_name', 'token-2', mode='pseudonymize').id, sleep=0)
+        assert KnownErasures().apply(dict(rows[2])) == rows[2]
+
+        restore_tracking_usage(tmp_path)
+        restored = model.Session.query(TrackingUsage).order_by(TrackingUsage.id).all()
+        assert [(row.user_id, row.token_name) for row in restored] == [
+            ('user-2', pseudonym('token-2')),
+            ('user-3', 'token-3'),
+        ]
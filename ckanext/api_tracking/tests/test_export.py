@@ -0,0 +1,100 @@
+import io
+from datetime import date, datetime, timedelta
+from types import SimpleNamespace
+
+import pytest
+
+from ckanext.api_tracking.guardrails import QueryTimeout
+from ckanext.api_tracking.queries import export
+from ckanext.api_tracking.queries.export import check_range, export_to_temporary_file, write_row_groups
+
+try:
+    import pyarrow.parquet as pq
+except ImportError:
+    pq = None
+
+needs_pyarrow = pytest.mark.skipif(pq is None, reason='pyarrow is not installed')
+
+
+def _rows(total):
+    return [
+        {
+            'id': f'id-{i}',
+            'timestamp': datetime(2026, 1, 1) + timedelta(minutes=i),
+            'last_timestamp': None,
+            'user_id': f'user-{i % 3}',
+            'tracking_type': 'api',
+            'tracking_sub_type': 'show',
+            'token_name': 'token' if i % 2 else None,
+            'object_type': 'dataset',
+            'object_id': f'dataset-{i % 5}',
+            'package_id': f'dataset-{i % 5}',
+            'owner_org': 'org-1',
+            'count': 1,
+            'duration_ms': 12.5,
+            'status_code': 200,
+            'response_bytes': 1024,
+            'extras': {'method': 'GET'},
+        }
+        for i in range(total)
+    ]
+
+
+def _read_stream(rows, fail_after=None):
+    def read_stream(statement, params=None, query_class='batch'):
+        for n, row in enumerate(rows):
+            if n == fail_after:
+                raise QueryTimeout(query_class, 1000)
+            yield SimpleNamespace(_mapping=row)
+    return read_stream
+
+
+class TestExportRange:
+    """ Test the download range is limited """
+
+    def test_check_range(self, monkeypatch):
+        monkeypatch.setattr(export, 'get_max_days', lambda: 31)
+        check_range(date(2026, 1, 1), date(2026, 2, 1))
+        with pytest.raises(ValueError):
+            check_range(date(2026, 1, 1), date(2026, 2, 2))
+        with pytest.raises(ValueError):
+            check_range(date(2026, 1, 1), date(2026, 1, 1))
+
+
+@needs_pyarrow
+class TestParquetExport:
+    """ Test the Parquet export is written in row groups """
+
+    def test_row_groups(self):
+        sink = io.BytesIO()
+        progress = list(write_row_groups(_rows(25), sink, row_group_size=10))
+        assert progress == [10, 20, 25]
+
+        parquet = pq.ParquetFile(io.BytesIO(sink.getvalue()))
+        assert parquet.metadata.num_rows == 25
+        assert parquet.metadata.num_row_groups == 3
+        table = parquet.read()
+        assert str(table.schema.field('object_id').type).startswith('dictionary')
+        row = table.slice(1, 1).to_pylist()[0]
+        assert row['timestamp'] == datetime(2026, 1, 1, 0, 1)
+        assert row['token_name'] == 'token'
+        assert row['extras'] == '{"method": "GET"}'
+
+    def test_empty(self):
+        sink = io.BytesIO()
+        list(write_row_groups([], sink))
+        assert pq.read_table(io.BytesIO(sink.getvalue())).num_rows == 0
+
+    def test_temporary_file(self, monkeypatch):
+        """ The file is complete before it is returned """
+        monkeypatch.setattr(export, 'read_stream', _read_stream(_rows(25)))
+        parquet, total = export_to_temporary_file(date(2026, 1, 1), date(2026, 1, 2))
+        with parquet:
+            assert total == 25
+            assert pq.read_table(parquet).num_rows == 25
+
+    def test_temporary_file_error(self, monkeypatch):
+        """ A timeout while reading is raised (nothing is sent) """
+        monkeypatch.setattr(export, 'read_stream', _read_stream(_rows(25), fail_after=20))
+        with pytest.raises(QueryTimeout):
+            export_to_temporary_file(date(2026, 1, 1), date(2026, 1, 2))
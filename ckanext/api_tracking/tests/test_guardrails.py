@@ -0,0 +1,81 @@
+import pytest
+from ckan import model
+from ckan.lib.helpers import url_for
+from ckan.plugins import toolkit
+from ckan.tests import factories
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import OperationalError
+
+from ckanext.api_tracking import replica
+from ckanext.api_tracking.guardrails import QueryTimeout, cap_limit, query_timeouts, set_statement_timeout
+from ckanext.api_tracking.replica import ReplicaRouter
+
+
+class _Canceled(Exception):
+    """ psycopg2 error for a statement cancelled by the statement timeout """
+    pgcode = '57014'
+
+
+class TestGuardrails:
+
+    def test_cap_limit(self):
+        assert cap_limit(10) == 10
+        assert cap_limit('20') == 20
+        assert cap_limit(100000) == 5000
+        assert cap_limit(3650, 'dashboard') == 1000
+        assert cap_limit(None, 'report') == 5000
+        assert cap_limit(100000, 'batch') == 100000
+
+    @pytest.mark.ckan_config('ckanext.api_tracking.report_max_rows', '100')
+    def test_cap_limit_config(self):
+        assert cap_limit(3650) == 100
+
+    @pytest.mark.parametrize('limit', ['abc', '10; DROP TABLE tracking_usage', '1.5'])
+    def test_cap_limit_invalid(self, limit):
+        """ Request parameters that are not integers are a validation error (not a server error) """
+        with pytest.raises(toolkit.ValidationError) as error:
+            cap_limit(limit)
+        assert error.value.error_dict == {'limit': ['Invalid integer']}
+
+    def test_unknown_class(self):
+        with pytest.raises(ValueError):
+            cap_limit(10, 'unknown')
+
+    def test_timeout_not_retried(self, monkeypatch):
+        """ A cancelled query raises QueryTimeout and does not run again on the primary """
+        primary = create_engine('sqlite://')
+        router = ReplicaRouter('sqlite://', engine=create_engine('sqlite://'))
+        router.get_lag = lambda: 0
+        monkeypatch.setattr(model.meta, 'engine', primary)
+        monkeypatch.setattr(replica, 'get_router', lambda: router)
+        calls = []
+
+        def run(conn):
+            calls.append(conn.engine)
+            raise OperationalError('SELECT', {}, _Canceled('canceling statement due to statement timeout'))
+
+        timeouts = query_timeouts['report'].value
+        with pytest.raises(QueryTimeout):
+            replica._read(run, 'report')
+        assert calls == [router.engine]
+        assert query_timeouts['report'].value == timeouts + 1
+        # The replica is still used
+        assert router.available()
+
+    def test_set_statement_timeout(self):
+        """ PostgreSQL only, other databases ignore it """
+        engine = create_engine('sqlite://')
+        with engine.connect() as conn, conn.begin():
+            assert set_statement_timeout(conn, 'dashboard') == 15000
+            assert conn.execute(text('SELECT 1')).scalar() == 1
+
+
+@pytest.mark.usefixtures('clean_db')
+class TestInvalidLimit:
+    """ Test an invalid limit is a validation error for the API """
+
+    def test_action(self, app):
+        sysadmin = factories.SysadminWithToken()
+        url = url_for('api.action', ver=3, logic_function='all_token_usage', limit='abc')
+        response = app.get(url, headers={"Authorization": sysadmin['token']}, status=409)
+        assert response.json['error']['limit'] == ['Invalid integer']
@@ -0,0 +1,40 @@
+import pytest
+
+from ckanext.api_tracking.hll import HyperLogLog
+
+
+class TestHyperLogLog:
+    """ Test the distinct count sketches """
+
+    @pytest.mark.parametrize('total', [0, 1, 10, 500, 20000])
+    def test_count(self, total):
+        sketch = HyperLogLog()
+        for n in range(total):
+            # Repeated values are counted once
+            sketch.add(f'user-{n}')
+            sketch.add(f'user-{n}')
+        # 3 standard errors
+        assert abs(sketch.count() - total) <= max(1, total * sketch.error * 3)
+
+    def test_merge(self):
+        day1 = HyperLogLog()
+        day2 = HyperLogLog()
+        for n in range(1000):
+            day1.add(f'user-{n}')
+        for n in range(500, 1500):
+            day2.add(f'user-{n}')
+        merged = HyperLogLog().merge(day1).merge(day2)
+        assert abs(merged.count() - 1500) <= 1500 * merged.error * 3
+
+    def test_serialization(self):
+        sketch = HyperLogLog()
+        for n in range(100):
+            sketch.add(n)
+        data = sketch.to_bytes()
+        # Compact for small sets
+        assert len(data) < 1024
+        assert HyperLogLog.from_bytes(data).count() == sketch.count()
+
+    def test_merge_different_precision(self):
+        with pytest.raises(ValueError):
+            HyperLogLog(precision=10).merge(HyperLogLog(precision=12))
@@ -0,0 +1,82 @@
+from datetime import datetime, timedelta
+
+import pytest
+from ckan import model
+from ckan.tests import factories
+from sqlalchemy import text
+
+from ckanext.api_tracking.models import TrackingIngestState, TrackingUsage
+from ckanext.api_tracking.queries.ingest import TRACKING_TYPE, ingest_tracking_raw, ingest_windows
+
+
+class TestIngestWindows:
+    """ Test the tracking_raw ingestion is split in windows """
+
+    def test_windows(self):
+        since = datetime(2026, 1, 1, 0, 0)
+        until = since + timedelta(hours=60)
+        windows = list(ingest_windows(since, until, hours=24))
+        assert windows == [
+            (since, since + timedelta(hours=24)),
+            (since + timedelta(hours=24), since + timedelta(hours=48)),
+            (since + timedelta(hours=48), until),
+        ]
+
+    def test_nothing_new(self):
+        now = datetime(2026, 1, 1, 0, 0)
+        assert list(ingest_windows(now, now)) == []
+        assert list(ingest_windows(now, now - timedelta(hours=1))) == []
+
+
+def _visit(url, user_key, access_timestamp):
+    model.Session.execute(
+        text(
+            'INSERT INTO tracking_raw (user_key, url, tracking_type, access_timestamp) '
+            "VALUES (:user_key, :url, 'page', :access_timestamp)"
+        ),
+        {'user_key': user_key, 'url': url, 'access_timestamp': access_timestamp},
+    )
+    model.Session.commit()
+
+
+def _ingested():
+    return model.Session.query(TrackingUsage).filter(TrackingUsage.tracking_type == TRACKING_TYPE).all()
+
+
+@pytest.mark.usefixtures('clean_db')
+class TestIngestTrackingRaw:
+    """ Test the tracking_raw rows are ingested once """
+
+    def test_ingest_and_continue(self):
+        dataset = factories.Dataset()
+        start = datetime.now() - timedelta(days=2)
+        for minutes in (0, 5, 10):
+            _visit(f'/dataset/{dataset["name"]}', 'visitor-1', start + timedelta(minutes=minutes))
+
+        total, watermark = ingest_tracking_raw(lag=0)
+        assert total == 1
+        rows = _ingested()
+        assert rows[0].count == 3
+        assert rows[0].object_id == dataset['id']
+
+        # The next run continues from the watermark
+        _visit(f'/dataset/{dataset["name"]}', 'visitor-2', datetime.now() - timedelta(minutes=1))
+        total, new_watermark = ingest_tracking_raw(lag=0)
+        assert total == 1
+        assert new_watermark > watermark
+        assert len(_ingested()) == 2
+
+    def test_ingest_again_skips_saved_rows(self):
+        dataset = factories.Dataset()
+        start = datetime.now() - timedelta(days=2)
+        for minutes in (0, 5):
+            _visit(f'/dataset/{dataset["name"]}', 'visitor-1', start + timedelta(minutes=minutes))
+        since = start - timedelta(hours=1)
+        assert ingest_tracking_raw(lag=0, since=since)[0] == 1
+        ids = [row.id for row in _ingested()]
+
+        # Ingest the same window again from scratch
+        model.Session.query(TrackingIngestState).delete()
+        model.Session.commit()
+        assert ingest_tracking_raw(lag=0, since=since)[0] == 0
+        assert [row.id for row in _ingested()] == ids
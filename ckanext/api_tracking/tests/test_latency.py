@@ -0,0 +1,80 @@
+import pytest
+
+from ckanext.api_tracking.coalesce import EventCoalescer
+from ckanext.api_tracking.latency import EXTRAS_KEY, LatencyHistogram, bucket_for, bucket_value, event_buckets
+
+
+class TestLatencyHistogram:
+    """ Test the mergeable latency histogram """
+
+    @pytest.mark.parametrize('duration_ms', [0.5, 1, 12.3, 250, 4000])
+    def test_bucket_error(self, duration_ms):
+        value = bucket_value(bucket_for(duration_ms))
+        assert abs(value - duration_ms) / duration_ms < 0.05
+
+    def test_empty(self):
+        assert LatencyHistogram().percentile(50) is None
+
+    def test_percentiles(self):
+        histogram = LatencyHistogram()
+        for duration_ms in range(1, 101):
+            histogram.add(duration_ms)
+        assert histogram.total == 100
+        assert histogram.percentile(50) == pytest.approx(50, rel=0.05)
+        assert histogram.percentile(95) == pytest.approx(95, rel=0.05)
+        assert histogram.percentile(99) == pytest.approx(99, rel=0.05)
+
+    def test_merge(self):
+        fast = LatencyHistogram()
+        slow = LatencyHistogram()
+        fast.add(10, count=90)
+        slow.add(1000, count=10)
+        merged = LatencyHistogram().merge(fast).merge(slow)
+        assert merged.total == 100
+        assert merged.percentile(50) == pytest.approx(10, rel=0.05)
+        assert merged.percentile(95) == pytest.approx(1000, rel=0.05)
+
+
+class TestMergedEventsLatency:
+    """ Test merged events keep the distribution of their durations """
+
+    def _event(self, duration_ms):
+        return {'tracking_type': 'api', 'tracking_sub_type': 'show', 'duration_ms': duration_ms, 'extras': {'method': 'GET'}}
+
+    def test_single_event(self):
+        assert event_buckets(self._event(10)) == {bucket_for(10): 1}
+        assert event_buckets({'tracking_type': 'api'}) == {}
+
+    def test_coalesced_events_keep_the_tail(self):
+        coalescer = EventCoalescer(window=60)
+        coalescer.add(self._event(2000))
+        for _ in range(99):
+            coalescer.add(self._event(10))
+        event = coalescer.flush()[0]
+        assert event['count'] == 100
+        assert event['duration_ms'] == 2990
+        assert event['extras']['method'] == 'GET'
+        assert event['extras'][EXTRAS_KEY] == {str(bucket_for(10)): 99, str(bucket_for(2000)): 1}
+        histogram = LatencyHistogram(event_buckets(event))
+        assert histogram.percentile(50) == pytest.approx(10, rel=0.05)
+        assert histogram.percentile(100) == pytest.approx(2000, rel=0.05)
+
+    def test_merge_coalesced_events(self):
+        """ Events already merged (the collector merges the coalesced events of the workers) """
+        first, second = EventCoalescer(window=60), EventCoalescer(window=60)
+        for duration_ms in (10, 10, 500):
+            first.add(self._event(duration_ms))
+        second.add(self._event(10))
+        second.add(self._event(3000))
+        merged = EventCoalescer(window=60)
+        merged.add(first.flush()[0])
+        merged.add(second.flush()[0])
+        event = merged.flush()[0]
+        assert event['count'] == 5
+        assert event_buckets(event) == {bucket_for(10): 3, bucket_for(500): 1, bucket_for(3000): 1}
+
+    def test_events_without_duration(self):
+        coalescer = EventCoalescer(window=60)
+        coalescer.add({'tracking_type': 'api', 'tracking_sub_type': 'show'})
+        coalescer.add({'tracking_type': 'api', 'tracking_sub_type': 'show'})
+        assert EXTRAS_KEY not in (coalescer.flush()[0].get('extras') or {})
@@ -0,0 +1,37 @@
+from ckanext.api_tracking.metrics import Counter, Histogram, Registry
+
+
+class TestMetrics:
+    """ Test the tracking pipeline metrics """
+
+    def test_counter(self):
+        counter = Counter('events_total', 'Events')
+        counter.inc()
+        counter.inc(5)
+        assert counter.value == 6
+
+    def test_histogram(self):
+        histogram = Histogram('duration_seconds', 'Duration', buckets=(0.1, 1))
+        histogram.observe(0.05)
+        histogram.observe(0.5)
+        histogram.observe(10)
+        samples = dict(histogram.samples())
+        assert samples['duration_seconds_bucket{le="0.1"}'] == 1
+        assert samples['duration_seconds_bucket{le="1"}'] == 2
+        assert samples['duration_seconds_bucket{le="+Inf"}'] == 3
+        assert samples['duration_seconds_count'] == 3
+        assert samples['duration_seconds_sum'] == 10.55
+
+    def test_histogram_timer(self):
+        histogram = Histogram('duration_seconds', 'Duration')
+        with histogram.time():
+            pass
+        assert histogram.count == 1
+
+    def test_render_prometheus(self):
+        registry = Registry()
+        registry.counter('events_total', 'Events').inc(2)
+        registry.gauge('queue_depth', 'Queue depth', lambda: 7)
+        text = registry.render_prometheus()
+        assert '# HELP events_total Events\n# TYPE events_total counter\nevents_total 2\n' in text
+        assert '# TYPE queue_depth gauge\nqueue_depth 7\n' in text
@@ -1,4 +1,12 @@
+import re
+import time
+from types import SimpleNamespace
+
 from ckan.tests import factories
+from ckanext.api_tracking import middleware as middleware_module
+from ckanext.api_tracking import persistence
+from ckanext.api_tracking.middleware import TrackedResponse, TrackingUsageMiddleware
+from ckanext.api_tracking.profiling import TrackingProfiler
 
 
 class TestTrackingUsageMiddleware:
@@ -34,3 +42,102 @@ class TestTrackingUsageMiddleware:
             assert response.status_code == 200
             assert dataset1['name'] in response
             assert dataset2['name'] in response
+
+
+class _FakeMiddleware:
+    def __init__(self, server_timing=False):
+        self.tracked = []
+        self.server_timing = server_timing
+
+    def server_timing_enabled(self, response):
+        return self.server_timing
+
+    def track(self, response):
+        response.timings['persist'] = 1
+        self.tracked.append(dict(response.data))
+
+
+class TestTrackedResponse:
+    """ Test the WSGI response wrapper """
+
+    def _run(self, headers, body, server_timing=False):
+        middleware = _FakeMiddleware(server_timing=server_timing)
+        response = TrackedResponse(middleware, {}, started=0)
+        sent = {}
+
+        def start_response(status, headers, exc_info=None):
+            sent.update(headers)
+
+        response.wrap_start_response(start_response)('302 Found', headers)
+        app_iter = response.wrap_app_iter(body)
+        chunks = list(app_iter)
+        if hasattr(app_iter, 'close'):
+            app_iter.close()
+        self.sent_headers = sent
+        return middleware.tracked, b''.join(chunks)
+
+    def test_buffered_response(self):
+        tracked, body = self._run([('Content-Length', '5')], [b'hello'])
+        assert len(tracked) == 1
+        assert tracked[0]['status_code'] == 302
+        assert tracked[0]['response_bytes'] == 5
+        assert body == b'hello'
+
+    def test_streamed_response(self):
+        tracked, body = self._run([], (chunk for chunk in [b'abc', b'de']))
+        # Tracked only once, after the body is sent
+        assert len(tracked) == 1
+        assert tracked[0]['response_bytes'] == 5
+        assert tracked[0]['duration_ms'] > 0
+        assert body == b'abcde'
+
+    def test_no_server_timing_by_default(self):
+        self._run([('Content-Length', '5')], [b'hello'])
+        assert 'Server-Timing' not in self.sent_headers
+
+    def test_server_timing(self):
+        self._run([('Content-Length', '5')], [b'hello'], server_timing=True)
+        metrics = [metric.split(';')[0] for metric in self.sent_headers['Server-Timing'].split(', ')]
+        assert metrics == ['app', 'persist']
+
+
+class TestServerTimings:
+    """ Test the plugin handlers and the persistence are timed apart """
+
+    def test_track_and_persist(self, monkeypatch):
+        def save(data_dict):
+            time.sleep(0.03)
+            return []
+
+        class SlowPlugin:
+            def track_usage(self, data, api_token):
+                time.sleep(0.02)
+                persistence.save_tracking_usage({})
+
+        monkeypatch.setattr(persistence, '_save_or_spool', save)
+        monkeypatch.setattr(middleware_module, 'get_profiler', lambda: None)
+        monkeypatch.setattr(middleware_module.plugins, 'PluginImplementations', lambda interface: [SlowPlugin()])
+        middleware = TrackingUsageMiddleware.__new__(TrackingUsageMiddleware)
+        middleware.skip_redirects = middleware.skip_errors = False
+        response = SimpleNamespace(data={'status_code': 200}, timings={}, profile=None, get_api_token=lambda: object())
+
+        middleware.track(response)
+        # The save is not counted twice
+        assert 20 <= response.timings['track'] < 50
+        assert response.timings['persist'] >= 30
+
+
+class TestMiddlewareProfiling:
+    """ Test only the tracked requests are sampled by the profiler """
+
+    def test_untracked_request_not_profiled(self, tmp_path, monkeypatch):
+        profiler = TrackingProfiler(sample_rate=1, directory=str(tmp_path), dump_interval=3600)
+        monkeypatch.setattr(middleware_module, 'get_profiler', lambda: profiler)
+        middleware = TrackingUsageMiddleware.__new__(TrackingUsageMiddleware)
+        middleware.compiled_paths = {'api': [re.compile(r'api/action/.*')]}
+        middleware.app = lambda environ, start_response: [b'ok']
+
+        environ = {'PATH_INFO': '/static/style.css', 'REQUEST_METHOD': 'GET'}
+        assert middleware.process_call(environ, None) == [b'ok']
+        assert profiler._tracked == 0
+        assert profiler.dump() is None
@@ -0,0 +1,72 @@
+from unittest import mock
+
+from ckanext.api_tracking.owners import OwnerResolver
+
+
+class _Lookup:
+    """ Fake database lookup counting the calls """
+    def __init__(self, owners):
+        self.owners = owners
+        self.calls = 0
+
+    def __call__(self, object_type, object_id):
+        self.calls += 1
+        return self.owners.get(object_id, (None, None))
+
+
+class TestOwnerResolver:
+    """ Test the dataset and organization of the tracked objects are resolved and cached """
+
+    def test_cached(self):
+        lookup = _Lookup({'resource-1': ('dataset-1', 'org-1')})
+        resolver = OwnerResolver(ttl=60, lookup=lookup)
+        for _ in range(5):
+            assert resolver.resolve('resource', 'resource-1', now=100) == ('dataset-1', 'org-1')
+        assert lookup.calls == 1
+        # Unknown objects are cached too
+        assert resolver.resolve('resource', 'missing', now=100) == (None, None)
+        assert resolver.resolve('resource', 'missing', now=100) == (None, None)
+        assert lookup.calls == 2
+
+    def test_expired(self):
+        lookup = _Lookup({'dataset-1': ('dataset-1', 'org-1')})
+        resolver = OwnerResolver(ttl=60, lookup=lookup)
+        resolver.resolve('dataset', 'dataset-1', now=100)
+        resolver.resolve('dataset', 'dataset-1', now=159)
+        assert lookup.calls == 1
+        resolver.resolve('dataset', 'dataset-1', now=161)
+        assert lookup.calls == 2
+
+    def test_max_size(self):
+        resolver = OwnerResolver(max_size=2, lookup=_Lookup({}))
+        for n in range(5):
+            resolver.resolve('dataset', f'dataset-{n}', now=100)
+        assert len(resolver) == 2
+
+    def test_not_owned(self):
+        lookup = _Lookup({})
+        resolver = OwnerResolver(lookup=lookup)
+        assert resolver.resolve('user', 'user-1') == (None, None)
+        assert resolver.resolve('dataset', None) == (None, None)
+        assert lookup.calls == 0
+
+    def test_add_owners(self):
+        resolver = OwnerResolver(lookup=_Lookup({'resource-1': ('dataset-1', 'org-1')}))
+        event = resolver.add_owners({'object_type': 'resource', 'object_id': 'resource-1'})
+        assert event['package_id'] == 'dataset-1'
+        assert event['owner_org'] == 'org-1'
+        # Already defined (e.g. ingested rows)
+        event = resolver.add_owners({'object_type': 'resource', 'object_id': 'resource-1', 'package_id': 'other'})
+        assert event['package_id'] == 'other'
+        assert 'owner_org' not in event
+
+    def test_lookup_error(self):
+        """ The event is saved without owners, the request session is not rolled back """
+        def failing_lookup(object_type, object_id):
+            raise RuntimeError('database is down')
+
+        resolver = OwnerResolver(lookup=failing_lookup)
+        with mock.patch('ckanext.api_tracking.owners.model') as model:
+            data_dict = resolver.add_owners({'object_type': 'dataset', 'object_id': 'dataset-1'})
+        assert data_dict == {'object_type': 'dataset', 'object_id': 'dataset-1'}
+        assert not model.Session.rollback.called
@@ -0,0 +1,83 @@
+from ckanext.api_tracking.profiling import TrackingProfiler, merge_profiles, summarize
+
+
+def _tracking_work():
+    return sum(n * n for n in range(1000))
+
+
+def _ckan_work():
+    return sum(n for n in range(1000))
+
+
+class TestTrackingProfiler:
+    """ Test the sampling profiler """
+
+    def test_sample_rate(self, tmp_path):
+        profiler = TrackingProfiler(sample_rate=3, directory=str(tmp_path))
+        sampled = []
+        for _ in range(9):
+            profile = profiler.sample(profiler.start())
+            sampled.append(profile is not None)
+            if profile:
+                profiler.stop(profile)
+        assert sampled == [False, False, True] * 3
+
+    def test_untracked_calls_are_not_counted(self, tmp_path):
+        """ A call we don't track does not use the sample and is not in the stats """
+        profiler = TrackingProfiler(sample_rate=2, directory=str(tmp_path), dump_interval=3600)
+        assert profiler.sample(profiler.start()) is None
+        profile = profiler.start()
+        assert profile is not None
+        _ckan_work()
+        profiler.discard(profile)
+        # The next tracked call is still the sampled one
+        profile = profiler.sample(profiler.start())
+        assert profile is not None
+        _tracking_work()
+        profiler.stop(profile)
+
+        assert profiler.dump()
+        stats, _files = merge_profiles(str(tmp_path))
+        report = summarize(stats, limit=50)
+        assert '_tracking_work' in report
+        assert '_ckan_work' not in report
+
+    def test_dump_and_merge(self, tmp_path):
+        directory = str(tmp_path)
+        profiler = TrackingProfiler(sample_rate=1, directory=directory, dump_interval=3600)
+        # Nothing to dump yet
+        assert profiler.dump() is None
+        for _ in range(2):
+            for _ in range(3):
+                profile = profiler.sample(profiler.start())
+                _tracking_work()
+                profiler.stop(profile)
+            assert profiler.dump()
+
+        stats, files = merge_profiles(directory)
+        assert len(files) == 2
+        report = summarize(stats, limit=10)
+        assert '_tracking_work' in report
+
+    def test_pause_while_ckan_runs(self, tmp_path):
+        """ The middleware pauses the profile while CKAN handles the request """
+        profiler = TrackingProfiler(sample_rate=1, directory=str(tmp_path), dump_interval=3600)
+        profile = profiler.sample(profiler.start())
+        _tracking_work()
+        profiler.pause(profile)
+        _ckan_work()
+        assert profiler.resume(profile)
+        _tracking_work()
+        profiler.stop(profile)
+        assert not profiler.resume(None)
+
+        assert profiler.dump()
+        stats, _files = merge_profiles(str(tmp_path))
+        report = summarize(stats, limit=50)
+        assert '_tracking_work' in report
+        assert '_ckan_work' not in report
+
+    def test_merge_empty_directory(self, tmp_path):
+        stats, files = merge_profiles(str(tmp_path))
+        assert stats is None
+        assert files == []
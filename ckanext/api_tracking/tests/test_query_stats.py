@@ -0,0 +1,32 @@
+import logging
+
+from sqlalchemy import create_engine, text
+
+from ckanext.api_tracking import query_stats
+
+
+class TestQueryStats:
+    """ Test the instrumentation of our SQL queries """
+
+    def setup_method(self):
+        query_stats.install()
+        query_stats.registry.reset()
+        self.engine = create_engine('sqlite://')
+
+    def test_only_named_queries(self):
+        with self.engine.connect() as conn:
+            for _ in range(3):
+                conn.execute(text('SELECT 1 UNION ALL SELECT 2').execution_options(api_tracking_query='test-query.sql'))
+            conn.execute(text('SELECT 1'))
+        summary = query_stats.registry.summary()
+        assert [row['name'] for row in summary] == ['test-query.sql']
+        assert summary[0]['calls'] == 3
+        assert summary[0]['total_ms'] > 0
+
+    def test_slow_query_log(self, monkeypatch, caplog):
+        monkeypatch.setattr(query_stats, 'get_slow_query_threshold', lambda: 0.000001)
+        with caplog.at_level(logging.WARNING, logger='ckanext.api_tracking.query_stats'):
+            with self.engine.connect() as conn:
+                conn.execute(text('SELECT :value').execution_options(api_tracking_query='slow'), {'value': 42})
+        assert 'Slow query slow' in caplog.text
+        assert '42' in caplog.text
@@ -0,0 +1,62 @@
+from ckan import model
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import OperationalError
+
+from ckanext.api_tracking import replica
+from ckanext.api_tracking.replica import ReplicaRouter
+
+
+class _Router(ReplicaRouter):
+    """ Router with a fake replication lag """
+    def __init__(self, lag, **kwargs):
+        super().__init__('sqlite://', engine=create_engine('sqlite://'), **kwargs)
+        self.lag = lag
+        self.checks = 0
+
+    def get_lag(self):
+        self.checks += 1
+        if isinstance(self.lag, Exception):
+            raise self.lag
+        return self.lag
+
+
+class TestReplicaRouter:
+    """ Test reads are routed to the replica only if it is available and up to date """
+
+    def test_available(self):
+        router = _Router(lag=2, max_staleness=60, check_interval=30)
+        assert router.available(now=100)
+        assert router.available(now=110)
+        # Checked once per interval
+        assert router.checks == 1
+
+    def test_lagging(self):
+        router = _Router(lag=120, max_staleness=60)
+        assert not router.available(now=100)
+
+    def test_down(self):
+        router = _Router(lag=OperationalError('SELECT', {}, Exception('connection refused')))
+        assert not router.available(now=100)
+
+    def test_mark_down(self):
+        router = _Router(lag=0, check_interval=30)
+        assert router.available(now=100)
+        router.mark_down(Exception('replica query failed'), now=105)
+        assert not router.available(now=120)
+        # Checked again after the interval
+        assert router.available(now=136)
+
+    def test_read_fallback(self, monkeypatch):
+        """ The replica does not have the table, we get the results from the primary """
+        primary = create_engine('sqlite://')
+        with primary.begin() as conn:
+            conn.execute(text('CREATE TABLE usage (total INTEGER)'))
+            conn.execute(text('INSERT INTO usage VALUES (42)'))
+        router = _Router(lag=0)
+        monkeypatch.setattr(model.meta, 'engine', primary)
+        monkeypatch.setattr(replica, 'get_router', lambda: router)
+
+        rows = replica.read_execute(text('SELECT total FROM usage'))
+        assert rows[0]['total'] == 42
+        assert router.checks == 1
+        assert not router.available()
@@ -0,0 +1,170 @@
+import multiprocessing
+from unittest import mock
+
+import pytest
+
+from ckanext.api_tracking import persistence
+from ckanext.api_tracking.shared_counters import SharedCounterTable
+
+
+def _event(**kwargs):
+    event = {
+        'user_id': 'user-1',
+        'token_name': 'token-1',
+        'tracking_type': 'api',
+        'tracking_sub_type': 'show',
+        'object_type': 'dataset',
+        'object_id': 'dataset-1',
+        'extras': {'method': 'GET'},
+    }
+    event.update(kwargs)
+    return event
+
+
+def _increment_many(path, times):
+    table = SharedCounterTable(path, slots=64, stripes=8)
+    for _ in range(times):
+        table.increment(_event())
+
+
+class TestSharedCounterTable:
+    """ Test the shared memory counters """
+
+    def test_increment_and_drain(self, tmp_path):
+        table = SharedCounterTable(str(tmp_path / 'counters'), slots=64, stripes=8)
+        for _ in range(5):
+            assert table.increment(_event())
+        assert table.increment(_event(object_id='dataset-2'))
+
+        events = sorted(table.drain(), key=lambda event: event['object_id'])
+        assert len(events) == 2
+        assert events[0]['object_id'] == 'dataset-1'
+        assert events[0]['count'] == 5
+        assert events[0]['token_name'] == 'token-1'
+        assert events[0]['extras'] == {'method': 'GET'}
+        assert events[0]['timestamp'] <= events[0]['last_timestamp']
+        assert events[1]['count'] == 1
+
+        # drain resets the table
+        assert table.drain() == []
+
+    def test_latency_buckets_are_counted_apart(self, tmp_path):
+        """ Slots keep the total duration, a slow request is not averaged with the fast ones """
+        table = SharedCounterTable(str(tmp_path / 'counters'), slots=64, stripes=8)
+        table.increment(_event(duration_ms=2000))
+        for _ in range(9):
+            table.increment(_event(duration_ms=10))
+
+        events = sorted(table.drain(), key=lambda event: event['duration_ms'])
+        assert [(event['count'], event['duration_ms']) for event in events] == [(9, 90), (1, 2000)]
+        assert all('_latency_bucket' not in event for event in events)
+
+    def test_shared_between_processes(self, tmp_path):
+        path = str(tmp_path / 'counters')
+        table = SharedCounterTable(path, slots=64, stripes=8)
+        ctx = multiprocessing.get_context('fork')
+        workers = [ctx.Process(target=_increment_many, args=(path, 50)) for _ in range(4)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        events = table.drain()
+        assert len(events) == 1
+        assert events[0]['count'] == 200
+
+    def test_full_table(self, tmp_path):
+        table = SharedCounterTable(str(tmp_path / 'counters'), slots=8, stripes=8)
+        results = [table.increment(_event(object_id=f'dataset-{n}')) for n in range(50)]
+        # One slot per stripe, some events must be rejected
+        assert not all(results)
+        assert len(table.drain()) == results.count(True)
+
+    def test_drain_if_due(self, tmp_path):
+        table = SharedCounterTable(str(tmp_path / 'counters'), slots=64, stripes=8)
+        table.increment(_event())
+        assert table.drain_if_due(interval=3600) is None
+        events = table.drain_if_due(interval=0)
+        assert len(events) == 1
+        assert not table.flush_due(interval=3600)
+
+    def test_drain_if_due_single_thread(self, tmp_path):
+        """ File locks are per process, other threads of the worker must not drain at the same time """
+        table = SharedCounterTable(str(tmp_path / 'counters'), slots=64, stripes=8)
+        table.increment(_event())
+        with table._flusher_thread_lock:
+            assert table.drain_if_due(interval=0) is None
+        assert len(table.drain_if_due(interval=0)) == 1
+
+    def test_different_configuration(self, tmp_path):
+        path = str(tmp_path / 'counters')
+        SharedCounterTable(path, slots=64, stripes=8)
+        try:
+            SharedCounterTable(path, slots=128, stripes=8)
+        except ValueError:
+            pass
+        else:
+            assert False, 'Expected a configuration error'
+
+    def test_restore(self, tmp_path):
+        """ Drained events not saved are counted again with their first and last timestamps """
+        table = SharedCounterTable(str(tmp_path / 'counters'), slots=64, stripes=8)
+        table.increment(_event(duration_ms=10), now=1000)
+        table.increment(_event(duration_ms=10), now=1060)
+        events = table.drain()
+        table.increment(_event(duration_ms=10), now=1100)
+        assert table.restore(events) == []
+
+        events = table.drain()
+        assert len(events) == 1
+        assert events[0]['count'] == 3
+        assert events[0]['duration_ms'] == 30
+        assert events[0]['timestamp'].timestamp() == 1000
+        assert events[0]['last_timestamp'].timestamp() == 1100
+
+    def test_reopen_after_fork_closes_the_inherited_file(self, tmp_path):
+        table = SharedCounterTable(str(tmp_path / 'counters'), slots=64, stripes=8)
+        inherited = table._mmap
+        # As in a forked worker
+        table._pid = -1
+        assert table.increment(_event())
+        assert inherited.closed
+        assert not table._mmap.closed
+        assert len(table.drain()) == 1
+
+
+class TestFlushSharedCounters:
+    """ Test the shared counters are saved by the flush, never in the request """
+
+    def test_request_only_increments(self, tmp_path):
+        table = SharedCounterTable(str(tmp_path / 'counters'), slots=64, stripes=8)
+        with mock.patch.object(persistence, 'get_sender', return_value=None), \
+                mock.patch.object(persistence, 'get_shared_counters', return_value=table), \
+                mock.patch.object(persistence, 'start_flush_thread') as start_flush_thread, \
+                mock.patch.object(persistence, '_save_events') as save_events:
+            assert persistence._save_tracking_usage(_event()) == []
+        assert start_flush_thread.called
+        assert not save_events.called
+        assert len(table.drain()) == 1
+
+    def test_failed_save_keeps_the_counters(self, tmp_path):
+        table = SharedCounterTable(str(tmp_path / 'counters'), slots=64, stripes=8)
+        for n in range(3):
+            table.increment(_event(object_id=f'dataset-{n}'))
+        saved = []
+
+        def tracking_usage_create(context, data_dict):
+            if len(saved) == 1:
+                raise RuntimeError('database is down')
+            saved.append(data_dict['object_id'])
+            return data_dict
+
+        with mock.patch.object(persistence, 'get_shared_counters', return_value=table), \
+                mock.patch.object(persistence, 'model'), \
+                mock.patch.object(persistence.toolkit, 'get_action', return_value=tracking_usage_create):
+            with pytest.raises(RuntimeError):
+                persistence.flush_shared_counters(force=True)
+
+        remaining = sorted(event['object_id'] for event in table.drain())
+        assert len(saved) == 1
+        assert remaining == sorted({'dataset-0', 'dataset-1', 'dataset-2'} - set(saved))
@@ -226,3 +226,50 @@ class TestTrackingUsageBasic:
         tracking_records = model.Session.query(TrackingUsage).all()
         # Should have at least the tracking records we expect
         assert len(tracking_records) == 2
+
+    def test_status_and_bytes(self, app):
+        """ The response status and size are saved """
+        user_with_token = factories.UserWithToken()
+        dataset = factories.Dataset()
+        url = url_for("api.action", ver=3, logic_function="package_show", id=dataset["id"])
+        auth = {"Authorization": user_with_token['token']}
+        response = app.get(url, headers=auth)
+        assert response.status_code == 200
+        tu = model.Session.query(TrackingUsage).order_by(TrackingUsage.timestamp.desc()).first()
+        assert tu.status_code == 200
+        assert tu.response_bytes == len(response.data)
+
+    def test_errors_tracked_by_default(self, app):
+        user_with_token = factories.UserWithToken()
+        url = url_for("api.action", ver=3, logic_function="package_show", id="missing-dataset")
+        auth = {"Authorization": user_with_token['token']}
+        app.get(url, headers=auth, status=404)
+        tu = model.Session.query(TrackingUsage).order_by(TrackingUsage.timestamp.desc()).first()
+        assert tu.status_code == 404
+
+    @pytest.mark.ckan_config("ckanext.api_tracking.skip_errors", "true")
+    def test_skip_errors(self, app):
+        user_with_token = factories.UserWithToken()
+        url = url_for("api.action", ver=3, logic_function="package_show", id="missing-dataset")
+        auth = {"Authorization": user_with_token['token']}
+        app.get(url, headers=auth, status=404)
+        assert model.Session.query(TrackingUsage).count() == 0
+
+    def test_owners_saved(self, app):
+        """ The dataset and organization of the object are saved in each row """
+        user_with_token = factories.UserWithToken()
+        org = factories.Organization()
+        dataset = factories.Dataset(owner_org=org["id"])
+        resource = factories.Resource(package_id=dataset["id"])
+        auth = {"Authorization": user_with_token['token']}
+        url = url_for("api.action", ver=3, logic_function="resource_show", id=resource["id"])
+        app.get(url, headers=auth, status=200)
+        tu = model.Session.query(TrackingUsage).order_by(TrackingUsage.timestamp.desc()).first()
+        assert tu.package_id == dataset["id"]
+        assert tu.owner_org == org["id"]
+
+        url = url_for("api.action", ver=3, logic_function="package_show", id=dataset["name"])
+        app.get(url, headers=auth, status=200)
+        tu = model.Session.query(TrackingUsage).order_by(TrackingUsage.timestamp.desc()).first()
+        assert tu.package_id == dataset["id"]
+        assert tu.owner_org == org["id"]
@@ -0,0 +1,58 @@
+import pytest
+from ckan.tests import factories
+
+from ckanext.api_tracking.queries.api import get_most_accessed_dataset_with_token, get_most_accessed_token
+from ckanext.api_tracking.queries.views import (
+    TOKEN_USAGE_BY_OBJECT,
+    TOKEN_USAGE_BY_TOKEN,
+    VIEWS,
+    get_freshness,
+    refresh_view,
+    refresh_views,
+    view_ready,
+)
+from ckanext.api_tracking.tests import factories as tf
+
+
+class TestViewPeriods:
+    """ Only the pre-computed periods are read from the views """
+
+    def test_unknown_period(self):
+        assert not view_ready('tracking_unique_dataset_views_mv', days_ago=90)
+
+    def test_unknown_view(self):
+        with pytest.raises(ValueError):
+            refresh_view('tracking_usage')
+
+
+@pytest.mark.usefixtures('clean_db')
+@pytest.mark.ckan_config('ckanext.api_tracking.materialized_views', 'true')
+class TestMaterializedViews:
+    """ Test the views are refreshed and used """
+
+    def test_refresh_and_read(self):
+        user = factories.UserWithToken()
+        dataset = factories.Dataset()
+        for _ in range(3):
+            tf.TrackingUsageAPIDataset(user=user, object_id=dataset['id'])
+
+        # Not refreshed yet, we read the tracking table
+        assert get_freshness(TOKEN_USAGE_BY_OBJECT) is None
+        live = get_most_accessed_dataset_with_token()
+
+        # The first refresh fills the view, the next ones are concurrent
+        refresh_views()
+        assert refresh_view(TOKEN_USAGE_BY_OBJECT)[1] is True
+        for name in VIEWS:
+            assert get_freshness(name) is not None
+        assert view_ready(TOKEN_USAGE_BY_TOKEN)
+
+        from_view = get_most_accessed_dataset_with_token()
+        assert [tuple(row) for row in from_view] == [tuple(row) for row in live]
+        assert from_view[0]['total'] == 3
+        assert get_most_accessed_token()[0]['total'] == 3
+
+    @pytest.mark.ckan_config('ckanext.api_tracking.materialized_views', 'false')
+    def test_disabled(self):
+        refresh_views([TOKEN_USAGE_BY_OBJECT])
+        assert get_freshness(TOKEN_USAGE_BY_OBJECT) is None